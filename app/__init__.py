@@ -1,8 +1,7 @@
 import logging
 import os
 import json
-from contextlib import suppress
-from hashlib import sha1
+import tempfile
 
 import PyPDF2
 import binascii
@@ -14,14 +13,35 @@ from flask_httpauth import HTTPTokenAuth
 from notifications_utils import logging as utils_logging
 from notifications_utils.clients.statsd.statsd_client import StatsdClient
 from notifications_utils.clients.encryption.encryption_client import Encryption
-from notifications_utils.s3 import s3upload, s3download, S3ObjectNotFound
 
+from app.cache import PreviewCache
+from app.ghostscript_pool import GhostscriptPool
+from app.logos import LogoCache
+from app.prefetch import Prefetcher
+from app.timing import init_stage_timing
 from app.celery.celery import NotifyCelery
 
 
 notify_celery = NotifyCelery()
 
 
+def check_preview_rasterisers(config):
+    """
+    Fails when the app starts, rather than on every preview, if a preview rasteriser is set to one that doesn't exist.
+    Unless one of them is used, app.rasterisers isn't imported, so fitz and poppler aren't loaded.
+    """
+    for name in ('TEMPLATED_PREVIEW_RASTERISER', 'PRECOMPILED_PREVIEW_RASTERISER'):
+        if config[name] == 'wand':
+            continue
+
+        from app.rasterisers import RASTERISERS
+
+        if config[name] not in RASTERISERS:
+            raise ValueError('{} must be wand or one of {}, not {}'.format(
+                name, ', '.join(sorted(RASTERISERS)), config[name]
+            ))
+
+
 def load_config(application):
     application.config['AWS_REGION'] = 'eu-west-1'
     application.config['TEMPLATE_PREVIEW_INTERNAL_SECRETS'] = json.loads(
@@ -56,6 +76,57 @@ def load_config(application):
 
     application.config['EXPIRE_CACHE_IN_SECONDS'] = 600
 
+    # local tiers in front of the S3 preview cache, both are off unless they're given a size
+    application.config['LOCAL_CACHE_MEMORY_LIMIT_BYTES'] = int(os.environ.get('LOCAL_CACHE_MEMORY_LIMIT_BYTES', 0))
+    application.config['LOCAL_CACHE_DISK_PATH'] = os.environ.get('LOCAL_CACHE_DISK_PATH')
+    application.config['LOCAL_CACHE_DISK_LIMIT_BYTES'] = int(os.environ.get('LOCAL_CACHE_DISK_LIMIT_BYTES', 0))
+
+    # processes on the same host take a lock per cache key so only one of them renders a letter that isn't cached
+    application.config['CACHE_LOCK_DIRECTORY'] = os.environ.get(
+        'CACHE_LOCK_DIRECTORY', os.path.join(tempfile.gettempdir(), 'template-preview-locks')
+    )
+    application.config['CACHE_LOCK_TIMEOUT_SECONDS'] = 60
+
+    # what renders preview pngs: wand (ImageMagick and Ghostscript), fitz (PyMuPDF) or pdf2image (poppler)
+    application.config['TEMPLATED_PREVIEW_RASTERISER'] = os.environ.get('TEMPLATED_PREVIEW_RASTERISER', 'wand')
+    application.config['PRECOMPILED_PREVIEW_RASTERISER'] = os.environ.get('PRECOMPILED_PREVIEW_RASTERISER', 'wand')
+    check_preview_rasterisers(application.config)
+
+    # after sending one page of a preview, render the rest of the letter's pages in the background
+    application.config['PREVIEW_PREFETCH'] = os.environ.get('PREVIEW_PREFETCH') == '1'
+    application.config['PREVIEW_PREFETCH_CONCURRENCY'] = 1
+
+    # how long urls given to clients with ?redirect=true last for
+    application.config['CACHE_PRESIGNED_URL_EXPIRY_SECONDS'] = 60
+
+    # upload to the S3 preview cache in the background, after the response has been sent
+    application.config['CACHE_WRITE_BEHIND'] = os.environ.get('CACHE_WRITE_BEHIND') == '1'
+    application.config['CACHE_WRITE_BEHIND_QUEUE_SIZE'] = 50
+    application.config['CACHE_WRITE_BEHIND_THREAD_COUNT'] = 2
+    application.config['CACHE_WRITE_BEHIND_FLUSH_TIMEOUT_SECONDS'] = 30
+
+    # cap how many requests each pool of expensive endpoints runs at once, across every process on the host
+    application.config['ADMISSION_CONTROL'] = os.environ.get('ADMISSION_CONTROL') == '1'
+    application.config['ADMISSION_CONTROL_DIRECTORY'] = os.environ.get(
+        'ADMISSION_CONTROL_DIRECTORY', os.path.join(tempfile.gettempdir(), 'template-preview-admission')
+    )
+    application.config['ADMISSION_CONTROL_LIMITS'] = {
+        'sanitise': 2,
+        'print': 2,
+        'preview': 3,
+    }
+    application.config['ADMISSION_CONTROL_BYTES_PER_SLOT'] = 5 * 1024 * 1024
+    application.config['ADMISSION_CONTROL_MAX_WAITING'] = 2
+    application.config['ADMISSION_CONTROL_WAIT_SECONDS'] = 10
+    application.config['ADMISSION_CONTROL_RETRY_AFTER_SECONDS'] = 5
+
+    # run CMYK conversion and font embedding through long-lived ghostscript workers rather than a new `gs` each time
+    application.config['GHOSTSCRIPT_POOL'] = os.environ.get('GHOSTSCRIPT_POOL') == '1'
+    application.config['GHOSTSCRIPT_POOL_SIZE'] = int(os.environ.get('GHOSTSCRIPT_POOL_SIZE', 2))
+    application.config['GHOSTSCRIPT_WORKER_MAX_JOBS'] = int(os.environ.get('GHOSTSCRIPT_WORKER_MAX_JOBS', 200))
+    application.config['GHOSTSCRIPT_WORKER_MAX_RSS_MB'] = int(os.environ.get('GHOSTSCRIPT_WORKER_MAX_RSS_MB', 500))
+    application.config['GHOSTSCRIPT_JOB_TIMEOUT_SECONDS'] = 60
+
     if os.environ['STATSD_ENABLED'] == "1":
         application.config['STATSD_ENABLED'] = True
         application.config['STATSD_HOST'] = os.environ['STATSD_HOST']
@@ -100,22 +171,34 @@ def load_config(application):
         'production': 'notifications.service.gov.uk'
     }[application.config['NOTIFY_ENVIRONMENT']])
 
+    application.config['LETTER_LOGO_CACHE_TTL_SECONDS'] = int(os.environ.get('LETTER_LOGO_CACHE_TTL_SECONDS', 3600))
+    application.config['LETTER_LOGO_CACHE_DISK_PATH'] = os.environ.get('LETTER_LOGO_CACHE_DISK_PATH')
+    # serve logos from a directory rather than LETTER_LOGO_URL, for rendering letters without the network
+    application.config['LETTER_LOGO_LOCAL_DIRECTORY'] = os.environ.get('LETTER_LOGO_LOCAL_DIRECTORY')
+
 
-def create_app():
+def create_app(register_blueprints=True):
+    """
+    :param bool register_blueprints: False for Celery, which doesn't serve any endpoints, so it doesn't import
+        everything the previews need
+    """
     application = Flask(__name__)
 
     init_app(application)
+    init_stage_timing(application)
 
     load_config(application)
 
     notify_celery.init_app(application)
 
-    from app.preview import preview_blueprint
-    from app.status import status_blueprint
-    from app.precompiled import precompiled_blueprint
-    application.register_blueprint(status_blueprint)
-    application.register_blueprint(preview_blueprint)
-    application.register_blueprint(precompiled_blueprint)
+    from app.admission import AdmissionController
+    if register_blueprints:
+        from app.preview import preview_blueprint
+        from app.status import status_blueprint
+        from app.precompiled import precompiled_blueprint
+        application.register_blueprint(status_blueprint)
+        application.register_blueprint(preview_blueprint)
+        application.register_blueprint(precompiled_blueprint)
 
     application.statsd_client = StatsdClient()
     application.statsd_client.init_app(application)
@@ -131,7 +214,11 @@ def create_app():
             return weasyprint_logs.log(logging.ERROR, msg, *args, **kwargs)
     weasyprint_logs.error = evil_error
 
-    application.cache = init_cache(application)
+    application.cache = PreviewCache(application)
+    application.logo_cache = LogoCache(application)
+    application.prefetcher = Prefetcher(application)
+    application.ghostscript_pool = GhostscriptPool(application)
+    application.admission = AdmissionController(application)
 
     @auth.verify_token
     def verify_token(token):
@@ -143,45 +230,6 @@ def create_app():
 auth = HTTPTokenAuth(scheme='Token')
 
 
-def init_cache(application):
-
-    def cache(*args, folder=None, extension='file'):
-
-        cache_key = '{}/{}.{}'.format(
-            folder,
-            sha1(''.join(str(arg) for arg in args).encode('utf-8')).hexdigest(),
-            extension,
-        )
-
-        def wrapper(original_function):
-
-            def new_function():
-
-                with suppress(S3ObjectNotFound):
-                    return s3download(
-                        application.config['LETTER_CACHE_BUCKET_NAME'],
-                        cache_key,
-                    )
-
-                data = original_function()
-
-                s3upload(
-                    data,
-                    application.config['AWS_REGION'],
-                    application.config['LETTER_CACHE_BUCKET_NAME'],
-                    cache_key,
-                )
-
-                data.seek(0)
-                return data
-
-            return new_function
-
-        return wrapper
-
-    return cache
-
-
 def init_app(app):
     @app.errorhandler(InvalidRequest)
     def invalid_request(error):
@@ -202,6 +250,14 @@ def init_app(app):
             # error.code is set for our exception types.
             return jsonify(result='error', message=str(error)), 500
 
+    @app.errorhandler(AdmissionRejected)
+    def admission_rejected(error):
+        return (
+            jsonify(result='error', message=error.message),
+            error.code,
+            {'Retry-After': str(error.retry_after)},
+        )
+
     @app.errorhandler(404)
     def page_not_found(e):
         msg = e.description or "Not found"
@@ -234,6 +290,13 @@ class ValidationFailed(Exception):
         self.page_count = page_count
 
 
+class AdmissionRejected(Exception):
+    def __init__(self, pool, retry_after, code=503):
+        self.message = 'Too many requests to {} endpoints'.format(pool)
+        self.retry_after = retry_after
+        self.code = code
+
+
 class QueueNames:
     LETTERS = 'letter-tasks'
     SANITISE_LETTERS = 'sanitise-letter-tasks'
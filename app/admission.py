@@ -0,0 +1,166 @@
+import fcntl
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, request
+
+from app import AdmissionRejected
+
+
+class AdmissionController:
+    """
+    Limits how many requests to each pool of expensive endpoints can run at once across every process on the host, so
+    a burst of big letters can't take every gunicorn worker.
+
+    A pool has ADMISSION_CONTROL_LIMITS slots, each one a lock file. A request takes one slot, or one more for every
+    ADMISSION_CONTROL_BYTES_PER_SLOT of its body. If there aren't enough free slots, up to ADMISSION_CONTROL_MAX_WAITING
+    requests wait for ADMISSION_CONTROL_WAIT_SECONDS for them. Anything else is rejected straight away, with a
+    Retry-After, so the client can back off rather than hold a connection open.
+
+    Waiting requests are admitted in the order they arrived. Only the request at the front of the queue can take slots,
+    and a request that arrives while others are waiting joins the back, so a request that needs every slot isn't
+    overtaken by smaller ones forever.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    def _path(self, filename):
+        directory = self.application.config['ADMISSION_CONTROL_DIRECTORY']
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, filename)
+
+    def _lock_path(self, pool, kind, index):
+        return self._path('{}.{}.{}.lock'.format(pool, kind, index))
+
+    def _try_lock(self, path):
+        lock_file = os.open(path, os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_file)
+            return None
+        return lock_file
+
+    @staticmethod
+    def _release(lock_files):
+        for lock_file in lock_files:
+            # closing the file releases the lock
+            os.close(lock_file)
+
+    def _take_slots(self, pool, slot_count, cost):
+        """
+        :return list: the lock files of the slots, or None if there weren't `cost` of them free
+        """
+        taken = []
+        for index in range(slot_count):
+            lock_file = self._try_lock(self._lock_path(pool, 'slot', index))
+            if lock_file is not None:
+                taken.append(lock_file)
+                if len(taken) == cost:
+                    return taken
+        self._release(taken)
+        return None
+
+    def _is_still_waiting(self, place):
+        _, pid, joined_at = place
+        # nothing waits this long unless its worker was killed while it was waiting
+        if time.time() - joined_at > 2 * self.application.config['ADMISSION_CONTROL_WAIT_SECONDS']:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @contextmanager
+    def _locked_queue(self, pool):
+        """
+        Holds the lock on `pool`'s queue, a json list of the places of the requests waiting for slots in the order they
+        arrived, and saves any changes made to it. Places left behind by workers that have gone are dropped.
+        """
+        with os.fdopen(os.open(self._path('{}.queue'.format(pool)), os.O_CREAT | os.O_RDWR), 'r+') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            contents = f.read()
+            waiting = [place for place in json.loads(contents or '[]') if self._is_still_waiting(place)]
+            yield waiting
+            f.seek(0)
+            f.truncate()
+            json.dump(waiting, f)
+
+    def _reject(self, pool, reason):
+        self.application.statsd_client.incr('admission.{}.rejected.{}'.format(pool, reason))
+        self.application.logger.warning('Rejected request to {} pool: {}'.format(pool, reason))
+        raise AdmissionRejected(pool, self.application.config['ADMISSION_CONTROL_RETRY_AFTER_SECONDS'])
+
+    def _wait_in_queue(self, pool, place, slot_count, cost):
+        """
+        :return list: the lock files of the slots, once `place` is at the front of the queue and they're free
+        """
+        start = time.monotonic()
+        deadline = start + self.application.config['ADMISSION_CONTROL_WAIT_SECONDS']
+        slots = None
+        try:
+            while slots is None:
+                if time.monotonic() > deadline:
+                    self._reject(pool, 'timed-out')
+                time.sleep(0.05)
+                with self._locked_queue(pool) as waiting:
+                    if waiting and waiting[0] == place:
+                        slots = self._take_slots(pool, slot_count, cost)
+        finally:
+            with self._locked_queue(pool) as waiting:
+                if place in waiting:
+                    waiting.remove(place)
+                queue_depth = len(waiting)
+            self.application.statsd_client.gauge('admission.{}.queue-depth'.format(pool), queue_depth)
+
+        self.application.statsd_client.timing('admission.{}.wait-time'.format(pool), time.monotonic() - start)
+        return slots
+
+    @contextmanager
+    def admit(self, pool, content_length=0):
+        slot_count = self.application.config['ADMISSION_CONTROL_LIMITS'][pool]
+        cost = min(slot_count, 1 + content_length // self.application.config['ADMISSION_CONTROL_BYTES_PER_SLOT'])
+
+        place = None
+        with self._locked_queue(pool) as waiting:
+            # anyone already waiting gets the slots first
+            slots = None if waiting else self._take_slots(pool, slot_count, cost)
+            if slots is None and len(waiting) < self.application.config['ADMISSION_CONTROL_MAX_WAITING']:
+                place = [uuid.uuid4().hex, os.getpid(), time.time()]
+                waiting.append(place)
+            queue_depth = len(waiting)
+
+        if slots is None:
+            self.application.statsd_client.gauge('admission.{}.queue-depth'.format(pool), queue_depth)
+            if place is None:
+                self._reject(pool, 'queue-full')
+            slots = self._wait_in_queue(pool, place, slot_count, cost)
+
+        self.application.statsd_client.incr('admission.{}.admitted'.format(pool))
+        try:
+            yield
+        finally:
+            self._release(slots)
+
+
+def admission_control(pool):
+    """
+    Runs the view only once `current_app.admission` has admitted it to `pool`, if ADMISSION_CONTROL is on
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not current_app.config['ADMISSION_CONTROL']:
+                return view(*args, **kwargs)
+            with current_app.admission.admit(pool, request.content_length or 0):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,564 @@
+import atexit
+import fcntl
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager, suppress
+from hashlib import sha1
+from io import BytesIO
+
+import boto3
+from botocore.exceptions import ClientError as BotoClientError
+from flask import g
+from notifications_utils.s3 import S3ObjectNotFound
+
+from app.timing import stage
+
+_boto3_sessions = threading.local()
+
+
+def boto3_session():
+    """
+    boto3's default session isn't safe to make clients and resources from on several threads at once, and the cache
+    is used from request threads, prefetch threads and the write-behind uploader's threads together. So each thread
+    gets a session of its own, made the first time it's needed. A forked process makes new ones.
+    """
+    if getattr(_boto3_sessions, 'pid', None) != os.getpid():
+        _boto3_sessions.session = boto3.session.Session()
+        _boto3_sessions.pid = os.getpid()
+    return _boto3_sessions.session
+
+
+def s3download(bucket_name, filename):
+    """
+    Like notifications_utils.s3.s3download, with this thread's session
+
+    :return: the object's body, which can be streamed
+    """
+    try:
+        return boto3_session().resource('s3').Object(bucket_name, filename).get()['Body']
+    except BotoClientError as error:
+        raise S3ObjectNotFound(error.response, error.operation_name)
+
+
+def s3upload(filedata, region, bucket_name, file_location):
+    """
+    Like notifications_utils.s3.s3upload, with this thread's session
+    """
+    boto3_session().resource('s3', region_name=region).Object(bucket_name, file_location).put(
+        Body=filedata,
+        ServerSideEncryption='AES256',
+        ContentType='binary/octet-stream',
+    )
+
+
+class MemoryCacheTier:
+    """
+    A least recently used cache of bytes, private to this process, that holds at most `max_bytes` of data.
+    """
+    name = 'memory'
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cache_key):
+        with self._lock:
+            data = self._items.get(cache_key)
+            if data is not None:
+                self._items.move_to_end(cache_key)
+            return data
+
+    def set(self, cache_key, data):
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            old_data = self._items.pop(cache_key, None)
+            if old_data is not None:
+                self.size -= len(old_data)
+
+            self._items[cache_key] = data
+            self.size += len(data)
+
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+class DiskCacheTier:
+    """
+    A cache of files under `path` that holds at most `max_bytes` of data. It's shared by every process on the host
+    that points at the same directory, so files are written atomically and the least recently read files are evicted
+    first.
+
+    Each process keeps a count of how much is in the directory, and only looks through it to evict files once the
+    count goes over `max_bytes`. The count is corrected every time it looks, but it doesn't see what other processes
+    have written since, so the directory can go over `max_bytes` by that much until one of them next evicts.
+    """
+    name = 'disk'
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+        self.size = sum(file_size for _, file_size, _ in self._files())
+
+    def _path_for(self, cache_key):
+        return os.path.join(self.path, *cache_key.split('/'))
+
+    def _files(self):
+        """
+        :return list: the modified time, size and path of every file in the cache
+        """
+        files = []
+        for directory, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(directory, filename)
+                with suppress(FileNotFoundError):
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def get(self, cache_key):
+        path = self._path_for(cache_key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        # the modified time is used to decide what to evict, so touching the file marks it as recently used
+        with suppress(FileNotFoundError):
+            os.utime(path)
+        return data
+
+    def set(self, cache_key, data):
+        if len(data) > self.max_bytes:
+            return
+
+        path = self._path_for(cache_key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temporary file and move it into place, so other processes never read a half written file
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as f:
+                f.write(data)
+            # if this replaces a file that's already there, that file's size no longer counts
+            old_size = 0
+            with suppress(FileNotFoundError):
+                old_size = os.stat(path).st_size
+            os.replace(temporary_path, path)
+        except Exception:
+            with suppress(FileNotFoundError):
+                os.remove(temporary_path)
+            raise
+
+        self.size += len(data) - old_size
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        files = self._files()
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in sorted(files):
+            if size <= self.max_bytes:
+                break
+            # another process may have evicted it already
+            with suppress(FileNotFoundError):
+                os.remove(path)
+            size -= file_size
+        self.size = size
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+        self.size = 0
+
+
+# cache keys are hashed onto a fixed number of lock files, so the lock directory doesn't grow forever
+LOCK_STRIPES = 1024
+
+_held_lock_paths = threading.local()
+
+
+@contextmanager
+def single_flight_lock(directory, cache_key, timeout):
+    """
+    Holds an exclusive lock for `cache_key` that's shared by every process on the host. Only one process renders a
+    letter at a time, the others wait for it and then read its result from the cache.
+
+    If the lock can't be taken within `timeout` seconds we carry on without it, rather than fail the request.
+
+    Each kind of file, by its folder and file extension, has its own lock files. Making one kind of file only ever
+    makes other kinds inside it, and always in the same order (a request-keyed file, then an image, then a pdf). So a
+    process holding the lock for one file never waits on a lock file that another process holds while waiting on it.
+
+    :return: a context manager giving True if another process held the lock and we had to wait for it
+    """
+    folder = cache_key.split('/')[0]
+    extension = cache_key.rsplit('.', 1)[-1]
+    stripe = int(sha1(cache_key.encode('utf-8')).hexdigest(), 16) % LOCK_STRIPES
+    lock_path = os.path.join(directory, '{}.{}.{}.lock'.format(folder, extension, stripe))
+
+    # keys of the same kind can hash to a lock file this thread already holds
+    if not hasattr(_held_lock_paths, 'paths'):
+        _held_lock_paths.paths = set()
+    held_lock_paths = _held_lock_paths.paths
+    if lock_path in held_lock_paths:
+        yield False
+        return
+
+    os.makedirs(directory, exist_ok=True)
+    lock_file = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+
+    try:
+        held_lock_paths.add(lock_path)
+        waited = False
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                waited = True
+                if time.monotonic() > deadline:
+                    break
+                time.sleep(0.05)
+
+        yield waited
+    finally:
+        held_lock_paths.discard(lock_path)
+        # closing the file releases the lock, if we got it
+        os.close(lock_file)
+
+
+class BackgroundUploader:
+    """
+    Uploads to S3 from a bounded queue on background threads, so a request doesn't wait for the upload.
+
+    The threads are started by the first upload in each process, so forked workers get threads of their own. If the
+    queue is full the upload is dropped rather than making the request wait: the letter will just be rendered again
+    next time it's asked for.
+    """
+
+    def __init__(self, application, queue_size, thread_count):
+        self.application = application
+        self.queue_size = queue_size
+        self.thread_count = thread_count
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            for _ in range(self.thread_count):
+                threading.Thread(target=self._upload_forever, daemon=True).start()
+            self._pid = os.getpid()
+            atexit.register(self.flush)
+
+    def _upload_forever(self):
+        upload_queue = self._queue
+        while True:
+            cache_key, data = upload_queue.get()
+            try:
+                s3upload(
+                    BytesIO(data),
+                    self.application.config['AWS_REGION'],
+                    self.application.config['LETTER_CACHE_BUCKET_NAME'],
+                    cache_key,
+                )
+                self.application.statsd_client.incr('cache.write-behind.uploaded')
+            except Exception:
+                self.application.statsd_client.incr('cache.write-behind.failed')
+                self.application.logger.exception('Failed to upload {} to the preview cache'.format(cache_key))
+            finally:
+                upload_queue.task_done()
+
+    def upload(self, cache_key, data):
+        """
+        :param bytes data: the data to upload
+        :return bool: False if the queue was full and the upload was dropped
+        """
+        if self._pid != os.getpid():
+            self._start()
+
+        try:
+            self._queue.put_nowait((cache_key, data))
+        except queue.Full:
+            self.application.statsd_client.incr('cache.write-behind.dropped')
+            return False
+
+        self.application.statsd_client.incr('cache.write-behind.queued')
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Waits for queued uploads to finish, for at most `timeout` seconds.
+
+        :return bool: True if every queued upload finished
+        """
+        if self._pid != os.getpid():
+            return True
+
+        timeout = self.application.config['CACHE_WRITE_BEHIND_FLUSH_TIMEOUT_SECONDS'] if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        # Queue.join can't time out, so poll the count of unfinished uploads instead
+        while self._queue.unfinished_tasks:
+            if time.monotonic() > deadline:
+                self.application.logger.warning(
+                    'Gave up waiting for {} uploads to the preview cache'.format(self._queue.unfinished_tasks)
+                )
+                return False
+            time.sleep(0.05)
+        return True
+
+
+class TierFillingStream:
+    """
+    Wraps a file-like being streamed from S3, so it can still be streamed to the client rather than read into memory
+    first. What's read is kept as it passes through, and once the end is reached it's given to `fill`. Anything bigger
+    than `max_bytes` isn't kept, and nor is anything that isn't read to the end.
+    """
+
+    def __init__(self, stream, max_bytes, fill):
+        self._stream = stream
+        self._max_bytes = max_bytes
+        self._fill = fill
+        self._chunks = []
+        self._size = 0
+
+    def read(self, size=-1):
+        whole = size is None or size < 0
+        chunk = self._stream.read() if whole else self._stream.read(size)
+        if self._chunks is None:
+            return chunk
+
+        self._size += len(chunk)
+        if self._size > self._max_bytes:
+            self._chunks = None
+        elif chunk and not whole:
+            self._chunks.append(chunk)
+        else:
+            self._chunks.append(chunk)
+            self._fill(b''.join(self._chunks))
+            self._chunks = None
+        return chunk
+
+    def close(self):
+        self._chunks = None
+        if hasattr(self._stream, 'close'):
+            self._stream.close()
+
+
+class PreviewCache:
+    """
+    Caches rendered letters. Lookups go through an in-process memory tier and a disk tier shared by every process on
+    the host (if they're configured) before falling back to the LETTER_CACHE_BUCKET_NAME bucket in S3. Hits from a
+    slower tier are copied into the faster ones.
+
+    Use as a decorator on a function that returns a file-like:
+
+        @current_app.cache(html, folder='templated', extension='pdf')
+        def _get():
+            return BytesIO(render(html))
+
+    On a miss only one process on the host calls the function for a given key, others asking for the same key wait
+    for it to finish and then read what it cached.
+
+    If CACHE_WRITE_BEHIND is set, uploads to S3 happen in the background after the response has been sent. Call
+    `flush` before the process exits so they aren't lost. Anything cached with `write_behind=True` is always uploaded
+    in the background.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.stats = Counter()
+
+        self.local_tiers = []
+        if application.config['LOCAL_CACHE_MEMORY_LIMIT_BYTES']:
+            self.local_tiers.append(MemoryCacheTier(application.config['LOCAL_CACHE_MEMORY_LIMIT_BYTES']))
+        if application.config['LOCAL_CACHE_DISK_PATH'] and application.config['LOCAL_CACHE_DISK_LIMIT_BYTES']:
+            self.local_tiers.append(DiskCacheTier(
+                application.config['LOCAL_CACHE_DISK_PATH'],
+                application.config['LOCAL_CACHE_DISK_LIMIT_BYTES'],
+            ))
+
+        self.write_behind = application.config['CACHE_WRITE_BEHIND']
+        # its threads aren't started until something is written behind
+        self.uploader = BackgroundUploader(
+            application,
+            application.config['CACHE_WRITE_BEHIND_QUEUE_SIZE'],
+            application.config['CACHE_WRITE_BEHIND_THREAD_COUNT'],
+        )
+
+    def __call__(self, *args, folder=None, extension='file', write_behind=False):
+        """
+        :param bool write_behind: upload to S3 in the background even if CACHE_WRITE_BEHIND isn't set. For copies of
+            something that's cached under another key too, so nothing is lost if the upload is dropped
+        """
+
+        cache_key = self.key(*args, folder=folder, extension=extension)
+
+        def wrapper(original_function):
+
+            def new_function():
+
+                data = self.get(cache_key)
+                if data is not None:
+                    return data
+
+                with self.single_flight_lock(cache_key) as waited:
+                    if waited:
+                        # whoever we waited for has probably cached it by now
+                        data = self.get(cache_key)
+                        if data is not None:
+                            return data
+
+                    data = original_function()
+                    # so the request can tell it made something, rather than finding everything in the cache
+                    g.cache_missed = True
+
+                    self.set(cache_key, data, write_behind=write_behind)
+
+                data.seek(0)
+                return data
+
+            return new_function
+
+        return wrapper
+
+    @staticmethod
+    def key(*args, folder=None, extension='file'):
+        """
+        Bytes are hashed as they are, anything else as the utf-8 encoding of its string. Each arg is fed to the hash
+        separately so we never build one big string out of all of them.
+        """
+        digest = sha1()
+        for arg in args:
+            digest.update(arg if isinstance(arg, bytes) else str(arg).encode('utf-8'))
+        return '{}/{}.{}'.format(folder, digest.hexdigest(), extension)
+
+    @contextmanager
+    def single_flight_lock(self, cache_key):
+        start = time.monotonic()
+        with single_flight_lock(
+            self.application.config['CACHE_LOCK_DIRECTORY'],
+            cache_key,
+            self.application.config['CACHE_LOCK_TIMEOUT_SECONDS'],
+        ) as waited:
+            if waited:
+                self.application.statsd_client.incr('cache.single-flight.waited')
+                self.application.statsd_client.timing('cache.single-flight.wait-time', time.monotonic() - start)
+            yield waited
+
+    def _record(self, tier, cache_key, hit):
+        folder = cache_key.split('/')[0]
+        outcome = 'hit' if hit else 'miss'
+        self.stats[(tier, folder, outcome)] += 1
+        self.application.statsd_client.incr('cache.{}.{}.{}'.format(tier, folder, outcome))
+
+    def get(self, cache_key):
+        """
+        :return: a file-like containing the cached data, or None if nothing is cached under this key
+        """
+        for tier in self.local_tiers:
+            data = tier.get(cache_key)
+            self._record(tier.name, cache_key, data is not None)
+            if data is not None:
+                for faster_tier in self.local_tiers[:self.local_tiers.index(tier)]:
+                    faster_tier.set(cache_key, data)
+                return BytesIO(data)
+
+        try:
+            with stage('s3-get'):
+                data = s3download(
+                    self.application.config['LETTER_CACHE_BUCKET_NAME'],
+                    cache_key,
+                )
+        except S3ObjectNotFound:
+            self._record('s3', cache_key, False)
+            return None
+
+        self._record('s3', cache_key, True)
+
+        if not self.local_tiers:
+            return data
+
+        def fill(data):
+            for tier in self.local_tiers:
+                tier.set(cache_key, data)
+
+        # the tiers don't keep anything bigger than they are
+        return TierFillingStream(data, max(tier.max_bytes for tier in self.local_tiers), fill)
+
+    def presigned_url(self, cache_key):
+        """
+        :return str: a short lived url the client can download the cached data from, or None if it isn't in S3
+        """
+        s3 = boto3_session().client('s3', region_name=self.application.config['AWS_REGION'])
+        bucket_name = self.application.config['LETTER_CACHE_BUCKET_NAME']
+
+        try:
+            s3.head_object(Bucket=bucket_name, Key=cache_key)
+        except BotoClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                raise
+            self._record('s3', cache_key, False)
+            return None
+
+        self._record('s3', cache_key, True)
+        return s3.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': bucket_name, 'Key': cache_key},
+            ExpiresIn=self.application.config['CACHE_PRESIGNED_URL_EXPIRY_SECONDS'],
+        )
+
+    def set(self, cache_key, data, write_behind=False):
+        """
+        :param BytesIO data: the data to cache. It's read from the beginning, and left at the end
+        :param bool write_behind: as for `__call__`
+        """
+        write_behind = write_behind or self.write_behind
+        if self.local_tiers or write_behind:
+            data.seek(0)
+            raw_data = data.read()
+            for tier in self.local_tiers:
+                tier.set(cache_key, raw_data)
+            data.seek(0)
+
+        if write_behind:
+            self.uploader.upload(cache_key, raw_data)
+            data.seek(0, os.SEEK_END)
+            return
+
+        with stage('s3-put'):
+            s3upload(
+                data,
+                self.application.config['AWS_REGION'],
+                self.application.config['LETTER_CACHE_BUCKET_NAME'],
+                cache_key,
+            )
+
+    def flush(self, timeout=None):
+        """
+        Waits for any uploads still being written behind to finish.
+        """
+        return self.uploader.flush(timeout)
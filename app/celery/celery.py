@@ -2,6 +2,8 @@ import time
 
 from celery import Celery, Task
 
+from app.timing import format_stage_timings, get_stage_timings, record_stage_timings
+
 
 class NotifyCelery(Celery):
 
@@ -12,14 +14,20 @@ class NotifyCelery(Celery):
         class NotifyTask(Task):
             abstract = True
             start = None
+            stage_timings = None
 
             def on_success(self, retval, task_id, args, kwargs):
                 elapsed_time = time.time() - self.start
                 app.logger.info(
-                    "Celery task {task_name} took {time}".format(
-                        task_name=self.name, time="{0:.4f}".format(elapsed_time)
+                    "Celery task {task_name} took {time}{stages}".format(
+                        task_name=self.name,
+                        time="{0:.4f}".format(elapsed_time),
+                        stages=', stages: {}'.format(format_stage_timings(self.stage_timings))
+                        if self.stage_timings else '',
                     )
                 )
+                if self.stage_timings:
+                    record_stage_timings(app.statsd_client, self.stage_timings)
 
             def on_failure(self, exc, task_id, args, kwargs, einfo):
                 # ensure task will log exceptions to correct handlers
@@ -32,7 +40,11 @@ class NotifyCelery(Celery):
                 with app.app_context():
                     self.start = time.time()
 
-                    return super().__call__(*args, **kwargs)
+                    try:
+                        return super().__call__(*args, **kwargs)
+                    finally:
+                        # the app context has gone by the time on_success is called
+                        self.stage_timings = get_stage_timings()
 
         super().__init__(
             app.import_name,
@@ -3,14 +3,15 @@ from io import BytesIO
 
 from botocore.exceptions import ClientError as BotoClientError
 from flask import current_app
-from flask_weasyprint import HTML
 from notifications_utils.s3 import s3download, s3upload
 from notifications_utils.statsd_decorators import statsd
 import boto3
 
 from app import notify_celery, TaskNames, QueueNames
 from app.precompiled import sanitise_file_contents
-from app.preview import get_page_count
+from app.pdf_metadata import get_page_count
+from app.rendering import letter_html, write_pdf
+from app.timing import stage
 from app.transformation import convert_pdf_to_cmyk
 
 from notifications_utils.template import LetterPrintTemplate
@@ -22,7 +23,8 @@ def sanitise_and_upload_letter(notification_id, filename, allow_international_le
     current_app.logger.info('Sanitising notification with id {}'.format(notification_id))
 
     try:
-        pdf_content = s3download(current_app.config['LETTERS_SCAN_BUCKET_NAME'], filename).read()
+        with stage('s3-get'):
+            pdf_content = s3download(current_app.config['LETTERS_SCAN_BUCKET_NAME'], filename).read()
         sanitisation_details = sanitise_file_contents(
             pdf_content,
             allow_international_letters=allow_international_letters,
@@ -41,12 +43,13 @@ def sanitise_and_upload_letter(notification_id, filename, allow_international_le
                 copy_redaction_failed_pdf(filename)
 
             # If the file already exists in S3, it will be overwritten
-            s3upload(
-                filedata=file_data,
-                region=current_app.config['AWS_REGION'],
-                bucket_name=current_app.config['SANITISED_LETTER_BUCKET_NAME'],
-                file_location=filename,
-            )
+            with stage('s3-put'):
+                s3upload(
+                    filedata=file_data,
+                    region=current_app.config['AWS_REGION'],
+                    bucket_name=current_app.config['SANITISED_LETTER_BUCKET_NAME'],
+                    file_location=filename,
+                )
 
         current_app.logger.info('Notification {} sanitisation: {}'.format(validation_status, notification_id))
 
@@ -110,10 +113,10 @@ def create_pdf_for_templated_letter(encrypted_letter_data):
         admin_base_url=current_app.config['LETTER_LOGO_URL'],
         logo_file_name=logo_filename,
     )
-    with current_app.test_request_context(''):
-        html = HTML(string=str(template))
+    with current_app.test_request_context(''), stage('html'):
+        html = letter_html(str(template))
 
-    pdf = BytesIO(html.write_pdf())
+    pdf = BytesIO(write_pdf(html))
 
     cmyk_pdf = convert_pdf_to_cmyk(pdf)
     page_count = get_page_count(cmyk_pdf.read())
@@ -125,12 +128,13 @@ def create_pdf_for_templated_letter(encrypted_letter_data):
             bucket_name = current_app.config['TEST_LETTERS_BUCKET_NAME']
         else:
             bucket_name = current_app.config['LETTERS_PDF_BUCKET_NAME']
-        s3upload(
-            filedata=cmyk_pdf,
-            region=current_app.config['AWS_REGION'],
-            bucket_name=bucket_name,
-            file_location=letter_details["letter_filename"],
-        )
+        with stage('s3-put'):
+            s3upload(
+                filedata=cmyk_pdf,
+                region=current_app.config['AWS_REGION'],
+                bucket_name=bucket_name,
+                file_location=letter_details["letter_filename"],
+            )
 
         current_app.logger.info(
             f"Uploaded letters PDF {letter_details['letter_filename']} to {bucket_name} for "
@@ -2,52 +2,28 @@ from io import BytesIO
 import subprocess
 
 from flask import current_app
-from PyPDF2 import PdfFileReader
+
+from app.precompiled_document import PrecompiledDocument
+from app.timing import stage
 
 
 def contains_unembedded_fonts(pdf_data):
     """
-    Code adapted from https://gist.github.com/tiarno/8a2995e70cee42f01e79
-
     :param BytesIO pdf_data: a file-like object containing the pdf
-    :return boolean: If any fonts are contained that are not embedded.
+    :return set: any fonts that are used but not embedded
     """
-    def walk(obj, fnt, emb):
-        '''
-        If there is a key called 'BaseFont', that is a font that is used in the document.
-        If there is a key called 'FontName' and another key in the same dictionary object
-        that is called 'FontFilex' (where x is null, 2, or 3), then that fontname is
-        embedded.
-
-        We create and add to two sets, fnt = fonts used and emb = fonts embedded.
-        '''
-        if hasattr(obj, 'keys'):
-            fontkeys = {'/FontFile', '/FontFile2', '/FontFile3'}
-            if '/BaseFont' in obj:
-                fnt.add(obj['/BaseFont'])
-            if '/FontName' in obj:
-                if any(x in obj for x in fontkeys):  # test to see if there is FontFile
-                    emb.add(obj['/FontName'])
-
-            for k in obj.keys():
-                walk(obj[k], fnt, emb)
-
-    pdf = PdfFileReader(pdf_data)
-    fonts = set()
-    embedded = set()
-    for page in pdf.pages:
-        obj = page.getObject()
-        walk(obj['/Resources'], fonts, embedded)
-
-    unembedded = fonts - embedded
+    unembedded = PrecompiledDocument.from_file(pdf_data).unembedded_fonts
     if unembedded:
         current_app.logger.info(f'Found unembedded fonts {[x for x in unembedded]}')
-
-    # put things back as we found them
-    pdf_data.seek(0)
     return unembedded
 
 
+# arguments for both a one-off `gs` and a ghostscript worker
+EMBED_FONTS_GHOSTSCRIPT_ARGS = ('-sDEVICE=pdfwrite',)
+EMBED_FONTS_GHOSTSCRIPT_POSTSCRIPT = '<</NeverEmbed [ ]>> setdistillerparams'
+
+
+@stage('ghostscript-fonts')
 def remove_embedded_fonts(pdf_data):
     """
     Recreate the following
@@ -72,15 +48,20 @@ def remove_embedded_fonts(pdf_data):
     :param BytesIO pdf: a file-like object containing the pdf
     :return BytesIO: New file-like containing the new pdf with embedded fonts
     """
+    if current_app.config['GHOSTSCRIPT_POOL']:
+        return BytesIO(current_app.ghostscript_pool.run(
+            pdf_data.read(), EMBED_FONTS_GHOSTSCRIPT_ARGS, EMBED_FONTS_GHOSTSCRIPT_POSTSCRIPT
+        ))
+
     gs_process = subprocess.Popen(
         [
             'gs',
             '-o',
             '%stdout',
-            '-sDEVICE=pdfwrite',
+            *EMBED_FONTS_GHOSTSCRIPT_ARGS,
             '-sstdout=%stderr',
             '-c',
-            '<</NeverEmbed [ ]>> setdistillerparams',
+            EMBED_FONTS_GHOSTSCRIPT_POSTSCRIPT,
             '-f',
             '%stdin',
         ],
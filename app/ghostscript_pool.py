@@ -0,0 +1,232 @@
+import atexit
+import os
+import queue
+import select
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+
+# ghostscript's pdfwrite needs somewhere to write to between jobs
+NOWHERE = os.devnull
+
+# the oldest ghostscript the workers have been run with, which is the one in docker/Dockerfile
+MINIMUM_GHOSTSCRIPT_VERSION = (9, 21)
+
+
+def ghostscript_version():
+    """
+    :return tuple: the version of `gs` as ints, eg (9, 21)
+    """
+    version = subprocess.check_output(['gs', '--version'], stderr=subprocess.STDOUT).decode('ascii').strip()
+    try:
+        return tuple(int(part) for part in version.split('.'))
+    except ValueError:
+        raise Exception('could not read the ghostscript version from: {}'.format(version))
+
+
+def _postscript_string(value):
+    return '({})'.format(value.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)'))
+
+
+class GhostscriptWorker:
+    """
+    A long-lived `gs` that reads PostScript from stdin one character at a time, so it can be given one job after
+    another without paying for starting the interpreter and loading its fonts and ICC profiles each time.
+
+    Each job points the pdfwrite device at a new output file, runs the pdf it's given, then points the device somewhere
+    else, which closes it and finishes writing the output. The job is wrapped in `stopped`, so a pdf Ghostscript can't
+    read fails that job rather than the worker, and ends by printing a marker that says whether it worked.
+
+    -dSAFER doesn't let PostScript change the OutputFile, and it's the default from ghostscript 9.50, so the worker is
+    started with -dNOSAFER. Only the worker's own pdfs are run through it, from files in a directory only it writes to.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.jobs_run = 0
+        self.directory = tempfile.mkdtemp(prefix='template-preview-gs-')
+        self.process = subprocess.Popen(
+            ['gs', '-q', '-dNOPAUSE', '-dNOSAFER', '-sOutputFile={}'.format(NOWHERE), *args, '-'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+
+    def run(self, pdf_data, postscript, timeout):
+        """
+        :param bytes pdf_data: the pdf to run through ghostscript
+        :param str postscript: run at the start of the job, after the output file has been set
+        :param int timeout: seconds to wait for the job to finish
+        :return bytes: the pdf ghostscript wrote
+        """
+        job_id = uuid.uuid4().hex
+        input_path = os.path.join(self.directory, 'input.pdf')
+        output_path = os.path.join(self.directory, 'output.pdf')
+        with open(input_path, 'wb') as f:
+            f.write(pdf_data)
+
+        self.process.stdin.write((
+            '{{ << /OutputFile {output} >> setpagedevice {postscript} {input} run }} stopped\n'
+            '<< /OutputFile {nowhere} >> setpagedevice\n'
+            '{{ (\\n%%JOB-FAILED {job_id} ) print $error /errorname get =only (\\n) print }}\n'
+            '{{ (\\n%%JOB-DONE {job_id}\\n) print }}\n'
+            'ifelse flush clear cleardictstack $error /newerror false put\n'
+        ).format(
+            output=_postscript_string(output_path),
+            postscript=postscript,
+            input=_postscript_string(input_path),
+            nowhere=_postscript_string(NOWHERE),
+            job_id=job_id,
+        ).encode('ascii'))
+        self.process.stdin.flush()
+
+        output = self._read_until_marker(job_id, timeout)
+        self.jobs_run += 1
+        if '%%JOB-DONE {}'.format(job_id) not in output:
+            raise Exception('ghostscript worker job failed\noutput:\n{}'.format(output))
+
+        with open(output_path, 'rb') as f:
+            return f.read()
+
+    def _read_until_marker(self, job_id, timeout):
+        markers = ('%%JOB-DONE {}\n'.format(job_id).encode('ascii'), '%%JOB-FAILED {} '.format(job_id).encode('ascii'))
+        deadline = time.monotonic() + timeout
+        output = b''
+        while not any(marker in output and output.endswith(b'\n') for marker in markers):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.process.stdout], [], [], remaining)[0]:
+                raise Exception('ghostscript worker timed out after {} seconds'.format(timeout))
+            chunk = os.read(self.process.stdout.fileno(), 65536)
+            if not chunk:
+                raise Exception('ghostscript worker exited with return code: {}\noutput:\n{}'.format(
+                    self.process.wait(), output.decode('utf-8', 'replace'),
+                ))
+            output += chunk
+        return output.decode('utf-8', 'replace')
+
+    def rss_mb(self):
+        try:
+            with open('/proc/{}/status'.format(self.process.pid)) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        # it's given in kB
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return 0
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def stop(self):
+        try:
+            self.process.stdin.write(b'quit\n')
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class GhostscriptPool:
+    """
+    Keeps up to GHOSTSCRIPT_POOL_SIZE workers per process for each set of ghostscript arguments, and runs pdfs
+    through them.
+
+    Workers are started when they're first needed, so forked processes get workers of their own. They're stopped and
+    replaced after GHOSTSCRIPT_WORKER_MAX_JOBS jobs, once they use more than GHOSTSCRIPT_WORKER_MAX_RSS_MB, or after
+    a job fails, since a failed job might have left the interpreter in a state the next job can't rely on.
+
+    The version of `gs` is checked before the first worker is started, so a ghostscript the workers don't work with
+    fails there rather than partway through a job.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self._pid = None
+        self._workers = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def check_ghostscript_version():
+        version = ghostscript_version()
+        if version < MINIMUM_GHOSTSCRIPT_VERSION:
+            raise Exception('ghostscript worker needs ghostscript {} or later, not {}'.format(
+                '.'.join(map(str, MINIMUM_GHOSTSCRIPT_VERSION)), '.'.join(map(str, version)),
+            ))
+
+    def _slots(self, args):
+        with self._lock:
+            if self._pid != os.getpid():
+                if self._pid is None:
+                    self.check_ghostscript_version()
+                    atexit.register(self.stop)
+                # the workers belong to the process we were forked from
+                self._workers = {}
+                self._pid = os.getpid()
+
+            if args not in self._workers:
+                # a slot holds an idle worker, or None if there's room to start another one
+                self._workers[args] = queue.LifoQueue()
+                for _ in range(self.application.config['GHOSTSCRIPT_POOL_SIZE']):
+                    self._workers[args].put(None)
+            return self._workers[args]
+
+    def run(self, pdf_data, args, postscript=''):
+        """
+        :param bytes pdf_data: the pdf to run through ghostscript
+        :param tuple args: ghostscript arguments, which should include the output device
+        :param str postscript: run at the start of each job
+        :return bytes: the pdf ghostscript wrote
+        """
+        timeout = self.application.config['GHOSTSCRIPT_JOB_TIMEOUT_SECONDS']
+        slots = self._slots(args)
+        try:
+            worker = slots.get(timeout=timeout)
+        except queue.Empty:
+            raise Exception('no ghostscript worker free after {} seconds'.format(timeout))
+
+        if worker is not None and not worker.is_alive():
+            worker.stop()
+            worker = None
+
+        try:
+            if worker is None:
+                self.application.statsd_client.incr('ghostscript-pool.started')
+                worker = GhostscriptWorker(args)
+            start = time.monotonic()
+            result = worker.run(pdf_data, postscript, timeout)
+            self.application.statsd_client.timing('ghostscript-pool.job-time', time.monotonic() - start)
+        except Exception:
+            self.application.statsd_client.incr('ghostscript-pool.failed')
+            if worker is not None:
+                worker.stop()
+            slots.put(None)
+            raise
+
+        worn_out = worker.jobs_run >= self.application.config['GHOSTSCRIPT_WORKER_MAX_JOBS']
+        if worn_out or worker.rss_mb() > self.application.config['GHOSTSCRIPT_WORKER_MAX_RSS_MB']:
+            self.application.statsd_client.incr('ghostscript-pool.recycled')
+            worker.stop()
+            worker = None
+        slots.put(worker)
+        return result
+
+    def stop(self):
+        """
+        Stops this process's idle workers
+        """
+        if self._pid != os.getpid():
+            return
+        for slots in self._workers.values():
+            while True:
+                try:
+                    worker = slots.get_nowait()
+                except queue.Empty:
+                    break
+                if worker is not None:
+                    worker.stop()
@@ -0,0 +1,133 @@
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import suppress
+from hashlib import sha1
+
+from flask import current_app
+from weasyprint import default_url_fetcher
+
+
+class LogoCache:
+    """
+    Keeps the logos letters link to, so WeasyPrint doesn't fetch them from LETTER_LOGO_URL for every letter.
+
+    Logos are kept in memory for LETTER_LOGO_CACHE_TTL_SECONDS, after which they're fetched again with the ETag we
+    were given, so an unchanged logo costs a 304 rather than the whole file. If LETTER_LOGO_CACHE_DISK_PATH is set
+    logos are also kept there, so they survive a process restart and are shared by every process on the host.
+
+    If LETTER_LOGO_LOCAL_DIRECTORY is set logos are read from that directory instead of LETTER_LOGO_URL, so letters
+    can be rendered without the network.
+    """
+
+    def __init__(self, application):
+        self.base_url = application.config['LETTER_LOGO_URL'].rstrip('/') + '/'
+        self.ttl_seconds = application.config['LETTER_LOGO_CACHE_TTL_SECONDS']
+        self.disk_path = application.config['LETTER_LOGO_CACHE_DISK_PATH']
+        self.local_directory = application.config['LETTER_LOGO_LOCAL_DIRECTORY']
+
+        # url: (time fetched, etag, mime type, data)
+        self._logos = {}
+        self._lock = threading.Lock()
+
+    def is_logo(self, url):
+        return url.startswith(self.base_url)
+
+    def fetch(self, url):
+        """
+        :return tuple: the mime type and raw bytes of the logo at `url`
+        """
+        with self._lock:
+            cached = self._logos.get(url)
+
+        if cached and time.monotonic() - cached[0] < self.ttl_seconds:
+            current_app.statsd_client.incr('logo-cache.memory.hit')
+            _, _, mime_type, data = cached
+            return mime_type, data
+
+        if self.local_directory:
+            mime_type, data = self._read_local_file(url)
+            etag = None
+        else:
+            if not cached and self.disk_path:
+                cached = self._read_from_disk(url)
+            etag, mime_type, data = self._fetch_from_url(url, cached)
+
+        with self._lock:
+            self._logos[url] = (time.monotonic(), etag, mime_type, data)
+        return mime_type, data
+
+    def _read_local_file(self, url):
+        path = os.path.join(self.local_directory, *url[len(self.base_url):].split('/'))
+        with open(path, 'rb') as f:
+            data = f.read()
+        return mimetypes.guess_type(path)[0], data
+
+    def _fetch_from_url(self, url, cached):
+        request = urllib.request.Request(url)
+        if cached and cached[1]:
+            request.add_header('If-None-Match', cached[1])
+
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                etag = response.headers.get('ETag')
+                mime_type = response.headers.get_content_type()
+                data = response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and cached:
+                current_app.statsd_client.incr('logo-cache.not-modified')
+                _, etag, mime_type, data = cached
+                return etag, mime_type, data
+            raise
+
+        current_app.statsd_client.incr('logo-cache.fetched')
+        if self.disk_path:
+            self._write_to_disk(url, etag, mime_type, data)
+        return etag, mime_type, data
+
+    def _disk_path_for(self, url):
+        return os.path.join(self.disk_path, sha1(url.encode('utf-8')).hexdigest())
+
+    def _read_from_disk(self, url):
+        path = self._disk_path_for(url)
+        try:
+            with open(path + '.meta', 'r') as f:
+                etag, mime_type = f.read().split('\n')
+            with open(path, 'rb') as f:
+                data = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # the file has to be revalidated before it's used, so pretend it was fetched a ttl ago
+        return (time.monotonic() - self.ttl_seconds, etag or None, mime_type, data)
+
+    def _write_to_disk(self, url, etag, mime_type, data):
+        path = self._disk_path_for(url)
+        os.makedirs(self.disk_path, exist_ok=True)
+
+        # the data is moved into place before its metadata, so a reader never sees an etag for data it can't read
+        for suffix, content in (('', data), ('.meta', '{}\n{}'.format(etag or '', mime_type).encode('utf-8'))):
+            file_descriptor, temporary_path = tempfile.mkstemp(dir=self.disk_path, prefix='.')
+            try:
+                with os.fdopen(file_descriptor, 'wb') as f:
+                    f.write(content)
+                os.replace(temporary_path, path + suffix)
+            except Exception:
+                with suppress(FileNotFoundError):
+                    os.remove(temporary_path)
+                raise
+
+
+def logo_url_fetcher(url):
+    """
+    A WeasyPrint url_fetcher that serves logos from `current_app.logo_cache`, and fetches anything else as normal. If
+    a logo can't be fetched the error is raised, and WeasyPrint logs that it failed to load the image.
+    """
+    if current_app.logo_cache.is_logo(url):
+        mime_type, data = current_app.logo_cache.fetch(url)
+        return {'string': data, 'mime_type': mime_type, 'redirected_url': url}
+    return default_url_fetcher(url)
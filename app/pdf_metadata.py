@@ -0,0 +1,107 @@
+import json
+from io import BytesIO
+
+from notifications_utils.pdf import pdf_page_count
+from notifications_utils.statsd_decorators import statsd
+from PyPDF2 import PdfFileReader
+from PyPDF2.generic import ArrayObject
+
+# an ICC based colourspace with no /Alternate is treated as the device colourspace with the same number of components
+ICC_COLOURSPACES = {1: 'DeviceGray', 3: 'DeviceRGB', 4: 'DeviceCMYK'}
+
+
+@statsd(namespace="template_preview")
+def get_page_count(pdf_data):
+    """
+    Reads the page count from the PDF's page tree, rather than asking ImageMagick, which would rasterise every page
+    """
+    return pdf_page_count(BytesIO(pdf_data))
+
+
+def _colourspace_name(colourspace):
+    """
+    :param colourspace: an image's /ColorSpace
+    :return str: for example DeviceRGB or DeviceCMYK. Colourspaces built on top of another, like ICC profiles and
+        indexed colours, are named after the one underneath
+    """
+    colourspace = colourspace.getObject()
+    if not isinstance(colourspace, ArrayObject):
+        return colourspace.lstrip('/')
+
+    family = colourspace[0].getObject()
+    if family == '/ICCBased':
+        profile = colourspace[1].getObject()
+        if '/Alternate' in profile:
+            return _colourspace_name(profile['/Alternate'])
+        return ICC_COLOURSPACES.get(profile['/N'] if '/N' in profile else None, 'ICCBased')
+    if family == '/Indexed':
+        return _colourspace_name(colourspace[1])
+    if family in ('/Separation', '/DeviceN'):
+        return _colourspace_name(colourspace[2])
+    return family.lstrip('/')
+
+
+def get_image_colourspaces(pdf):
+    """
+    Reads the /ColorSpace of every image, including images inside forms, from the image's dictionary, so no image is
+    decoded
+
+    :param PdfFileReader pdf:
+    :return set: the name of each colourspace, as returned by `_colourspace_name`
+    """
+    colourspaces = set()
+    # an image or form used on several pages, like a logo, is only looked at once
+    seen = set()
+
+    def walk(resources):
+        if '/XObject' not in resources:
+            return
+        for xobject in resources['/XObject'].values():
+            xobject = xobject.getObject()
+            if id(xobject) in seen:
+                continue
+            seen.add(id(xobject))
+
+            if xobject.get('/Subtype') == '/Image' and '/ColorSpace' in xobject:
+                colourspaces.add(_colourspace_name(xobject['/ColorSpace']))
+            elif xobject.get('/Subtype') == '/Form' and '/Resources' in xobject:
+                walk(xobject['/Resources'])
+
+    for page in pdf.pages:
+        if '/Resources' in page:
+            walk(page['/Resources'])
+    return colourspaces
+
+
+def get_pdf_metadata(pdf_data):
+    """
+    Facts about a PDF that are cheap to find from its structure, without rasterising anything. These are cached next
+    to the PDF so that questions like "how many pages has this letter got" don't need the PDF at all.
+
+    :param bytes pdf_data: the raw bytes of the pdf
+    :return dict: a json serialisable description of the pdf
+    """
+    pdf = PdfFileReader(BytesIO(pdf_data))
+
+    return {
+        'page_count': pdf.numPages,
+        # [left, bottom, right, top] in points, one per page
+        'media_boxes': [
+            [float(coordinate) for coordinate in pdf.getPage(page_number).mediaBox]
+            for page_number in range(pdf.numPages)
+        ],
+        # for example DeviceRGB or DeviceCMYK
+        'image_colourspaces': sorted(get_image_colourspaces(pdf)),
+        'size_in_bytes': len(pdf_data),
+    }
+
+
+def pdf_metadata_as_file(pdf_data):
+    """
+    :return BytesIO: the metadata of the pdf as json, ready to be cached
+    """
+    return BytesIO(json.dumps(get_pdf_metadata(pdf_data)).encode('utf-8'))
+
+
+def pdf_metadata_from_file(metadata_file):
+    return json.loads(metadata_file.read().decode('utf-8'))
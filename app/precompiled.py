@@ -5,6 +5,7 @@ import app.pdf_redactor as pdf_redactor
 import re
 import fitz
 
+from functools import lru_cache
 from operator import itemgetter
 from itertools import groupby
 
@@ -21,11 +22,13 @@ from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 
 from app import auth, InvalidRequest, ValidationFailed
-from app.preview import png_from_pdf
+from app.admission import admission_control
 from app.transformation import convert_pdf_to_cmyk, does_pdf_contain_cmyk, does_pdf_contain_rgb
 from app.embedded_fonts import contains_unembedded_fonts, remove_embedded_fonts
+from app.precompiled_document import PrecompiledDocument
+from app.timing import stage
 
-from notifications_utils.pdf import is_letter_too_long, pdf_page_count
+from notifications_utils.pdf import is_letter_too_long
 from notifications_utils.postal_address import PostalAddress
 
 A4_WIDTH = 210.0
@@ -141,6 +144,7 @@ class PrecompiledPostalAddress(PostalAddress):
 @precompiled_blueprint.route('/precompiled/sanitise', methods=['POST'])
 @auth.login_required
 @statsd(namespace='template_preview')
+@admission_control('sanitise')
 def sanitise_precompiled_letter():
     encoded_string = request.get_data()
     allow_international_letters = (
@@ -168,14 +172,15 @@ def sanitise_file_contents(encoded_string, *, allow_international_letters):
     * adds NOTIFY tag if not present
     """
     try:
-        file_data = BytesIO(encoded_string)
+        file_data = PrecompiledDocument(encoded_string)
 
-        page_count = pdf_page_count(file_data)
+        page_count = file_data.page_count
         if is_letter_too_long(page_count):
             message = "letter-too-long"
             raise ValidationFailed(message, page_count=page_count)
 
-        message, invalid_pages = get_invalid_pages_with_message(file_data)
+        with stage('validate'):
+            message, invalid_pages = get_invalid_pages_with_message(file_data)
         if message:
             raise ValidationFailed(message, invalid_pages, page_count=page_count)
 
@@ -209,21 +214,30 @@ def sanitise_file_contents(encoded_string, *, allow_international_letters):
 
 
 def rewrite_pdf(file_data, *, page_count, allow_international_letters):
-    file_data, recipient_address, redaction_failed_message = rewrite_address_block(
-        file_data,
-        page_count=page_count,
-        allow_international_letters=allow_international_letters,
-    )
+    with stage('rewrite-address'):
+        file_data, recipient_address, redaction_failed_message = rewrite_address_block(
+            file_data,
+            page_count=page_count,
+            allow_international_letters=allow_international_letters,
+        )
 
-    if not does_pdf_contain_cmyk(file_data) or does_pdf_contain_rgb(file_data):
-        file_data = convert_pdf_to_cmyk(file_data)
+    # each check below reuses what the ones before it parsed, until the letter is changed
+    file_data = PrecompiledDocument.from_file(file_data)
 
-    if contains_unembedded_fonts(file_data):
-        file_data = remove_embedded_fonts(file_data)
+    with stage('colour-check'):
+        needs_cmyk = not does_pdf_contain_cmyk(file_data) or does_pdf_contain_rgb(file_data)
+    if needs_cmyk:
+        file_data = PrecompiledDocument.from_file(convert_pdf_to_cmyk(file_data))
+
+    with stage('font-check'):
+        needs_fonts = contains_unembedded_fonts(file_data)
+    if needs_fonts:
+        file_data = PrecompiledDocument.from_file(remove_embedded_fonts(file_data))
 
     # during switchover, DWP and CYSP will still be sending the notify tag. Only add it if it's not already there
-    if not is_notify_tag_present(file_data):
-        file_data = add_notify_tag_to_letter(file_data)
+    with stage('notify-tag'):
+        if not is_notify_tag_present(file_data):
+            file_data = add_notify_tag_to_letter(file_data)
 
     return file_data, recipient_address, redaction_failed_message
 
@@ -253,6 +267,9 @@ def overlay_template_png_for_page():
     else:
         raise InvalidRequest(f'page_number or is_first_page must be specified in request params {request.args}')
 
+    # the preview stack, ImageMagick included, is only loaded by the web app, as Celery never calls this
+    from app.preview import png_from_pdf
+
     return send_file(
         filename_or_fp=png_from_pdf(
             _colour_no_print_areas_of_single_page_pdf_in_red(file_data, is_first_page=is_first_page),
@@ -289,6 +306,22 @@ def overlay_template_pdf():
     return send_file(filename_or_fp=bytesio_from_pdf(pdf), mimetype='application/pdf')
 
 
+def register_font():
+    """
+    Registers Arial with reportlab. Parsing the font file is slow, so it's only done once per process.
+    """
+    if FONT not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont(FONT, TRUE_TYPE_FONT_FILE))
+
+
+@lru_cache()
+def get_notify_tag_font():
+    """
+    The font the NOTIFY tag is written in, loaded once per process
+    """
+    return ImageFont.truetype(TRUE_TYPE_FONT_FILE, NOTIFY_TAG_FONT_SIZE)
+
+
 def add_notify_tag_to_letter(src_pdf):
     """
     Adds the word 'NOTIFY' to the first page of the PDF
@@ -299,11 +332,10 @@ def add_notify_tag_to_letter(src_pdf):
     pdf = PdfFileReader(src_pdf)
     page = pdf.getPage(0)
     can = NotifyCanvas(white)
-    pdfmetrics.registerFont(TTFont(FONT, TRUE_TYPE_FONT_FILE))
+    register_font()
     can.setFont(FONT, NOTIFY_TAG_FONT_SIZE)
 
-    font = ImageFont.truetype(TRUE_TYPE_FONT_FILE, NOTIFY_TAG_FONT_SIZE)
-    line_width, line_height = font.getsize('NOTIFY')
+    line_width, line_height = get_notify_tag_font().getsize('NOTIFY')
 
     center_of_left_margin = (BORDER_LEFT_FROM_LEFT_OF_PAGE * mm) / 2
     half_width_of_notify_tag = line_width / 2
@@ -327,6 +359,8 @@ def add_notify_tag_to_letter(src_pdf):
 
 
 def get_invalid_pages_with_message(src_pdf):
+    src_pdf = PrecompiledDocument.from_file(src_pdf)
+
     invalid_pages = _get_pages_with_invalid_orientation_or_size(src_pdf)
     if len(invalid_pages) > 0:
         return "letter-not-a4-portrait-oriented", invalid_pages
@@ -336,7 +370,8 @@ def get_invalid_pages_with_message(src_pdf):
     if len(invalid_pages) > 0:
         return 'content-outside-printable-area', invalid_pages
 
-    invalid_pages = _get_pages_with_notify_tag(pdf_to_validate)
+    # the white overlay doesn't change the text on the page, so look for tags in the letter we've already parsed
+    invalid_pages = _get_pages_with_notify_tag(src_pdf)
     if len(invalid_pages) > 0:
         # we really dont expect to see many of these so lets log
         current_app.logger.warning(f'notify tag found on pages {invalid_pages}')
@@ -356,15 +391,9 @@ def _is_page_A4_portrait(page_height, page_width, rotation):
 
 
 def _get_pages_with_invalid_orientation_or_size(src_pdf):
-    pdf = PdfFileReader(src_pdf)
     invalid_pages = []
-    for page_num in range(0, pdf.numPages):
-        page = pdf.getPage(page_num)
-
-        page_height = float(page.mediaBox.getHeight()) / mm
-        page_width = float(page.mediaBox.getWidth()) / mm
-        rotation = page.get('/Rotate')
-
+    page_sizes = PrecompiledDocument.from_file(src_pdf).page_sizes
+    for page_num, (page_height, page_width, rotation) in enumerate(page_sizes):
         if not _is_page_A4_portrait(page_height, page_width, rotation):
             invalid_pages.append(page_num + 1)
             current_app.logger.warning(
@@ -393,6 +422,7 @@ def _overlay_printable_areas_with_white(src_pdf):
     :return BytesIO: New file like containing the overlaid pdf
     """
 
+    # merging the overlay changes the pages, so this needs its own copy rather than a PrecompiledDocument's
     pdf = PdfFileReader(src_pdf)
     page = pdf.getPage(0)
     can = NotifyCanvas(white)
@@ -604,15 +634,10 @@ def _extract_text_from_first_page_of_pdf(pdf, *, x1, y1, x2, y2):
     :param y2: vertical location parameter for bottom right corner of rectangle in mm
     :return: Any text found
     """
-    pdf.seek(0)
-    doc = fitz.open("pdf", pdf)
-    page = doc[0]
-    ret = _extract_text_from_page(page, x1=x1, y1=y1, x2=x2, y2=y2)
-    pdf.seek(0)
-    return ret
+    return _extract_text_from_words(PrecompiledDocument.from_file(pdf).words(0), x1=x1, y1=y1, x2=x2, y2=y2)
 
 
-def _extract_text_from_page(page, *, x1, y1, x2, y2):
+def _extract_text_from_words(words, *, x1, y1, x2, y2):
     """
     Extracts all text within a block.
     Taken from this script: https://github.com/pymupdf/PyMuPDF-Utilities/blob/master/textboxtract.py
@@ -623,7 +648,7 @@ def _extract_text_from_page(page, *, x1, y1, x2, y2):
     and is structured as follows:
     (x1, y1, x2, y2, word value, paragraph number, line number, word position within the line)
 
-    :param fitz.Page page: fitz page object from which to extract
+    :param list words: the words on a page, from PrecompiledDocument.words
     :param x1: horizontal location parameter for top left corner of rectangle in mm
     :param y1: vertical location parameter for top left corner of rectangle in mm
     :param x2: horizontal location parameter for bottom right corner of rectangle in mm
@@ -631,7 +656,6 @@ def _extract_text_from_page(page, *, x1, y1, x2, y2):
     :return: Any text found
     """
     rect = fitz.Rect(x1, y1, x2, y2)
-    words = page.getTextWords()
     mywords = [w for w in words if fitz.Rect(w[:4]).intersects(rect)]
     mywords.sort(key=itemgetter(-3, -2, -1))
     group = groupby(mywords, key=itemgetter(3))
@@ -663,8 +687,7 @@ def _get_notify_tag_bounding_box():
     """
     Return x1, y1, x2, y2 in mm for the boundary of the NOTIFY tag in the top left, plus a healthy margin to help read
     """
-    font = ImageFont.truetype(TRUE_TYPE_FONT_FILE, NOTIFY_TAG_FONT_SIZE)
-    line_width, line_height = font.getsize('NOTIFY')
+    line_width, line_height = get_notify_tag_font().getsize('NOTIFY')
 
     # add on a fairly chunky margin to be generous to rounding errors
     x1 = NOTIFY_TAG_FROM_LEFT_OF_PAGE - 5
@@ -696,28 +719,26 @@ def _get_pages_with_notify_tag(src_pdf_bytes):
     process letters with NOTIFY tags on later pages because their software thinks it's a marker signifying when a new
     letter starts. We've seen services attach pages from previous letters sent via notify
     """
-    src_pdf_bytes.seek(0)
-    doc = fitz.open("pdf", src_pdf_bytes)
-    if doc.pageCount == 1:
+    document = PrecompiledDocument.from_file(src_pdf_bytes)
+    if len(document.fitz_document) == 1:
         # if no extra pages we dont need to do anything
-        src_pdf_bytes.seek(0)
         return []
     x1, y1, x2, y2 = _get_notify_tag_bounding_box()
 
     invalid_pages = [
-        page.number + 1  # return 1 indexed pages
-        for page in doc.pages(start=1)
-        if _extract_text_from_page(
-            page,
+        page_number + 1  # return 1 indexed pages
+        for page_number in range(1, len(document.fitz_document))
+        if _extract_text_from_words(
+            document.words(page_number),
             x1=x1 * mm, y1=y1 * mm,
             x2=x2 * mm, y2=y2 * mm
         ) == 'NOTIFY'
     ]
 
-    src_pdf_bytes.seek(0)
     return invalid_pages
 
 
+@stage('redact')
 def redact_precompiled_letter_address_block(pdf, address_regex):
     options = pdf_redactor.RedactorOptions()
 
@@ -758,7 +779,7 @@ def add_address_to_precompiled_letter(pdf, address):
     can.rect(pt1, pt2)
 
     # start preparing to write address
-    pdfmetrics.registerFont(TTFont(FONT, TRUE_TYPE_FONT_FILE))
+    register_font()
 
     # text origin is bottom left of the first character. But we've got multiple lines, and we want to match the
     # bottom left of the bottom line of text to the bottom left of the address block.
@@ -0,0 +1,150 @@
+from io import BytesIO
+
+import fitz
+from flask import current_app
+from PyPDF2 import PdfFileReader
+from reportlab.lib.units import mm
+
+from app import InvalidRequest
+
+
+class PrecompiledDocument(BytesIO):
+    """
+    One version of a precompiled letter, and the facts about it that sanitising asks for.
+
+    It's a file-like like any other, so it can be passed anywhere a BytesIO of the pdf can. But the first time a fact
+    is asked for, it parses the pdf and works the fact out, and keeps both, so each pdf is parsed at most once by PyPDF2
+    and once by fitz however many checks look at it. Anything that changes the letter makes a new PrecompiledDocument,
+    which starts with nothing cached.
+
+    The parsed documents are shared, so don't change them. Anything that merges onto pages should parse its own copy.
+    """
+
+    def __init__(self, data):
+        super().__init__(data)
+        self._pdf = None
+        self._fitz_document = None
+        self._words = {}
+        self._image_colourspaces = None
+        self._fonts = None
+
+    @classmethod
+    def from_file(cls, pdf):
+        """
+        :param pdf: a PrecompiledDocument, which is returned as it is, or any other file-like containing a pdf
+        """
+        if isinstance(pdf, cls):
+            pdf.seek(0)
+            return pdf
+        pdf.seek(0)
+        document = cls(pdf.read())
+        # put things back how we found them
+        pdf.seek(0)
+        return document
+
+    @property
+    def pdf(self):
+        """
+        :return PdfFileReader: the pdf parsed by PyPDF2, from its own buffer so it doesn't move this one's position
+        """
+        if self._pdf is None:
+            self._pdf = PdfFileReader(BytesIO(self.getvalue()))
+        return self._pdf
+
+    @property
+    def fitz_document(self):
+        if self._fitz_document is None:
+            self._fitz_document = fitz.open(stream=self.getvalue(), filetype='pdf')
+        return self._fitz_document
+
+    @property
+    def page_count(self):
+        return self.pdf.numPages
+
+    @property
+    def page_sizes(self):
+        """
+        :return list: the height and width in mm, and the /Rotate, of each page
+        """
+        return [
+            (
+                float(self.pdf.getPage(page_number).mediaBox.getHeight()) / mm,
+                float(self.pdf.getPage(page_number).mediaBox.getWidth()) / mm,
+                self.pdf.getPage(page_number).get('/Rotate'),
+            )
+            for page_number in range(self.page_count)
+        ]
+
+    def words(self, page_number):
+        """
+        :param int page_number: zero-indexed
+        :return list: each word on the page, as fitz's getTextWords gives them
+        """
+        if page_number not in self._words:
+            self._words[page_number] = self.fitz_document[page_number].getTextWords()
+        return self._words[page_number]
+
+    @property
+    def image_colourspaces(self):
+        """
+        :return set: the colourspace of every image in the pdf, for example "Colorspace(CS_RGB) - DeviceRGB"
+        """
+        if self._image_colourspaces is None:
+            colourspaces = {}
+            for page_number in range(len(self.fitz_document)):
+                try:
+                    images = self.fitz_document.getPageImageList(page_number)
+                except RuntimeError:
+                    current_app.logger.warning("Fitz couldn't read page info for page {}".format(page_number + 1))
+                    raise InvalidRequest("Invalid PDF on page {}".format(page_number + 1))
+                for image in images:
+                    xref = image[0]
+                    # an image used on several pages, like a logo, is only decoded once
+                    if xref not in colourspaces:
+                        colourspaces[xref] = str(fitz.Pixmap(self.fitz_document, xref).colorspace)
+            self._image_colourspaces = set(colourspaces.values())
+        return self._image_colourspaces
+
+    def contains_colourspace(self, colourspace):
+        return any(colourspace in image_colourspace for image_colourspace in self.image_colourspaces)
+
+    @property
+    def fonts(self):
+        """
+        Code adapted from https://gist.github.com/tiarno/8a2995e70cee42f01e79
+
+        :return tuple: the set of fonts used in the pdf, and the set of those that are embedded
+        """
+        def walk(obj, fnt, emb):
+            '''
+            If there is a key called 'BaseFont', that is a font that is used in the document.
+            If there is a key called 'FontName' and another key in the same dictionary object
+            that is called 'FontFilex' (where x is null, 2, or 3), then that fontname is
+            embedded.
+
+            We create and add to two sets, fnt = fonts used and emb = fonts embedded.
+            '''
+            if hasattr(obj, 'keys'):
+                fontkeys = {'/FontFile', '/FontFile2', '/FontFile3'}
+                if '/BaseFont' in obj:
+                    fnt.add(obj['/BaseFont'])
+                if '/FontName' in obj:
+                    if any(x in obj for x in fontkeys):  # test to see if there is FontFile
+                        emb.add(obj['/FontName'])
+
+                for k in obj.keys():
+                    walk(obj[k], fnt, emb)
+
+        if self._fonts is None:
+            fonts = set()
+            embedded = set()
+            for page in self.pdf.pages:
+                obj = page.getObject()
+                walk(obj['/Resources'], fonts, embedded)
+            self._fonts = fonts, embedded
+        return self._fonts
+
+    @property
+    def unembedded_fonts(self):
+        fonts, embedded = self.fonts
+        return fonts - embedded
@@ -0,0 +1,37 @@
+import threading
+
+
+class Prefetcher:
+    """
+    Runs work nobody has asked for yet, such as rendering the other pages of a letter, on background threads.
+
+    At most PREVIEW_PREFETCH_CONCURRENCY things are prefetched at once in each process. Anything submitted while
+    they're all busy is dropped, rather than queued, so prefetching never holds up requests that are actually waiting.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self._slots = threading.BoundedSemaphore(application.config['PREVIEW_PREFETCH_CONCURRENCY'])
+
+    def submit(self, function, *args):
+        """
+        Calls `function(*args)` on a background thread, inside a request context so that it can render letters
+
+        :return bool: False if it was dropped because too much is already being prefetched
+        """
+        if not self._slots.acquire(blocking=False):
+            self.application.statsd_client.incr('prefetch.dropped')
+            return False
+
+        self.application.statsd_client.incr('prefetch.started')
+        threading.Thread(target=self._run, args=(function, args), daemon=True).start()
+        return True
+
+    def _run(self, function, args):
+        try:
+            with self.application.test_request_context():
+                function(*args)
+        except Exception:
+            self.application.logger.exception('Failed to prefetch {}'.format(function.__name__))
+        finally:
+            self._slots.release()
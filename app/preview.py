@@ -1,48 +1,173 @@
 import base64
 import dateutil.parser
-from io import BytesIO
+from collections import namedtuple
+from datetime import datetime
+from io import BytesIO, SEEK_END
+from json import dumps as json_dumps
 
-from flask import Blueprint, request, send_file, abort, current_app, jsonify
-from flask_weasyprint import HTML
+from flask import Blueprint, request, send_file, abort, current_app, g, jsonify, redirect
 from notifications_utils.statsd_decorators import statsd
+from notifications_utils.version import __version__ as notifications_utils_version
+from PyPDF2 import PdfFileReader, PdfFileWriter
 from wand.image import Image
 from wand.color import Color
 from wand.exceptions import MissingDelegateError
+from werkzeug.wsgi import ClosingIterator
 from notifications_utils.template import (
     LetterPreviewTemplate,
     LetterPrintTemplate,
 )
 
 from app import auth
+from app.admission import admission_control
+from app.pdf_metadata import get_page_count, pdf_metadata_as_file, pdf_metadata_from_file
+from app.rendering import letter_html, write_pdf
 from app.schemas import get_and_validate_json_from_request, preview_schema
+from app.timing import stage
 from app.transformation import convert_pdf_to_cmyk
 
 preview_blueprint = Blueprint('preview_blueprint', __name__)
 
 
+def _notify_tag_cover_size(resolution):
+    """
+    :return tuple: the width and height, in pixels, of a block that covers the Notify tag at this resolution
+    """
+    return round(130 * resolution / 150), round(50 * resolution / 150)
+
+
 # When the background is set to white traces of the Notify tag are visible in the preview png
 # As modifying the pdf text is complicated, a quick solution is to place a white block over it
-def hide_notify_tag(image):
-    with Image(width=130, height=50, background=Color('white')) as cover:
+def hide_notify_tag(image, resolution=150):
+    width, height = _notify_tag_cover_size(resolution)
+    with Image(width=width, height=height, background=Color('white')) as cover:
         if image.colorspace == 'cmyk':
             cover.transform_colorspace('cmyk')
         image.composite(cover, left=0, top=0)
 
 
-@statsd(namespace="template_preview")
-def png_from_pdf(data, page_number, hide_notify=False):
-    with Image(blob=data, resolution=150) as pdf:
+# previews can be asked for at a lower resolution, in dpi, and in other formats, which are smaller and quicker to make
+PREVIEW_RESOLUTIONS = (50, 75, 150)
+PREVIEW_FORMATS = {
+    'png': 'image/png',
+    # a png with a palette of at most 256 colours, which is plenty for most letters
+    'png8': 'image/png',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+}
+ImageOptions = namedtuple('ImageOptions', ['resolution', 'image_format', 'quality'])
+DEFAULT_IMAGE_OPTIONS = ImageOptions(resolution=150, image_format='png', quality=None)
+
+
+def get_image_options(args):
+    """
+    Reads `resolution`, `format` and `quality` (for jpeg and webp only, from 1 to 100) from the request args
+
+    :return ImageOptions:
+    """
+    try:
+        image_options = ImageOptions(
+            resolution=int(args.get('resolution', DEFAULT_IMAGE_OPTIONS.resolution)),
+            image_format=args.get('format', DEFAULT_IMAGE_OPTIONS.image_format),
+            quality=int(args['quality']) if 'quality' in args else None,
+        )
+    except ValueError:
+        abort(400, 'Could not understand resolution {} or quality {}'.format(
+            args.get('resolution'), args.get('quality'),
+        ))
+
+    if image_options.resolution not in PREVIEW_RESOLUTIONS:
+        abort(400, 'Resolution must be one of {}'.format(', '.join(map(str, PREVIEW_RESOLUTIONS))))
+    if image_options.image_format not in PREVIEW_FORMATS:
+        abort(400, 'Format must be one of {}'.format(', '.join(sorted(PREVIEW_FORMATS))))
+    if image_options.quality is not None and (
+        image_options.image_format not in ('jpeg', 'webp') or not 1 <= image_options.quality <= 100
+    ):
+        abort(400, 'Quality must be from 1 to 100, and can only be set for jpeg or webp')
+    return image_options
+
+
+def _rasterise_page(data, page_number, resolution=DEFAULT_IMAGE_OPTIONS.resolution):
+    with Image(blob=get_single_page_of_pdf(data, page_number), resolution=resolution) as pdf:
         pdf_width, pdf_height = pdf.width, pdf.height
-        try:
-            page = pdf.sequence[page_number - 1]
-        except IndexError:
-            abort(400, 'Letter does not have a page {}'.format(page_number))
+        page = pdf.sequence[0]
         pdf_colorspace = pdf.colorspace
-    return _generate_png_page(page, pdf_width, pdf_height, pdf_colorspace, hide_notify)
+    return page, pdf_width, pdf_height, pdf_colorspace
+
+
+@stage('rasterise')
+def _page_images(data, page_number, hide_notify_variants, image_options, rasteriser):
+    """
+    Rasterises a page once, and encodes an image from it for each of `hide_notify_variants`
+
+    :param str rasteriser: wand, or one of app.rasterisers.RASTERISERS
+    :return dict: {hide_notify: image}
+    """
+    if rasteriser == 'wand':
+        page = _rasterise_page(data, page_number, image_options.resolution)
+        return {
+            hide_notify: _generate_page_image(*page, hide_notify, image_options)
+            for hide_notify in hide_notify_variants
+        }
+
+    # fitz and poppler are only loaded if they're used
+    from app.rasterisers import RASTERISERS, encode_page
+
+    image = RASTERISERS[rasteriser](get_single_page_of_pdf(data, page_number), image_options.resolution)
+    return {
+        hide_notify: encode_page(
+            image,
+            image_options,
+            cover_size=_notify_tag_cover_size(image_options.resolution) if hide_notify else None,
+        )
+        for hide_notify in hide_notify_variants
+    }
 
 
 @statsd(namespace="template_preview")
-def _generate_png_page(pdf_page, pdf_width, pdf_height, pdf_colorspace, hide_notify=False):
+def png_from_pdf(data, page_number, hide_notify=False, image_options=DEFAULT_IMAGE_OPTIONS, rasteriser='wand'):
+    return _page_images(data, page_number, (hide_notify,), image_options, rasteriser)[hide_notify]
+
+
+@statsd(namespace="template_preview")
+def pngs_from_pdf_with_and_without_notify_tag(
+    data, page_number, image_options=DEFAULT_IMAGE_OPTIONS, rasteriser='wand'
+):
+    """
+    Rasterises a page once, and makes an image with the NOTIFY tag left as it is, and one with it hidden, from that
+
+    :return dict: {False: image with the tag, True: image with the tag hidden}
+    """
+    return _page_images(data, page_number, (False, True), image_options, rasteriser)
+
+
+def get_single_page_of_pdf(pdf, page_number):
+    """
+    ImageMagick rasterises every page of a blob it's given, so we cut the page we want out of the PDF first. This
+    only reads the page tree, so the cost of rendering a page doesn't grow with the length of the letter.
+
+    :param bytes|BytesIO|PdfFileReader pdf: the whole pdf, or a reader if it has already been parsed
+    :param int page_number: the one-indexed page to keep
+    :return bytes: a one page pdf
+    """
+    if isinstance(pdf, bytes):
+        pdf = BytesIO(pdf)
+    if not isinstance(pdf, PdfFileReader):
+        pdf = PdfFileReader(pdf)
+    if not 1 <= page_number <= pdf.numPages:
+        abort(400, 'Letter does not have a page {}'.format(page_number))
+
+    single_page_pdf = PdfFileWriter()
+    single_page_pdf.addPage(pdf.getPage(page_number - 1))
+    output = BytesIO()
+    single_page_pdf.write(output)
+    return output.getvalue()
+
+
+@statsd(namespace="template_preview")
+def _generate_page_image(
+    pdf_page, pdf_width, pdf_height, pdf_colorspace, hide_notify=False, image_options=DEFAULT_IMAGE_OPTIONS
+):
     output = BytesIO()
     with Image(width=pdf_width, height=pdf_height) as image:
 
@@ -51,19 +176,18 @@ def _generate_png_page(pdf_page, pdf_width, pdf_height, pdf_colorspace, hide_not
 
         image.composite(pdf_page, top=0, left=0)
         if hide_notify:
-            hide_notify_tag(image)
-        with image.convert('png') as converted:
+            hide_notify_tag(image, image_options.resolution)
+        with image.convert(image_options.image_format) as converted:
+            if image_options.image_format in ('jpeg', 'webp'):
+                # unlike png, these can be saved as cmyk, which browsers don't show properly
+                converted.transform_colorspace('srgb')
+            if image_options.quality is not None:
+                converted.compression_quality = image_options.quality
             converted.save(file=output)
     output.seek(0)
     return output
 
 
-@statsd(namespace="template_preview")
-def get_page_count(pdf_data):
-    with Image(blob=pdf_data) as image:
-        return len(image.sequence)
-
-
 @preview_blueprint.route("/preview.json", methods=['POST'])
 @auth.login_required
 @statsd(namespace="template_preview")
@@ -71,7 +195,7 @@ def page_count():
     json = get_and_validate_json_from_request(request, preview_schema)
     return jsonify(
         {
-            'count': get_page_count(get_pdf(get_html(json)).read())
+            'count': get_pdf_metadata_for_html(get_html(json))['page_count']
         }
     )
 
@@ -79,6 +203,7 @@ def page_count():
 @preview_blueprint.route("/preview.<filetype>", methods=['POST'])
 @auth.login_required
 @statsd(namespace="template_preview")
+@admission_control('preview')
 def view_letter_template(filetype):
     """
     POST /preview.pdf with the following json blob
@@ -98,29 +223,60 @@ def view_letter_template(filetype):
         if filetype == 'pdf' and request.args.get('page') is not None:
             abort(400)
 
-        html = get_html(
-            get_and_validate_json_from_request(request, preview_schema)
-        )
+        json = get_and_validate_json_from_request(request, preview_schema)
 
         if filetype == 'pdf':
-            return send_file(
-                filename_or_fp=get_pdf(html),
+            return send_cached_file(
+                current_app.cache.key(*get_request_cache_key_args(json), folder='templated-request', extension='pdf'),
+                lambda: get_pdf_for_request(json),
                 mimetype='application/pdf',
             )
         elif filetype == 'png':
-            return send_file(
-                filename_or_fp=get_png(
-                    html,
-                    int(request.args.get('page', 1)),
+            page_number = int(request.args.get('page', 1))
+            image_options = get_image_options(request.args)
+            response = send_cached_file(
+                current_app.cache.key(
+                    *get_request_cache_key_args(json),
+                    folder='templated-request',
+                    extension=_page_image_extension(page_number, image_options=image_options),
                 ),
-                mimetype='image/png',
+                lambda: get_png_for_request(json, page_number, image_options),
+                mimetype=PREVIEW_FORMATS[image_options.image_format],
             )
+            return prefetch_after(response, prefetch_pngs, json, page_number, image_options)
 
     except Exception as e:
         current_app.logger.error(str(e))
         raise e
 
 
+@preview_blueprint.route("/preview.pngs", methods=['POST'])
+@auth.login_required
+@statsd(namespace="template_preview")
+@admission_control('preview')
+def view_letter_template_pages():
+    """
+    POST /preview.pngs?pages=1-3 with the same json blob as /preview.png
+
+    Returns pngs of several pages (by default all of them) of the letter in one response, base64 encoded, in the form
+    {"page_count": 3, "mimetype": "image/png", "pages": {"1": "...", "2": "...", "3": "..."}}
+
+    Takes the same resolution, format and quality args as /preview.png. The mimetype is the format the pages are in.
+    """
+    html = get_html(
+        get_and_validate_json_from_request(request, preview_schema)
+    )
+    image_options = get_image_options(request.args)
+    pdf = PdfFileReader(BytesIO(get_pdf(html).read()))
+
+    return pngs_as_json(
+        pdf,
+        lambda page_number: get_png(html, page_number, pdf=pdf, image_options=image_options),
+        image_options,
+    )
+
+
+@stage('html')
 def get_html(json):
     filename = f'{json["filename"]}.svg' if json['filename'] else None
 
@@ -135,47 +291,316 @@ def get_html(json):
     ))
 
 
+def get_request_cache_key_args(json):
+    """
+    Everything the html of a templated letter is made from, so it can be looked up in the cache without making the
+    html first. As well as the request json that's the date the letter is dated, where its logo comes from, and the
+    version of notifications-utils, which turns them into html.
+
+    :return tuple: args for `current_app.cache`
+    """
+    return (
+        json_dumps(json, sort_keys=True, separators=(',', ':')),
+        '' if json.get('date') else datetime.utcnow().date().isoformat(),
+        current_app.config['LETTER_LOGO_URL'],
+        notifications_utils_version,
+    )
+
+
+def get_pdf_for_request(json):
+    """
+    Cached by the request json. If that's a miss it falls back to the html-keyed cache, which only needs the html
+    making. The request-keyed copy is uploaded in the background, so a cold request only waits for the html-keyed
+    one.
+    """
+
+    @current_app.cache(
+        *get_request_cache_key_args(json),
+        folder='templated-request',
+        extension='pdf',
+        write_behind=True,
+    )
+    def _get():
+        return BytesIO(get_pdf(get_html(json)).read())
+
+    return _get()
+
+
+def get_png_for_request(json, page_number, image_options, html=None, pdf=None):
+    """
+    Like `get_pdf_for_request`, for a page of the letter
+
+    :param str html: the html of the letter, if it's already been made
+    """
+
+    @current_app.cache(
+        *get_request_cache_key_args(json),
+        folder='templated-request',
+        extension=_page_image_extension(page_number, image_options=image_options),
+        write_behind=True,
+    )
+    def _get():
+        return BytesIO(get_png(
+            html if html is not None else get_html(json),
+            page_number,
+            pdf=pdf,
+            image_options=image_options,
+        ).read())
+
+    return _get()
+
+
+def _file_length(data):
+    """
+    :return int: the number of bytes left to read in `data`, or None if it can't be found without reading them
+    """
+    if not getattr(data, 'seekable', lambda: False)():
+        return None
+    position = data.tell()
+    length = data.seek(0, SEEK_END) - position
+    data.seek(position)
+    return length
+
+
+def send_cached_file(cache_key, get_file, mimetype):
+    """
+    Sends a cached file with the cache key as its ETag. Cache keys are a hash of everything the file is made from, so
+    if the client already has the file it gets a 304 without the file being fetched or rendered.
+
+    Files are streamed as they're read from the cache. If their length is known, clients can ask for a range of bytes.
+
+    With ?redirect=true, a file that's already in S3 isn't sent at all. Instead the client is redirected to a short
+    lived url for it, so it's downloaded from S3 rather than through us. The redirect is a 303, so the client follows
+    it with a GET.
+
+    :param function get_file: returns a file-like of the file, usually by getting it from the cache
+    """
+    if cache_key in request.if_none_match:
+        response = current_app.response_class(status=304)
+        response.set_etag(cache_key)
+        return response
+
+    if request.args.get('redirect') == 'true':
+        url = current_app.cache.presigned_url(cache_key)
+        if url is not None:
+            return redirect(url, code=303)
+
+    data = get_file()
+    length = _file_length(data)
+
+    response = send_file(data, mimetype=mimetype)
+    response.set_etag(cache_key)
+    if length is not None:
+        response.content_length = length
+    return response.make_conditional(request, accept_ranges=True, complete_length=length)
+
+
 def get_pdf(html):
 
     @current_app.cache(html, folder='templated', extension='pdf')
     def _get():
-        return BytesIO(HTML(string=html).write_pdf())
+        pdf = BytesIO(write_pdf(letter_html(html)))
+        # keep a note of the page count etc next to the pdf so we can answer questions without fetching it
+        current_app.cache.set(
+            current_app.cache.key(html, folder='templated', extension='pdf.json'),
+            pdf_metadata_as_file(pdf.getvalue()),
+        )
+        return pdf
 
     return _get()
 
 
-def get_png(html, page_number):
+def get_cached_pdf_metadata(cache_key, get_pdf_file):
+    """
+    Making a pdf caches its metadata next to it, so if the metadata isn't cached, this gets the pdf and then reads
+    back what was cached with it, rather than working it out and caching it a second time.
+
+    :param str cache_key: where the metadata is cached
+    :param function get_pdf_file: returns a file-like of the pdf, from the cache or by making it
+    :return dict: as returned by app.pdf_metadata.get_pdf_metadata
+    """
+    metadata = current_app.cache.get(cache_key)
+    if metadata is None:
+        pdf = get_pdf_file()
+        metadata = current_app.cache.get(cache_key)
+        if metadata is None:
+            # the pdf was cached before we started keeping its metadata next to it
+            metadata = pdf_metadata_as_file(pdf.read())
+            current_app.cache.set(cache_key, metadata)
+            metadata.seek(0)
+    return pdf_metadata_from_file(metadata)
+
+
+def get_pdf_metadata_for_html(html):
+    """
+    :return dict: as returned by app.pdf_metadata.get_pdf_metadata for the pdf of this letter
+    """
+    return get_cached_pdf_metadata(
+        current_app.cache.key(html, folder='templated', extension='pdf.json'),
+        lambda: get_pdf(html),
+    )
+
+
+def _page_image_extension(page_number, hide_notify=False, image_options=DEFAULT_IMAGE_OPTIONS):
+    """
+    For example page01.png, or page01.hide-notify.75dpi.q80.webp. Images made with the default options keep the
+    extension they had before there were any options, so they're still found in the cache.
+    """
+    parts = ['page{0:02d}'.format(page_number)]
+    if hide_notify:
+        parts.append('hide-notify')
+    if image_options.resolution != DEFAULT_IMAGE_OPTIONS.resolution:
+        parts.append('{}dpi'.format(image_options.resolution))
+    if image_options.quality is not None:
+        parts.append('q{}'.format(image_options.quality))
+    parts.append('palette.png' if image_options.image_format == 'png8' else image_options.image_format)
+    return '.'.join(parts)
 
-    @current_app.cache(html, folder='templated', extension='page{0:02d}.png'.format(page_number))
+
+def get_png(html, page_number, pdf=None, image_options=DEFAULT_IMAGE_OPTIONS):
+
+    @current_app.cache(
+        html,
+        folder='templated',
+        extension=_page_image_extension(page_number, image_options=image_options),
+    )
     def _get():
         return png_from_pdf(
-            get_pdf(html).read(),
+            pdf if pdf is not None else get_pdf(html).read(),
             page_number=page_number,
+            image_options=image_options,
+            rasteriser=current_app.config['TEMPLATED_PREVIEW_RASTERISER'],
         )
 
     return _get()
 
 
-def get_png_from_precompiled(encoded_string, page_number, hide_notify):
+def get_png_from_precompiled(pdf_data, page_number, hide_notify, pdf=None, image_options=DEFAULT_IMAGE_OPTIONS):
+    """
+    Cached by the content of the PDF, rather than the base64 string it was sent as. Both versions of a page (with and
+    without the NOTIFY tag hidden) are made from the same raster and cached together.
+
+    :param bytes pdf_data: the decoded pdf
+    :param PdfFileReader pdf: the same pdf, if it's already been parsed
+    """
 
     @current_app.cache(
-        encoded_string.decode('ascii'), hide_notify,
+        pdf_data,
         folder='precompiled',
-        extension='page{0:02d}.png'.format(page_number)
+        extension=_page_image_extension(page_number, hide_notify, image_options),
     )
     def _get():
-        return png_from_pdf(
-            base64.decodebytes(encoded_string),
+        pngs = pngs_from_pdf_with_and_without_notify_tag(
+            pdf if pdf is not None else pdf_data,
             page_number=page_number,
-            hide_notify=hide_notify,
+            image_options=image_options,
+            rasteriser=current_app.config['PRECOMPILED_PREVIEW_RASTERISER'],
         )
+        current_app.cache.set(
+            current_app.cache.key(
+                pdf_data,
+                folder='precompiled',
+                extension=_page_image_extension(page_number, not hide_notify, image_options),
+            ),
+            pngs[not hide_notify],
+        )
+        return pngs[hide_notify]
 
     return _get()
 
 
+def prefetch_after(response, function, *args):
+    """
+    If PREVIEW_PREFETCH is on, calls `function(*args)` in the background once the response has been sent.
+
+    Only responses that had to be rendered are followed by a prefetch. If a page came from the cache, the rest of the
+    letter has almost certainly been prefetched already, and prefetching it again for every page viewed would read the
+    whole letter back from the cache each time.
+    """
+    if current_app.config['PREVIEW_PREFETCH'] and response.status_code == 200 and g.get('cache_missed'):
+        # the request context has gone by the time the response is closed
+        prefetcher = current_app.prefetcher
+        # send_file responses are passed straight through to the server, which closes the file rather than the
+        # response, so call_on_close wouldn't be called
+        response.response = ClosingIterator(response.response, lambda: prefetcher.submit(function, *args))
+    return response
+
+
+def prefetch_pngs(json, page_number, image_options):
+    """
+    Someone looking at one page of a letter usually asks for the rest soon after, so render and cache them now
+    """
+    html = get_html(json)
+    if get_pdf_metadata_for_html(html)['page_count'] == 1:
+        return
+
+    pdf = PdfFileReader(BytesIO(get_pdf(html).read()))
+    for other_page_number in range(1, pdf.numPages + 1):
+        if other_page_number != page_number:
+            get_png_for_request(json, other_page_number, image_options, html=html, pdf=pdf)
+
+
+def prefetch_pngs_from_precompiled(pdf_data, page_number, hide_notify, image_options):
+    """
+    Like `prefetch_pngs`, for precompiled letters
+    """
+    pdf = PdfFileReader(BytesIO(pdf_data))
+    for other_page_number in range(1, pdf.numPages + 1):
+        if other_page_number != page_number:
+            get_png_from_precompiled(pdf_data, other_page_number, hide_notify, pdf=pdf, image_options=image_options)
+
+
+def get_page_numbers(pages, page_count):
+    """
+    Turns a `pages` request arg such as `1-3,5` into a list of page numbers. If it isn't set, every page is returned.
+
+    :param str pages: comma separated page numbers or ranges of page numbers, all one-indexed
+    :param int page_count: the number of pages in the letter
+    :return list: sorted, one-indexed page numbers
+    """
+    if not pages:
+        return list(range(1, page_count + 1))
+
+    page_numbers = set()
+    for part in pages.split(','):
+        first, separator, last = part.partition('-')
+        try:
+            first = int(first)
+            last = int(last) if separator else first
+        except ValueError:
+            abort(400, 'Could not understand pages {}'.format(pages))
+        if first > last:
+            abort(400, 'Could not understand pages {}'.format(pages))
+
+        # checked before the range is expanded, so a huge range can't make us build a huge set
+        for page_number in (first, last):
+            if not 1 <= page_number <= page_count:
+                abort(400, 'Letter does not have a page {}'.format(page_number))
+        page_numbers.update(range(first, last + 1))
+    return sorted(page_numbers)
+
+
+def pngs_as_json(pdf, get_page_png, image_options):
+    """
+    :param PdfFileReader pdf: the letter, already parsed, so it's only parsed once for all of its pages
+    :param function get_page_png: given a page number returns a file-like containing an image of that page
+    :param ImageOptions image_options: what the images were made with, so clients know what format they're in
+    """
+    page_numbers = get_page_numbers(request.args.get('pages'), pdf.numPages)
+    return jsonify({
+        'page_count': pdf.numPages,
+        'mimetype': PREVIEW_FORMATS[image_options.image_format],
+        'pages': {
+            str(page_number): base64.b64encode(get_page_png(page_number).read()).decode('ascii')
+            for page_number in page_numbers
+        },
+    })
+
+
 @preview_blueprint.route("/precompiled-preview.png", methods=['POST'])
 @auth.login_required
 @statsd(namespace="template_preview")
+@admission_control('preview')
 def view_precompiled_letter():
     try:
         encoded_string = request.get_data()
@@ -183,13 +608,58 @@ def view_precompiled_letter():
         if not encoded_string:
             abort(400)
 
-        return send_file(
-            filename_or_fp=get_png_from_precompiled(
-                encoded_string,
-                int(request.args.get('page', 1)),
-                hide_notify=request.args.get('hide_notify', '') == 'true',
+        pdf_data = base64.decodebytes(encoded_string)
+        page_number = int(request.args.get('page', 1))
+        hide_notify = request.args.get('hide_notify', '') == 'true'
+        image_options = get_image_options(request.args)
+
+        response = send_cached_file(
+            current_app.cache.key(
+                pdf_data,
+                folder='precompiled',
+                extension=_page_image_extension(page_number, hide_notify, image_options),
+            ),
+            lambda: get_png_from_precompiled(pdf_data, page_number, hide_notify, image_options=image_options),
+            mimetype=PREVIEW_FORMATS[image_options.image_format],
+        )
+        return prefetch_after(
+            response, prefetch_pngs_from_precompiled, pdf_data, page_number, hide_notify, image_options,
+        )
+
+    # catch invalid pdfs
+    except MissingDelegateError as e:
+        current_app.logger.warning(f"Failed to generate PDF: {e}")
+        abort(400)
+
+
+@preview_blueprint.route("/precompiled-preview.pngs", methods=['POST'])
+@auth.login_required
+@statsd(namespace="template_preview")
+@admission_control('preview')
+def view_precompiled_letter_pages():
+    """
+    POST /precompiled-preview.pngs?pages=1-3 with the same base64 encoded pdf as /precompiled-preview.png
+
+    Returns pngs of several pages (by default all of them) of the letter in one response, in the same form as
+    /preview.pngs
+    """
+    try:
+        encoded_string = request.get_data()
+
+        if not encoded_string:
+            abort(400)
+
+        pdf_data = base64.decodebytes(encoded_string)
+        pdf = PdfFileReader(BytesIO(pdf_data))
+        hide_notify = request.args.get('hide_notify', '') == 'true'
+        image_options = get_image_options(request.args)
+
+        return pngs_as_json(
+            pdf,
+            lambda page_number: get_png_from_precompiled(
+                pdf_data, page_number, hide_notify, pdf=pdf, image_options=image_options,
             ),
-            mimetype='image/png',
+            image_options,
         )
 
     # catch invalid pdfs
@@ -201,6 +671,7 @@ def view_precompiled_letter():
 @preview_blueprint.route("/print.pdf", methods=['POST'])
 @auth.login_required
 @statsd(namespace="template_preview")
+@admission_control('print')
 def print_letter_template():
     """
     POST /print.pdf with the following json blob
@@ -216,24 +687,55 @@ def print_letter_template():
     json = get_and_validate_json_from_request(request, preview_schema)
     filename = f'{json["filename"]}.svg' if json['filename'] else None
 
-    template = LetterPrintTemplate(
-        json['template'],
-        values=json['values'] or None,
-        contact_block=json['letter_contact_block'],
-        # letter assets are hosted on s3
-        admin_base_url=current_app.config['LETTER_LOGO_URL'],
-        logo_file_name=filename,
-    )
-    html = HTML(string=str(template))
-    pdf = BytesIO(html.write_pdf())
-
-    cmyk_pdf = convert_pdf_to_cmyk(pdf)
+    with stage('html'):
+        html = str(LetterPrintTemplate(
+            json['template'],
+            values=json['values'] or None,
+            contact_block=json['letter_contact_block'],
+            # letter assets are hosted on s3
+            admin_base_url=current_app.config['LETTER_LOGO_URL'],
+            logo_file_name=filename,
+        ))
+
+    print_pdf = get_print_pdf(html)
+    if isinstance(print_pdf, BytesIO):
+        # it's just been rendered, or came from a local cache tier, so it's quicker to count its pages than to fetch
+        # its metadata
+        page_count = get_page_count(print_pdf.getvalue())
+    else:
+        page_count = get_print_pdf_metadata(html)['page_count']
 
     response = send_file(
-        cmyk_pdf,
+        print_pdf,
         as_attachment=True,
         attachment_filename='print.pdf'
     )
-    response.headers['X-pdf-page-count'] = get_page_count(cmyk_pdf.read())
-    cmyk_pdf.seek(0)
+    response.headers['X-pdf-page-count'] = page_count
     return response
+
+
+def get_print_pdf(html):
+    """
+    The print ready, CMYK, version of a letter. Its metadata, including its page count, is cached next to it.
+    """
+
+    @current_app.cache(html, folder='print', extension='pdf')
+    def _get():
+        cmyk_pdf = convert_pdf_to_cmyk(BytesIO(write_pdf(letter_html(html))))
+        current_app.cache.set(
+            current_app.cache.key(html, folder='print', extension='pdf.json'),
+            pdf_metadata_as_file(cmyk_pdf.getvalue()),
+        )
+        return cmyk_pdf
+
+    return _get()
+
+
+def get_print_pdf_metadata(html):
+    """
+    :return dict: as returned by app.pdf_metadata.get_pdf_metadata for the print ready pdf of this letter
+    """
+    return get_cached_pdf_metadata(
+        current_app.cache.key(html, folder='print', extension='pdf.json'),
+        lambda: get_print_pdf(html),
+    )
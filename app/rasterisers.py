@@ -0,0 +1,63 @@
+"""
+Rasterisers that render a page with something other than ImageMagick, which app.preview uses by default. They render
+to a Pillow image, which Pillow then encodes in whichever format was asked for.
+
+Which one is used is set per endpoint, by TEMPLATED_PREVIEW_RASTERISER and PRECOMPILED_PREVIEW_RASTERISER.
+"""
+from io import BytesIO
+
+import fitz
+from pdf2image import convert_from_bytes
+from PIL import Image, ImageDraw
+
+
+def rasterise_with_fitz(single_page_pdf, resolution):
+    """
+    :param bytes single_page_pdf: a pdf with one page
+    :param int resolution: in dpi
+    :return PIL.Image.Image: the page, in RGB
+    """
+    doc = fitz.open(stream=single_page_pdf, filetype='pdf')
+    try:
+        # pdfs are measured in points, of which there are 72 to the inch
+        pixmap = doc[0].getPixmap(matrix=fitz.Matrix(resolution / 72, resolution / 72), alpha=False)
+    finally:
+        doc.close()
+    return Image.frombytes('RGB', [pixmap.width, pixmap.height], pixmap.samples)
+
+
+def rasterise_with_pdf2image(single_page_pdf, resolution):
+    """
+    Renders with poppler's pdftoppm. Takes the same arguments as `rasterise_with_fitz`.
+    """
+    return convert_from_bytes(single_page_pdf, dpi=resolution)[0].convert('RGB')
+
+
+RASTERISERS = {
+    'fitz': rasterise_with_fitz,
+    'pdf2image': rasterise_with_pdf2image,
+}
+
+
+def encode_page(image, image_options, cover_size=None):
+    """
+    :param PIL.Image.Image image: a rasterised page, which is left as it is
+    :param app.preview.ImageOptions image_options: the format and quality to encode the page with
+    :param tuple cover_size: if set, the width and height of a white block to put over the top left corner
+    :return BytesIO: the encoded image
+    """
+    if cover_size:
+        image = image.copy()
+        ImageDraw.Draw(image).rectangle([(0, 0), (cover_size[0] - 1, cover_size[1] - 1)], fill='white')
+
+    output = BytesIO()
+    if image_options.image_format == 'png8':
+        image.quantize(colors=256).save(output, 'PNG')
+    elif image_options.image_format == 'png':
+        image.save(output, 'PNG')
+    elif image_options.quality is not None:
+        image.save(output, image_options.image_format.upper(), quality=image_options.quality)
+    else:
+        image.save(output, image_options.image_format.upper())
+    output.seek(0)
+    return output
@@ -0,0 +1,53 @@
+import os
+
+from flask import request
+from flask_weasyprint import make_url_fetcher
+from weasyprint import HTML
+from weasyprint.fonts import FontConfiguration
+
+from app.logos import logo_url_fetcher
+from app.timing import stage
+
+_font_config = None
+_font_config_pid = None
+
+
+def get_font_config():
+    """
+    Building a FontConfiguration has fontconfig and pango look up every font on the system, which WeasyPrint would
+    otherwise do for every letter. Letters don't bring their own fonts (no @font-face), so one per process is shared
+    by every render. It's rebuilt after a fork rather than shared with the parent.
+    """
+    global _font_config, _font_config_pid
+
+    if _font_config is None or _font_config_pid != os.getpid():
+        _font_config = FontConfiguration()
+        _font_config_pid = os.getpid()
+    return _font_config
+
+
+@stage('weasyprint')
+def write_pdf(html):
+    """
+    :param weasyprint.HTML html: the letter to render
+    :return bytes: the rendered pdf
+    """
+    return html.write_pdf(font_config=get_font_config())
+
+
+def letter_url_fetcher():
+    """
+    Pass as the url_fetcher of letter HTML, so logos come from the logo cache. Like flask_weasyprint's own fetcher
+    this needs a request context when it's made.
+    """
+    return make_url_fetcher(next_fetcher=logo_url_fetcher)
+
+
+def letter_html(html):
+    """
+    :param str html: a letter's html
+    :return weasyprint.HTML: the letter, ready to render, with its logo coming from the logo cache. flask_weasyprint's
+        HTML would replace the url_fetcher with its own, so this uses WeasyPrint's and sets the base url the same way.
+        Needs a request context.
+    """
+    return HTML(string=html, base_url=request.url, url_fetcher=letter_url_fetcher())
@@ -0,0 +1,74 @@
+"""
+Breaks down how long a request or Celery task spends in each stage of making a letter, such as building the html,
+laying it out with WeasyPrint, running Ghostscript or reading from S3.
+
+Stages are timed with `stage`, and added up per request in `flask.g`. At the end of a request they're sent back in a
+Server-Timing header, as statsd timers and in one log line.
+"""
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+
+
+def start_stage_timings():
+    g.stage_timings = OrderedDict()
+
+
+def get_stage_timings():
+    """
+    :return OrderedDict: seconds spent in each stage, in the order they were first entered
+    """
+    if not has_app_context():
+        return OrderedDict()
+    return g.get('stage_timings', OrderedDict())
+
+
+@contextmanager
+def stage(name):
+    """
+    Adds the time the block takes to the `name` stage of the current request or task. Can be used as a decorator.
+    Outside an app context it does nothing.
+    """
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        if has_app_context():
+            stage_timings = g.setdefault('stage_timings', OrderedDict())
+            stage_timings[name] = stage_timings.get(name, 0) + time.monotonic() - start
+
+
+def format_server_timing(stage_timings):
+    return ', '.join(
+        '{};dur={:.1f}'.format(name, seconds * 1000) for name, seconds in stage_timings.items()
+    )
+
+
+def format_stage_timings(stage_timings):
+    return ' '.join(
+        '{}={:.1f}ms'.format(name, seconds * 1000) for name, seconds in stage_timings.items()
+    )
+
+
+def record_stage_timings(statsd_client, stage_timings):
+    for name, seconds in stage_timings.items():
+        statsd_client.timing('stages.{}'.format(name), seconds)
+
+
+def init_stage_timing(application):
+    @application.before_request
+    def start_timing_stages():
+        start_stage_timings()
+
+    @application.after_request
+    def report_stage_timings(response):
+        stage_timings = get_stage_timings()
+        if stage_timings:
+            response.headers['Server-Timing'] = format_server_timing(stage_timings)
+            record_stage_timings(application.statsd_client, stage_timings)
+            application.logger.info('{} {} {} stages: {}'.format(
+                request.method, request.path, response.status_code, format_stage_timings(stage_timings),
+            ))
+        return response
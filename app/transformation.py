@@ -2,53 +2,48 @@
 from io import BytesIO
 import subprocess
 
-import fitz
 from flask import current_app
 
-from app import InvalidRequest
-
-
-def _does_pdf_contain_colorspace(colourspace, data):
-    doc = fitz.open(stream=data, filetype="pdf")
-    for i in range(len(doc)):
-        try:
-            page = doc.getPageImageList(i)
-        except RuntimeError:
-            current_app.logger.warning("Fitz couldn't read page info for page {}".format(i + 1))
-            raise InvalidRequest("Invalid PDF on page {}".format(i + 1))
-        for img in page:
-            xref = img[0]
-            pix = fitz.Pixmap(doc, xref)
-            if colourspace in pix.colorspace.__str__():
-                data.seek(0)
-                return True
-    data.seek(0)
-    return False
+from app.precompiled_document import PrecompiledDocument
+from app.timing import stage
 
 
 def does_pdf_contain_cmyk(data):
-    return _does_pdf_contain_colorspace("CMYK", data)
+    return PrecompiledDocument.from_file(data).contains_colourspace("CMYK")
 
 
 def does_pdf_contain_rgb(data):
-    return _does_pdf_contain_colorspace("RGB", data)
+    return PrecompiledDocument.from_file(data).contains_colourspace("RGB")
+
 
+# arguments for both a one-off `gs` and a ghostscript worker
+CMYK_GHOSTSCRIPT_ARGS = (
+    '-dCompatibilityLevel=1.7',
+    '-sDEVICE=pdfwrite',
+    '-sColorConversionStrategy=CMYK',
+    '-sSourceObjectICC=app/ghostscript/control.txt',
+    '-dBandBufferSpace=100000000',
+    '-dBufferSpace=100000000',
+    '-dMaxPatternBitmap=1000000',
+)
+CMYK_GHOSTSCRIPT_POSTSCRIPT = '100000000 setvmthreshold'
 
+
+@stage('ghostscript-cmyk')
 def convert_pdf_to_cmyk(input_data):
+    if current_app.config['GHOSTSCRIPT_POOL']:
+        return BytesIO(current_app.ghostscript_pool.run(
+            input_data.read(), CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT
+        ))
+
     gs_process = subprocess.Popen(
         [
             'gs',
             '-q',
             '-o',
             '-',
-            '-dCompatibilityLevel=1.7',
-            '-sDEVICE=pdfwrite',
-            '-sColorConversionStrategy=CMYK',
-            '-sSourceObjectICC=app/ghostscript/control.txt',
-            '-dBandBufferSpace=100000000',
-            '-dBufferSpace=100000000',
-            '-dMaxPatternBitmap=1000000',
-            '-c', '100000000 setvmthreshold',
+            *CMYK_GHOSTSCRIPT_ARGS,
+            '-c', CMYK_GHOSTSCRIPT_POSTSCRIPT,
             '-f', '-'
         ],
         stdin=subprocess.PIPE,
@@ -0,0 +1,59 @@
+"""
+Gets the slow, one-off parts of rendering letters out of the way before a worker takes any requests.
+
+`warm_up_process` runs in the gunicorn master when the app is preloaded, so everything it loads is shared with the
+workers copy-on-write. It only loads things, and leaves anything that could start threads for after the fork.
+`warm_up_worker` then renders a small letter in each worker, before it accepts traffic.
+"""
+import time
+
+from wand.version import formats as imagemagick_formats
+
+from app.precompiled import get_notify_tag_font, register_font
+from app.preview import DEFAULT_IMAGE_OPTIONS, get_html, png_from_pdf
+from app.rendering import get_font_config, letter_html, write_pdf
+
+WARM_UP_LETTER = {
+    'letter_contact_block': 'Warm up',
+    'template': {
+        'subject': 'Warm up',
+        'content': 'Warm up',
+    },
+    'values': {
+        'address_line_1': 'Warm up',
+        'postcode': 'SW1A 1AA',
+    },
+    'filename': None,
+}
+
+
+def warm_up_process(application):
+    start = time.monotonic()
+
+    register_font()
+    get_notify_tag_font()
+    # has ImageMagick read its config and find its delegates, including Ghostscript for pdfs
+    imagemagick_formats('PDF')
+    # each worker makes its own after the fork, but fontconfig's caches are in memory by then
+    get_font_config()
+
+    application.logger.info('Warmed up process in {:.0f}ms'.format((time.monotonic() - start) * 1000))
+
+
+def warm_up_worker(application):
+    """
+    Renders a letter with no logo as a pdf, then as a png, without touching the preview cache
+    """
+    start = time.monotonic()
+    try:
+        with application.test_request_context():
+            pdf = write_pdf(letter_html(get_html(WARM_UP_LETTER)))
+            png_from_pdf(pdf, 1, image_options=DEFAULT_IMAGE_OPTIONS._replace(resolution=50))
+    except Exception:
+        # a worker that couldn't warm up can still serve requests, just more slowly at first
+        application.logger.exception('Failed to warm up worker')
+        return
+
+    elapsed = time.monotonic() - start
+    application.statsd_client.timing('gunicorn.worker-warm-up', elapsed)
+    application.logger.info('Warmed up worker in {:.0f}ms'.format(elapsed * 1000))
@@ -0,0 +1,75 @@
+"""
+Measures how much slower the first letters a fresh worker renders are than the ones after, and how much of that
+warming up the process and worker before it takes requests saves.
+
+    python -m benchmarks.cold_start [--letters 3] [--json results.json]
+"""
+import argparse
+import time
+from io import BytesIO
+
+from benchmarks.utils import dump_json, get_app, print_table, run_isolated
+
+TEMPLATE = {
+    'subject': 'Your application reference ((reference))',
+    'content': 'Dear ((name)),\n\nThank you for your application.',
+}
+
+
+def _boot_and_render(letter_count, warm_up):
+    start = time.perf_counter()
+    app = get_app()
+    timings = {'boot_ms': (time.perf_counter() - start) * 1000, 'warm_up_ms': 0}
+
+    from app.precompiled import add_notify_tag_to_letter
+    from app.preview import get_html, png_from_pdf
+    from app.rendering import letter_html, write_pdf
+    from app.warmup import warm_up_process, warm_up_worker
+
+    if warm_up:
+        start = time.perf_counter()
+        warm_up_process(app)
+        warm_up_worker(app)
+        timings['warm_up_ms'] = (time.perf_counter() - start) * 1000
+
+    with open('tests/test_pdfs/multi_page_pdf.pdf', 'rb') as f:
+        precompiled_pdf = f.read()
+
+    with app.test_request_context():
+        for i in range(letter_count):
+            start = time.perf_counter()
+            pdf = write_pdf(letter_html(get_html({
+                'letter_contact_block': '123',
+                'template': TEMPLATE,
+                'values': {'name': 'Person {}'.format(i), 'reference': 'REF-{:06d}'.format(i)},
+                'filename': None,
+            })))
+            png_from_pdf(pdf, 1)
+            add_notify_tag_to_letter(BytesIO(precompiled_pdf))
+            timings['letter_{}_ms'.format(i + 1)] = (time.perf_counter() - start) * 1000
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--letters', type=int, default=3)
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    rows = []
+    for mode, warm_up in (('cold', False), ('warmed-up', True)):
+        result = run_isolated(_boot_and_render, args.letters, warm_up)
+        rows.append({
+            'mode': mode,
+            'peak_rss_mb': round(result['peak_rss_mb'], 1),
+            **{name: round(value, 1) for name, value in result['result'].items()},
+        })
+
+    letter_columns = ['letter_{}_ms'.format(i + 1) for i in range(args.letters)]
+    print_table(rows, ['mode', 'boot_ms', 'warm_up_ms', *letter_columns, 'peak_rss_mb'])
+    if args.json_path:
+        dump_json(rows, args.json_path)
+
+
+if __name__ == '__main__':
+    main()
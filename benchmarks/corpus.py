@@ -0,0 +1,147 @@
+"""
+Synthetic letters for the benchmark suite, so it doesn't depend on real letters or anything on the network.
+
+`templated_letters` are json blobs like the ones the api sends to /preview.* and the create-pdf Celery task.
+`precompiled_letters` are pdfs like the ones services upload, built to pass validation so that sanitising them does all
+of its work. Both are generated the same way every time, so results can be compared between runs.
+"""
+import random
+from io import BytesIO
+
+from PIL import Image
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from app.precompiled import (
+    ADDRESS_LEFT_FROM_LEFT_OF_PAGE,
+    ADDRESS_LINE_HEIGHT,
+    ADDRESS_TOP_FROM_TOP_OF_PAGE,
+    BODY_TOP_FROM_TOP_OF_PAGE,
+    BORDER_BOTTOM_FROM_TOP_OF_PAGE,
+    BORDER_LEFT_FROM_LEFT_OF_PAGE,
+    FONT,
+    register_font,
+)
+from benchmarks.utils import letter_with_pages
+
+PARAGRAPH = (
+    'Thank you for your application. We have looked at the information you gave us and have made a decision. '
+    'You can find the details of the decision, and what you need to do next, below. '
+)
+
+SHORT_ADDRESS = ['A. Person', '1 Example Street', 'SW1A 1AA']
+# the most lines an address can have, each as long as it can be
+LONG_ADDRESS = [
+    'Dr Alexandria Bartholomew-Fotheringham-Smythe',
+    'Flat 123, The Old Building Society Buildings',
+    'Apartment Complex of Long Street Names',
+    '1234 Extraordinarily Long Thoroughfare Road',
+    'Little Snoring-on-the-Marsh Industrial Estate',
+    'Royal Tunbridge Wells, Kent',
+    'TN1 1AA',
+]
+
+TEMPLATE_PAGE = '\n\n'.join([PARAGRAPH * 6] * 4)
+
+
+def _templated_letter(page_count, address=SHORT_ADDRESS, filename=None):
+    values = {'address_line_{}'.format(i + 1): line for i, line in enumerate(address[:-1])}
+    values['postcode'] = address[-1]
+    return {
+        'letter_contact_block': 'Notify\nWhitechapel\nLondon\nE1 8QS',
+        'template': {
+            'subject': 'Your application reference ((reference))',
+            # roughly a page of text for each page asked for
+            'content': '\n\n'.join(['Dear ((name)),'] + [TEMPLATE_PAGE] * page_count),
+        },
+        'values': {**values, 'name': address[0], 'reference': 'REF-000001'},
+        'filename': filename,
+    }
+
+
+def templated_letters():
+    """
+    :return dict: json blobs for /preview.* and /print.pdf, by name
+    """
+    return {
+        '1-page': _templated_letter(1),
+        '3-page': _templated_letter(3),
+        '10-page': _templated_letter(10),
+        'long-address': _templated_letter(1, address=LONG_ADDRESS),
+        # needs LETTER_LOGO_LOCAL_DIRECTORY to point at tests/test_pdfs to render without the network
+        'logo': _templated_letter(1, filename='hm-government'),
+    }
+
+
+def _noise_image(width, height, mode, seed):
+    """
+    Random pixels, so the image doesn't compress away to nothing like a flat colour would
+    """
+    size = width * height * len(mode)
+    image = Image.frombytes(mode, (width, height), random.Random(seed).getrandbits(size * 8).to_bytes(size, 'big'))
+    output = BytesIO()
+    # CMYK can't be saved as png
+    image.save(output, format='TIFF' if mode == 'CMYK' else 'PNG')
+    output.seek(0)
+    return ImageReader(output)
+
+
+def _precompiled_letter(page_count, address=SHORT_ADDRESS, images_per_page=0, image_mode='RGB', embed_fonts=True):
+    """
+    :return bytes: an A4 pdf with the address in the address block and text and images only in the printable area
+    """
+    if embed_fonts:
+        register_font()
+        font = FONT
+    else:
+        # one of the standard pdf fonts, which pdfs can use without embedding
+        font = 'Helvetica'
+
+    _, page_height = A4
+    left = BORDER_LEFT_FROM_LEFT_OF_PAGE * mm
+    output = BytesIO()
+    pdf = canvas.Canvas(output, pagesize=A4)
+    for page_number in range(page_count):
+        if page_number == 0:
+            pdf.setFont(font, 8)
+            y = page_height - ADDRESS_TOP_FROM_TOP_OF_PAGE * mm - ADDRESS_LINE_HEIGHT
+            for line in address:
+                pdf.drawString(ADDRESS_LEFT_FROM_LEFT_OF_PAGE * mm, y, line)
+                y -= ADDRESS_LINE_HEIGHT
+
+        pdf.setFont(font, 10)
+        y = page_height - BODY_TOP_FROM_TOP_OF_PAGE * mm
+        for line_number in range(40):
+            pdf.drawString(left, y, PARAGRAPH[:90])
+            y -= 12
+
+        for image_number in range(images_per_page):
+            pdf.drawImage(
+                _noise_image(300, 200, image_mode, seed=page_number * images_per_page + image_number),
+                left + (image_number % 2) * 90 * mm,
+                (page_height - BORDER_BOTTOM_FROM_TOP_OF_PAGE * mm) + 5 * mm + (image_number // 2) * 62 * mm,
+                width=85 * mm,
+                height=57 * mm,
+            )
+        pdf.showPage()
+    pdf.save()
+    return output.getvalue()
+
+
+def precompiled_letters():
+    """
+    :return dict: pdfs for /precompiled/sanitise, /precompiled/overlay.* and the sanitise Celery task, by name
+    """
+    return {
+        '1-page-embedded-fonts': _precompiled_letter(1),
+        '1-page-unembedded-fonts': _precompiled_letter(1, embed_fonts=False),
+        '10-page': _precompiled_letter(10),
+        'long-address': _precompiled_letter(1, address=LONG_ADDRESS),
+        'rgb-images': _precompiled_letter(3, images_per_page=2),
+        'cmyk-images': _precompiled_letter(3, images_per_page=2, image_mode='CMYK'),
+        'image-heavy': _precompiled_letter(5, images_per_page=4),
+        # a real letter with lots of fonts and vector drawing, repeated
+        'multi-page-sample': letter_with_pages(10),
+    }
@@ -0,0 +1,75 @@
+"""
+Compares converting letters to CMYK with a new `gs` for each one against the pool of long-lived ghostscript workers,
+on throughput and latency across a run of letters.
+
+    python -m benchmarks.ghostscript_pool [--letters 1000] [--concurrency 2] [--json results.json]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from benchmarks.utils import dump_json, get_app, print_table, summarise
+
+LETTERS = (
+    'tests/test_pdfs/valid_letter.pdf',
+    'tests/test_pdfs/example_dwp_pdf.pdf',
+    'tests/test_pdfs/multi_page_pdf.pdf',
+    'tests/test_pdfs/rgb_image.pdf',
+    'tests/test_pdfs/cmyk_image.pdf',
+)
+
+
+def _convert_letters(app, letters, concurrency):
+    from app.transformation import convert_pdf_to_cmyk
+
+    def convert(data):
+        with app.app_context():
+            start = time.perf_counter()
+            convert_pdf_to_cmyk(BytesIO(data))
+            return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        timings = list(executor.map(convert, letters))
+    return time.perf_counter() - start, timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--letters', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=2)
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    corpus = []
+    for path in LETTERS:
+        with open(path, 'rb') as f:
+            corpus.append(f.read())
+    letters = [corpus[i % len(corpus)] for i in range(args.letters)]
+
+    app = get_app()
+    app.config['GHOSTSCRIPT_POOL_SIZE'] = args.concurrency
+
+    rows = []
+    for mode in ('subprocess', 'pool'):
+        app.config['GHOSTSCRIPT_POOL'] = mode == 'pool'
+        seconds, timings = _convert_letters(app, letters, args.concurrency)
+        timings.sort()
+        rows.append({
+            'mode': mode,
+            'letters': len(letters),
+            'seconds': round(seconds, 1),
+            'letters_per_s': round(len(letters) / seconds, 1),
+            'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 2),
+            **summarise(timings),
+        })
+    app.ghostscript_pool.stop()
+
+    print_table(rows, ['mode', 'letters', 'seconds', 'letters_per_s', 'median_ms', 'p95_ms', 'max_ms'])
+    if args.json_path:
+        dump_json(rows, args.json_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Compares counting the pages of a letter by rasterising it against reading the page tree.
+
+    python -m benchmarks.page_count [--max-pages 10] [--repeat 5] [--json results.json]
+"""
+import argparse
+
+from wand.image import Image
+
+from benchmarks.utils import dump_json, get_app, letter_with_pages, print_table, summarise, time_call
+
+
+def _count_by_rasterising(pdf_data):
+    # how get_page_count used to work
+    with Image(blob=pdf_data) as image:
+        return len(image.sequence)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-pages', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    from app.preview import get_page_count
+
+    rows = []
+    with get_app().test_request_context():
+        for page_count in range(1, args.max_pages + 1):
+            data = letter_with_pages(page_count)
+            for strategy, count_pages in (
+                ('rasterise', _count_by_rasterising),
+                ('page-tree', get_page_count),
+            ):
+                assert count_pages(data) == page_count
+                rows.append({
+                    'pages': page_count,
+                    'strategy': strategy,
+                    **summarise(time_call(count_pages, data, repeat=args.repeat)),
+                })
+
+    print_table(rows, ['pages', 'strategy', 'min_ms', 'median_ms', 'max_ms'])
+    if args.json_path:
+        dump_json(rows, args.json_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Compares rendering one page of a letter by rasterising the whole document against cutting the page out first.
+
+    python -m benchmarks.png_from_pdf [--max-pages 10] [--repeat 5] [--json results.json]
+"""
+import argparse
+
+from wand.image import Image
+
+from benchmarks.utils import (
+    dump_json,
+    get_app,
+    letter_with_pages,
+    print_table,
+    run_isolated,
+    summarise,
+    time_call,
+)
+
+
+def _rasterise_whole_document(data, page_number):
+    # how png_from_pdf used to work - every page is rasterised, then all but one thrown away
+    with Image(blob=data, resolution=150) as pdf:
+        page = pdf.sequence[page_number - 1]
+        with Image(page) as image:
+            return image.make_blob('png')
+
+
+def _measure(strategy, page_count, repeat):
+    from app.preview import png_from_pdf
+
+    render = {
+        'whole-document': _rasterise_whole_document,
+        'single-page': lambda data, page_number: png_from_pdf(data, page_number).read(),
+    }[strategy]
+
+    data = letter_with_pages(page_count)
+    with get_app().test_request_context():
+        # always ask for the last page, the worst case for the old approach
+        return summarise(time_call(render, data, page_count, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-pages', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    rows = []
+    for page_count in range(1, args.max_pages + 1):
+        for strategy in ('whole-document', 'single-page'):
+            measured = run_isolated(_measure, strategy, page_count, args.repeat)
+            rows.append({
+                'pages': page_count,
+                'strategy': strategy,
+                'peak_rss_mb': round(measured['peak_rss_mb'], 1),
+                **measured['result'],
+            })
+
+    print_table(rows, ['pages', 'strategy', 'median_ms', 'max_ms', 'peak_rss_mb'])
+    if args.json_path:
+        dump_json(rows, args.json_path)
+
+
+if __name__ == '__main__':
+    main()
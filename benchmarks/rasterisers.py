@@ -0,0 +1,95 @@
+"""
+Compares the rasterisers previews can be rendered with, on how long they take, how much memory they use and how
+closely their pngs match the ones ImageMagick makes.
+
+    python -m benchmarks.rasterisers [--repeat 5] [--resolution 150] [--json results.json]
+"""
+import argparse
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageStat
+
+from benchmarks.utils import dump_json, get_app, print_table, run_isolated, summarise, time_call
+
+LETTERS = (
+    'tests/test_pdfs/valid_letter.pdf',
+    'tests/test_pdfs/example_dwp_pdf.pdf',
+    'tests/test_pdfs/cmyk_image.pdf',
+    'tests/test_pdfs/rgb_image.pdf',
+    'tests/test_pdfs/landscape_rotated_page.pdf',
+)
+
+
+def _render(path, rasteriser, resolution, repeat):
+    from app.preview import DEFAULT_IMAGE_OPTIONS, png_from_pdf
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    image_options = DEFAULT_IMAGE_OPTIONS._replace(resolution=resolution)
+
+    def render():
+        return png_from_pdf(data, 1, image_options=image_options, rasteriser=rasteriser).read()
+
+    with get_app().test_request_context():
+        return {
+            'timings': time_call(render, repeat=repeat),
+            'png': render(),
+        }
+
+
+def _difference(png, reference_png):
+    """
+    :return tuple: the mean difference of every channel of every pixel, from 0 to 255, and the percentage of pixels
+        that differ by more than 32 in any channel
+    """
+    image = Image.open(BytesIO(png)).convert('RGB')
+    reference = Image.open(BytesIO(reference_png)).convert('RGB')
+    if image.size != reference.size:
+        # rasterisers round the size of the page differently, so may be a pixel out
+        image = image.resize(reference.size)
+
+    difference = ImageChops.difference(image, reference)
+    mean_difference = sum(ImageStat.Stat(difference).mean) / 3
+    changed_pixels = sum(
+        1 for pixel in difference.getdata() if max(pixel) > 32
+    ) / (reference.size[0] * reference.size[1])
+    return round(mean_difference, 2), round(changed_pixels * 100, 2)
+
+
+def main():
+    from app.rasterisers import RASTERISERS
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--resolution', type=int, default=150)
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    rows = []
+    for path in LETTERS:
+        reference_png = None
+        for rasteriser in ['wand'] + sorted(RASTERISERS):
+            measured = run_isolated(_render, path, rasteriser, args.resolution, args.repeat)
+            png = measured['result']['png']
+            if reference_png is None:
+                reference_png = png
+            mean_difference, changed_pixels = _difference(png, reference_png)
+            rows.append({
+                'letter': path.rsplit('/', 1)[-1],
+                'rasteriser': rasteriser,
+                'peak_rss_mb': round(measured['peak_rss_mb'], 1),
+                'png_kb': round(len(png) / 1024, 1),
+                'mean_diff': mean_difference,
+                'changed_%': changed_pixels,
+                **summarise(measured['result']['timings']),
+            })
+
+    print_table(rows, [
+        'letter', 'rasteriser', 'median_ms', 'max_ms', 'peak_rss_mb', 'png_kb', 'mean_diff', 'changed_%',
+    ])
+    if args.json_path:
+        dump_json(rows, args.json_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Counts how many times sanitising a precompiled letter parses a pdf with each library, and how long it takes, with each
+version of the letter parsed once and shared between checks, against parsing it again for every check as sanitising
+used to.
+
+The counts include the small pages reportlab draws to overlay onto the letter, which are parsed the same either way.
+
+    python -m benchmarks.sanitise_parses [--repeat 5] [--json results.json]
+"""
+import argparse
+from collections import Counter
+from contextlib import ExitStack
+from unittest import mock
+
+import fitz
+import pdfrw
+from PyPDF2 import PdfFileReader
+
+from app import precompiled
+from app.precompiled_document import PrecompiledDocument
+from benchmarks.corpus import precompiled_letters
+from benchmarks.utils import dump_json, get_app, print_table, summarise, time_call
+
+
+def _counting(counts, name, function):
+    def wrapper(*args, **kwargs):
+        counts[name] += 1
+        return function(*args, **kwargs)
+    return wrapper
+
+
+def _copy_every_time(cls, pdf):
+    pdf.seek(0)
+    document = cls(pdf.read())
+    pdf.seek(0)
+    return document
+
+
+def _count_parses(sanitise, data):
+    """
+    :return tuple: what sanitising the letter returned, and how many times each library parsed a pdf
+    """
+    counts = Counter()
+    with ExitStack() as patches:
+        for name, owner, attribute in (
+            ('PyPDF2', PdfFileReader, '__init__'),
+            ('fitz', fitz.Document, '__init__'),
+            ('pdfrw', pdfrw.PdfReader, '__init__'),
+            ('pdf2image', precompiled, 'convert_from_bytes'),
+        ):
+            patches.enter_context(
+                mock.patch.object(owner, attribute, _counting(counts, name, getattr(owner, attribute)))
+            )
+        result = sanitise(data)
+    return result, counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    def sanitise(data):
+        result = precompiled.sanitise_file_contents(data, allow_international_letters=False)
+        return result['message'] or 'sanitised'
+
+    rows = []
+    with get_app().test_request_context():
+        for letter_name, data in precompiled_letters().items():
+            for strategy in ('parse-per-check', 'shared'):
+                with ExitStack() as patches:
+                    if strategy == 'parse-per-check':
+                        patches.enter_context(
+                            mock.patch.object(PrecompiledDocument, 'from_file', classmethod(_copy_every_time))
+                        )
+                    result, counts = _count_parses(sanitise, data)
+                    rows.append({
+                        'letter': letter_name,
+                        'strategy': strategy,
+                        'result': result,
+                        **{name: counts[name] for name in ('PyPDF2', 'fitz', 'pdfrw', 'pdf2image')},
+                        **summarise(time_call(sanitise, data, repeat=args.repeat)),
+                    })
+
+    print_table(rows, ['letter', 'strategy', 'result', 'PyPDF2', 'fitz', 'pdfrw', 'pdf2image', 'median_ms'])
+    if args.json_path:
+        dump_json(rows, args.json_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Measures how long importing each of the app's modules, and creating the app for the web and for Celery, takes in a
+fresh interpreter, and which of the heavy pdf and image libraries each one loads.
+
+    python -m benchmarks.startup [--repeat 5] [--json results.json]
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from benchmarks.utils import dump_json, print_table, summarise
+
+HEAVY_MODULES = (
+    'wand.image',
+    'fitz',
+    'weasyprint',
+    'reportlab.pdfgen',
+    'pdf2image',
+    'PIL.Image',
+    'PyPDF2',
+    'notifications_utils.template',
+)
+
+TARGETS = (
+    ('import app', 'import app'),
+    ('import app.cache', 'import app.cache'),
+    ('import app.rendering', 'import app.rendering'),
+    ('import app.transformation', 'import app.transformation'),
+    ('import app.pdf_metadata', 'import app.pdf_metadata'),
+    ('import app.precompiled', 'import app.precompiled'),
+    ('import app.preview', 'import app.preview'),
+    ('import app.rasterisers', 'import app.rasterisers'),
+    ('import app.celery.tasks', 'import app.celery.tasks'),
+    ('create_app (web)', 'from app import create_app; create_app()'),
+    # what run_celery.py does, then the task modules Celery imports
+    (
+        'create_app (celery)',
+        'from app import create_app; create_app(register_blueprints=False); import app.celery.tasks',
+    ),
+)
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed_ms = (time.perf_counter() - start) * 1000
+json.dump({{'ms': elapsed_ms, 'loaded': [name for name in {heavy_modules!r} if name in sys.modules]}}, sys.stdout)
+'''
+
+
+def _time_in_fresh_interpreter(statement):
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD.format(statement=statement, heavy_modules=HEAVY_MODULES)],
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    return json.loads(output.decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    rows = []
+    for name, statement in TARGETS:
+        results = [_time_in_fresh_interpreter(statement) for _ in range(args.repeat)]
+        rows.append({
+            'target': name,
+            **summarise([result['ms'] for result in results]),
+            'loads': ','.join(name.split('.')[0] for name in results[0]['loaded']) or '-',
+        })
+
+    print_table(rows, ['target', 'min_ms', 'median_ms', 'max_ms'])
+    for row in rows:
+        sys.stdout.write('{}: {}\n'.format(row['target'], row['loads']))
+    if args.json_path:
+        dump_json(rows, args.json_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""
+Runs every endpoint and Celery task that makes or changes a letter against the synthetic letters in
+`benchmarks.corpus`, without the network, and records how long each one takes, how much CPU and memory it uses and
+how big its output is.
+
+S3 is replaced with moto, logos are read from tests/test_pdfs and the tasks the Celery tasks would send back to the api
+are dropped. The preview cache, including the memory and disk tiers if they're configured, is emptied before every
+run, so previews are always rendered. Otherwise the app runs with its usual config, including anything set in the
+environment, so a change behind a setting can be compared against a baseline by running the suite again with it
+turned on.
+
+    python -m benchmarks.suite [--repeat 5] [--only preview.png] [--json baseline.json]
+    python -m benchmarks.suite --compare baseline.json [--threshold 0.2] [--json results.json]
+
+With --compare, a case is a regression if its p50, p95, CPU time, peak RSS or output size is more than `threshold`
+worse than in the baseline, or its status has changed. They're listed, and the script exits with status 1.
+"""
+import argparse
+import base64
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+from io import BytesIO
+from unittest import mock
+
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_s3
+from PyPDF2 import PdfFileReader, PdfFileWriter
+
+from app import notify_celery
+from benchmarks.corpus import precompiled_letters, templated_letters
+from benchmarks.utils import dump_json, get_app, percentile, print_table, run_isolated
+
+LETTER_FILENAME = 'benchmark.pdf'
+NOTIFICATION_ID = 'benchmark-notification'
+
+REGRESSION_METRICS = ('p50_ms', 'p95_ms', 'cpu_ms', 'peak_rss_mb', 'output_bytes')
+
+
+def _first_page(pdf_bytes):
+    pdf = PdfFileReader(BytesIO(pdf_bytes))
+    output = PdfFileWriter()
+    output.addPage(pdf.getPage(0))
+    page_bytes = BytesIO()
+    output.write(page_bytes)
+    return page_bytes.getvalue()
+
+
+def _post(path, make_body, content_type):
+    def run(app, client, letter):
+        response = client.post(path, data=make_body(letter), headers={
+            'Content-type': content_type,
+            'Authorization': 'Token {}'.format(app.config['TEMPLATE_PREVIEW_INTERNAL_SECRETS'][0]),
+        })
+        return response.status_code, len(response.get_data())
+    return run
+
+
+def _uploaded(app, bucket_config_name):
+    """
+    :return tuple: whether the task uploaded its letter, and how big it is
+    """
+    s3 = _s3_client(app)
+    try:
+        head = s3.head_object(Bucket=app.config[bucket_config_name], Key=LETTER_FILENAME)
+    except ClientError:
+        return 'not-uploaded', 0
+    s3.delete_object(Bucket=app.config[bucket_config_name], Key=LETTER_FILENAME)
+    return 'uploaded', head['ContentLength']
+
+
+def _sanitise_and_upload_letter(app, client, pdf):
+    from app.celery.tasks import sanitise_and_upload_letter
+
+    _s3_client(app).put_object(Bucket=app.config['LETTERS_SCAN_BUCKET_NAME'], Key=LETTER_FILENAME, Body=pdf)
+    sanitise_and_upload_letter(NOTIFICATION_ID, LETTER_FILENAME)
+    return _uploaded(app, 'SANITISED_LETTER_BUCKET_NAME')
+
+
+def _create_pdf_for_templated_letter(app, client, letter):
+    from app.celery.tasks import create_pdf_for_templated_letter
+
+    create_pdf_for_templated_letter(app.encryption_client.encrypt({
+        'letter_contact_block': letter['letter_contact_block'],
+        'template': letter['template'],
+        'values': letter['values'],
+        'logo_filename': letter['filename'],
+        'letter_filename': LETTER_FILENAME,
+        'notification_id': NOTIFICATION_ID,
+        'key_type': 'normal',
+    }))
+    return _uploaded(app, 'LETTERS_PDF_BUCKET_NAME')
+
+
+# name, which corpus it runs against, and what runs it
+TARGETS = (
+    ('preview.pdf', 'templated', _post('/preview.pdf', json.dumps, 'application/json')),
+    ('preview.png', 'templated', _post('/preview.png?page=1', json.dumps, 'application/json')),
+    ('preview.pngs', 'templated', _post('/preview.pngs', json.dumps, 'application/json')),
+    ('preview.json', 'templated', _post('/preview.json', json.dumps, 'application/json')),
+    ('print.pdf', 'templated', _post('/print.pdf', json.dumps, 'application/json')),
+    (
+        'precompiled-preview.png',
+        'precompiled',
+        _post('/precompiled-preview.png?page=1', base64.b64encode, 'text/plain'),
+    ),
+    ('precompiled/sanitise', 'precompiled', _post('/precompiled/sanitise', bytes, 'application/pdf')),
+    ('precompiled/overlay.pdf', 'precompiled', _post('/precompiled/overlay.pdf', bytes, 'application/pdf')),
+    (
+        'precompiled/overlay.png',
+        'precompiled',
+        _post('/precompiled/overlay.png?page_number=1', _first_page, 'application/pdf'),
+    ),
+    ('sanitise-and-upload-letter', 'precompiled', _sanitise_and_upload_letter),
+    ('create-pdf-for-templated-letter', 'templated', _create_pdf_for_templated_letter),
+)
+
+
+def _configure_environment():
+    os.environ.setdefault('LETTER_LOGO_LOCAL_DIRECTORY', 'tests/test_pdfs')
+    os.environ.setdefault('TEMPLATE_PREVIEW_INTERNAL_SECRETS', '["benchmark-secret"]')
+    # moto doesn't check credentials, but boto3 still needs some to sign requests with
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+
+
+def _s3_client(app):
+    return boto3.client('s3', region_name=app.config['AWS_REGION'])
+
+
+def _create_buckets(app):
+    s3 = _s3_client(app)
+    for bucket_config_name in (
+        'LETTER_CACHE_BUCKET_NAME',
+        'LETTERS_SCAN_BUCKET_NAME',
+        'SANITISED_LETTER_BUCKET_NAME',
+        'LETTERS_PDF_BUCKET_NAME',
+        'TEST_LETTERS_BUCKET_NAME',
+    ):
+        s3.create_bucket(
+            Bucket=app.config[bucket_config_name],
+            CreateBucketConfiguration={'LocationConstraint': app.config['AWS_REGION']},
+        )
+
+
+def _empty_preview_cache(app):
+    # anything still being written behind would land after the bucket was emptied
+    app.cache.flush()
+    for tier in app.cache.local_tiers:
+        tier.clear()
+    boto3.resource('s3', region_name=app.config['AWS_REGION']).Bucket(
+        app.config['LETTER_CACHE_BUCKET_NAME']
+    ).objects.all().delete()
+
+
+def _cpu_seconds():
+    # children only counts processes that have exited, which covers each `gs` but not ghostscript pool workers
+    return sum(
+        usage.ru_utime + usage.ru_stime
+        for usage in (resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN))
+    )
+
+
+def _run_case(run, letter, repeat, warm_up):
+    app = get_app()
+    timings, cpu_timings = [], []
+    # there's no broker to send the api's tasks to
+    with mock_s3(), mock.patch.object(notify_celery, 'send_task'):
+        _create_buckets(app)
+        client = app.test_client()
+        for i in range(warm_up + repeat):
+            _empty_preview_cache(app)
+            start, cpu_start = time.perf_counter(), _cpu_seconds()
+            status, output_bytes = run(app, client, letter)
+            if i >= warm_up:
+                timings.append((time.perf_counter() - start) * 1000)
+                cpu_timings.append((_cpu_seconds() - cpu_start) * 1000)
+
+    return {
+        'p50_ms': round(percentile(timings, 50), 1),
+        'p95_ms': round(percentile(timings, 95), 1),
+        'p99_ms': round(percentile(timings, 99), 1),
+        'cpu_ms': round(statistics.median(cpu_timings), 1),
+        'output_bytes': output_bytes,
+        'status': status,
+    }
+
+
+def find_regressions(baseline_rows, rows, threshold):
+    """
+    :return list: a description of each way a case in `rows` is worse than the same case in `baseline_rows`
+    """
+    baseline = {row['case']: row for row in baseline_rows}
+    regressions = []
+    for row in rows:
+        old = baseline.get(row['case'])
+        if old is None:
+            continue
+        if row['status'] != old['status']:
+            regressions.append('{}: status {} -> {}'.format(row['case'], old['status'], row['status']))
+        for metric in REGRESSION_METRICS:
+            if old[metric] and row[metric] > old[metric] * (1 + threshold):
+                regressions.append('{}: {} {} -> {} (+{:.0%})'.format(
+                    row['case'], metric, old[metric], row[metric], row[metric] / old[metric] - 1,
+                ))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warm-up', type=int, default=1, help='untimed runs of each case before the timed ones')
+    parser.add_argument('--only', action='append', help='only run cases with this in their name, can be repeated')
+    parser.add_argument('--json', dest='json_path')
+    parser.add_argument('--compare', dest='baseline_path', help='a --json file from an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args()
+
+    _configure_environment()
+    corpora = {'templated': templated_letters(), 'precompiled': precompiled_letters()}
+
+    rows = []
+    for target, corpus, run in TARGETS:
+        for letter_name, letter in corpora[corpus].items():
+            case = '{}:{}'.format(target, letter_name)
+            if args.only and not any(only in case for only in args.only):
+                continue
+            sys.stderr.write('{}\n'.format(case))
+            result = run_isolated(_run_case, run, letter, args.repeat, args.warm_up)
+            rows.append({'case': case, **result['result'], 'peak_rss_mb': round(result['peak_rss_mb'], 1)})
+
+    print_table(rows, ['case', 'p50_ms', 'p95_ms', 'p99_ms', 'cpu_ms', 'peak_rss_mb', 'output_bytes', 'status'])
+    if args.json_path:
+        dump_json(rows, args.json_path)
+
+    if args.baseline_path:
+        with open(args.baseline_path) as f:
+            regressions = find_regressions(json.load(f), rows, args.threshold)
+        for regression in regressions:
+            sys.stdout.write('REGRESSION {}\n'.format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
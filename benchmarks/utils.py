@@ -0,0 +1,113 @@
+import json
+import math
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+from io import BytesIO
+
+from PyPDF2 import PdfFileReader, PdfFileWriter
+
+# the benchmarks build a real app, so give it the same config the tests run with unless told otherwise
+os.environ.setdefault('NOTIFY_ENVIRONMENT', 'test')
+os.environ.setdefault('STATSD_ENABLED', '0')
+os.environ.setdefault('DANGEROUS_SALT', 'benchmark-notify-salt')
+os.environ.setdefault('SECRET_KEY', 'benchmark-notify-secret-key')
+
+MULTI_PAGE_PDF = 'tests/test_pdfs/multi_page_pdf.pdf'
+
+
+def get_app():
+    from app import create_app
+    return create_app()
+
+
+def letter_with_pages(page_count, source=MULTI_PAGE_PDF):
+    """
+    Builds a letter of `page_count` pages by repeating the pages of one of the test pdfs.
+
+    :return bytes: the raw bytes of the new pdf
+    """
+    with open(source, 'rb') as f:
+        pdf = PdfFileReader(BytesIO(f.read()))
+
+    output = PdfFileWriter()
+    for i in range(page_count):
+        output.addPage(pdf.getPage(i % pdf.numPages))
+
+    pdf_bytes = BytesIO()
+    output.write(pdf_bytes)
+    return pdf_bytes.getvalue()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def time_call(function, *args, repeat=5, **kwargs):
+    """
+    :return list: wall clock time of each call, in milliseconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _run_and_send(connection, function, args):
+    result = function(*args)
+    connection.send({'result': result, 'peak_rss_mb': peak_rss_mb()})
+    connection.close()
+
+
+def run_isolated(function, *args):
+    """
+    Runs `function` in a freshly forked process so that its peak RSS isn't polluted by anything run before it.
+
+    :return dict: the return value of the function, and the peak RSS of the process that ran it
+    """
+    parent_connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.get_context('fork').Process(
+        target=_run_and_send,
+        args=(child_connection, function, args),
+    )
+    process.start()
+    result = parent_connection.recv()
+    process.join()
+    return result
+
+
+def summarise(timings):
+    return {
+        'min_ms': round(min(timings), 2),
+        'median_ms': round(statistics.median(timings), 2),
+        'max_ms': round(max(timings), 2),
+    }
+
+
+def percentile(values, percent):
+    """
+    :return: the nearest-rank percentile, so with only a few values p99 is the slowest one rather than a guess
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def print_table(rows, columns):
+    sys.stdout.write('  '.join('{:>14}'.format(column) for column in columns) + '\n')
+    for row in rows:
+        sys.stdout.write('  '.join('{:>14}'.format(row[column]) for column in columns) + '\n')
+
+
+def dump_json(results, path=None):
+    if path:
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
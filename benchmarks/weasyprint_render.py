@@ -0,0 +1,75 @@
+"""
+Compares rendering letters with a new WeasyPrint font configuration for each one against sharing one per process.
+
+    python -m benchmarks.weasyprint_render [--letters 1000] [--json results.json]
+"""
+import argparse
+import time
+
+from benchmarks.utils import dump_json, get_app, print_table, run_isolated, summarise
+
+TEMPLATE = {
+    'subject': 'Your application reference ((reference))',
+    'content': 'Dear ((name)),\n\nThank you for your application.\n\n# What happens next\n\n' + (
+        'We will review your application and contact you within 10 working days.\n\n' * 5
+    ),
+}
+
+
+def _render_letters(letter_count, share_font_config):
+    from flask_weasyprint import HTML
+    from notifications_utils.template import LetterPrintTemplate
+
+    from app.rendering import write_pdf
+
+    timings = []
+    with get_app().test_request_context():
+        for i in range(letter_count):
+            template = LetterPrintTemplate(
+                TEMPLATE,
+                values={
+                    'name': 'Person {}'.format(i),
+                    'reference': 'REF-{:06d}'.format(i),
+                    'address_line_1': 'Person {}'.format(i),
+                    'address_line_2': '{} Example Street'.format(i),
+                    'postcode': 'SW1A 1AA',
+                },
+            )
+            start = time.perf_counter()
+            html = HTML(string=str(template))
+            if share_font_config:
+                write_pdf(html)
+            else:
+                # WeasyPrint builds a new font configuration when it isn't given one
+                html.write_pdf()
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--letters', type=int, default=1000)
+    parser.add_argument('--json', dest='json_path')
+    args = parser.parse_args()
+
+    rows = []
+    for strategy, share_font_config in (
+        ('per-letter', False),
+        ('shared', True),
+    ):
+        result = run_isolated(_render_letters, args.letters, share_font_config)
+        rows.append({
+            'letters': args.letters,
+            'strategy': strategy,
+            'total_s': round(sum(result['result']) / 1000, 2),
+            'peak_rss_mb': round(result['peak_rss_mb'], 1),
+            **summarise(result['result']),
+        })
+
+    print_table(rows, ['letters', 'strategy', 'total_s', 'min_ms', 'median_ms', 'max_ms', 'peak_rss_mb'])
+    if args.json_path:
+        dump_json(rows, args.json_path)
+
+
+if __name__ == '__main__':
+    main()
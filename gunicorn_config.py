@@ -1,4 +1,5 @@
 import os
+import random
 import sys
 import traceback
 
@@ -7,7 +8,34 @@ timeout = 120
 errorlog = "/home/vcap/logs/gunicorn_error.log"
 bind = "0.0.0.0:{}".format(os.getenv("PORT"))
 
-max_requests = 10
+# load the app in the master before forking workers, so the libraries and fonts it loads are shared copy-on-write
+preload_app = os.getenv('PRELOAD_APP') == '1'
+
+# render a small letter in each worker before it accepts traffic
+WARM_UP_WORKERS = os.getenv('WARM_UP_WORKERS') == '1'
+
+# workers are recycled when they use too much memory, see post_request. this is only a backstop, and is jittered so
+# workers don't all restart at once
+max_requests = 1000
+max_requests_jitter = 200
+
+# a worker is recycled once its RSS is over WORKER_MAX_RSS_MB, or has grown by WORKER_MAX_RSS_GROWTH_MB since its
+# first request, less up to WORKER_RSS_JITTER of either so workers started together don't all restart together
+WORKER_MAX_RSS_MB = int(os.getenv('WORKER_MAX_RSS_MB', 350))
+WORKER_MAX_RSS_GROWTH_MB = int(os.getenv('WORKER_MAX_RSS_GROWTH_MB', 150))
+WORKER_RSS_JITTER = 0.1
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    # it's given in kB
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
 
 
 def on_starting(server):
@@ -20,9 +48,70 @@ def worker_abort(worker):
         worker.log.error(''.join(traceback.format_stack(stack)))
 
 
+def when_ready(server):
+    if server.cfg.preload_app:
+        from app.warmup import warm_up_process
+        warm_up_process(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    if WARM_UP_WORKERS:
+        from app.warmup import warm_up_worker
+        warm_up_worker(worker.wsgi)
+
+
 def on_exit(server):
     server.log.info("Stopping Notifications template preview")
 
 
+def post_fork(server, worker):
+    jitter = 1 - random.uniform(0, WORKER_RSS_JITTER)
+    worker.max_rss_mb = WORKER_MAX_RSS_MB * jitter
+    worker.max_rss_growth_mb = WORKER_MAX_RSS_GROWTH_MB * jitter
+    worker.first_request_rss_mb = None
+    worker.recycle_reason = None
+
+
+def post_request(worker, req, environ, resp):
+    rss_mb = _rss_mb()
+    if rss_mb is None or not worker.alive:
+        return
+
+    if worker.first_request_rss_mb is None:
+        # by the end of its first request a worker has imported everything it's going to
+        worker.first_request_rss_mb = rss_mb
+
+    if rss_mb > worker.max_rss_mb:
+        worker.recycle_reason = 'rss'
+    elif rss_mb - worker.first_request_rss_mb > worker.max_rss_growth_mb:
+        worker.recycle_reason = 'rss-growth'
+    else:
+        return
+
+    worker.log.info("worker {} recycled after {} requests at {:.0f}MB ({:.0f}MB after its first): {}".format(
+        worker.pid, worker.nr, rss_mb, worker.first_request_rss_mb, worker.recycle_reason,
+    ))
+    # the sync worker stops once this request is done, and the arbiter starts a new one
+    worker.alive = False
+
+
+def worker_exit(server, worker):
+    application = getattr(worker, 'wsgi', None)
+
+    statsd_client = getattr(application, 'statsd_client', None)
+    if statsd_client is not None:
+        reason = getattr(worker, 'recycle_reason', None)
+        if reason is None:
+            reason = 'max-requests' if worker.nr >= worker.max_requests else 'exit'
+        statsd_client.incr('gunicorn.worker-exit.{}'.format(reason))
+        rss_mb = _rss_mb()
+        if rss_mb is not None:
+            statsd_client.gauge('gunicorn.worker-exit.rss-mb', round(rss_mb))
+
+    # don't lose uploads the preview cache is still writing behind
+    if application is not None and hasattr(application, 'cache'):
+        application.cache.flush()
+
+
 def worker_int(worker):
     worker.log.info("worker: received SIGINT {}".format(worker.pid))
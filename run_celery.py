@@ -3,5 +3,5 @@
 from app import notify_celery, create_app  # noqa
 
 
-application = create_app()
+application = create_app(register_blueprints=False)
 application.app_context().push()
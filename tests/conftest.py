@@ -66,12 +66,14 @@ def auth_header():
 
 @pytest.fixture(autouse=True)
 def mocked_cache_get(mocker):
-    return mocker.patch('app.s3download', side_effect=S3ObjectNotFound({}, ''))
+    return mocker.patch('app.cache.s3download', side_effect=S3ObjectNotFound({}, ''))
 
 
 @pytest.fixture(autouse=True)
-def mocked_cache_set(mocker):
-    return mocker.patch('app.s3upload')
+def mocked_cache_set(mocker, app):
+    yield mocker.patch('app.cache.s3upload')
+    # uploads written behind use the mock too, so they need to finish before it's removed
+    app.cache.flush()
 
 
 @contextmanager
@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+
+import pytest
+from flask import url_for
+
+from app import AdmissionRejected
+from app.admission import AdmissionController
+from tests.conftest import set_config
+from tests.pdf_consts import blank_page
+
+
+@pytest.fixture
+def admission(app, tmpdir):
+    with set_config(app, 'ADMISSION_CONTROL_DIRECTORY', str(tmpdir)), \
+            set_config(app, 'ADMISSION_CONTROL_LIMITS', {'sanitise': 2, 'print': 1}), \
+            set_config(app, 'ADMISSION_CONTROL_BYTES_PER_SLOT', 1000), \
+            set_config(app, 'ADMISSION_CONTROL_MAX_WAITING', 1), \
+            set_config(app, 'ADMISSION_CONTROL_WAIT_SECONDS', 0.2):
+        yield AdmissionController(app)
+
+
+def test_admit_lets_requests_in_while_there_are_free_slots(admission):
+    with admission.admit('sanitise'), admission.admit('sanitise'):
+        pass
+
+
+def test_admit_keeps_pools_separate(admission):
+    with admission.admit('print'), admission.admit('sanitise'):
+        pass
+
+
+def test_admit_waits_for_a_slot(app, admission, mocker):
+    mock_timing = mocker.patch.object(app.statsd_client, 'timing')
+    mock_gauge = mocker.patch.object(app.statsd_client, 'gauge')
+    first_admitted, release_first = threading.Event(), threading.Event()
+
+    def first_request():
+        with admission.admit('print'):
+            first_admitted.set()
+            release_first.wait(1)
+
+    thread = threading.Thread(target=first_request)
+    thread.start()
+    assert first_admitted.wait(1)
+    threading.Timer(0.05, release_first.set).start()
+
+    with admission.admit('print'):
+        pass
+
+    thread.join()
+    assert mock_gauge.call_args_list == [
+        mocker.call('admission.print.queue-depth', 1),
+        mocker.call('admission.print.queue-depth', 0),
+    ]
+    assert mock_timing.call_args[0][0] == 'admission.print.wait-time'
+
+
+def test_admit_rejects_requests_that_wait_too_long(app, admission, mocker):
+    mock_incr = mocker.patch.object(app.statsd_client, 'incr')
+
+    with admission.admit('print'):
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with admission.admit('print'):
+                pass
+
+    assert excinfo.value.code == 503
+    assert excinfo.value.retry_after == app.config['ADMISSION_CONTROL_RETRY_AFTER_SECONDS']
+    mock_incr.assert_any_call('admission.print.rejected.timed-out')
+
+
+def test_admit_rejects_requests_straight_away_if_the_queue_is_full(app, admission, mocker):
+    mock_incr = mocker.patch.object(app.statsd_client, 'incr')
+    mock_sleep = mocker.patch('app.admission.time.sleep')
+
+    with admission.admit('print'):
+        with admission._locked_queue('print') as waiting:
+            waiting.append(['another-request', os.getpid(), time.time()])
+
+        with pytest.raises(AdmissionRejected):
+            with admission.admit('print'):
+                pass
+
+    assert mock_sleep.called is False
+    mock_incr.assert_any_call('admission.print.rejected.queue-full')
+
+
+def test_admit_queues_behind_requests_already_waiting_even_if_there_are_free_slots(app, admission, mocker):
+    mock_incr = mocker.patch.object(app.statsd_client, 'incr')
+    with admission._locked_queue('print') as waiting:
+        waiting.append(['earlier-request', os.getpid(), time.time()])
+
+    with set_config(app, 'ADMISSION_CONTROL_MAX_WAITING', 2), pytest.raises(AdmissionRejected):
+        with admission.admit('print'):
+            pass
+
+    mock_incr.assert_any_call('admission.print.rejected.timed-out')
+    with admission._locked_queue('print') as waiting:
+        assert [place[0] for place in waiting] == ['earlier-request']
+
+
+@pytest.mark.parametrize('pid, seconds_waited', [
+    # its worker was killed while it was waiting
+    (os.getpid(), 60),
+    (999999999, 0),
+])
+def test_admit_ignores_places_left_in_the_queue(admission, pid, seconds_waited):
+    with admission._locked_queue('print') as waiting:
+        waiting.append(['left-behind', pid, time.time() - seconds_waited])
+
+    with admission.admit('print'):
+        pass
+
+
+def test_admit_lets_waiting_requests_in_in_the_order_they_arrived(admission):
+    admitted = []
+    first_admitted, release_first = threading.Event(), threading.Event()
+
+    def first_request():
+        with admission.admit('print'):
+            first_admitted.set()
+            release_first.wait(1)
+
+    def waiting_request(name):
+        with admission.admit('print'):
+            admitted.append(name)
+
+    threading.Thread(target=first_request).start()
+    assert first_admitted.wait(1)
+    with set_config(admission.application, 'ADMISSION_CONTROL_MAX_WAITING', 2), \
+            set_config(admission.application, 'ADMISSION_CONTROL_WAIT_SECONDS', 1):
+        threads = [threading.Thread(target=waiting_request, args=(name,)) for name in ('second', 'third')]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.1)
+        release_first.set()
+        for thread in threads:
+            thread.join()
+
+    assert admitted == ['second', 'third']
+
+
+def test_admit_takes_more_slots_for_bigger_requests(admission):
+    with admission.admit('sanitise', content_length=1000):
+        with pytest.raises(AdmissionRejected):
+            with admission.admit('sanitise'):
+                pass
+
+    # but never more slots than the pool has
+    with admission.admit('sanitise', content_length=1000000):
+        pass
+
+
+def test_rejected_requests_get_503_with_retry_after(app, client, auth_header, admission, mocker):
+    mocker.patch.object(app, 'admission', admission)
+
+    with set_config(app, 'ADMISSION_CONTROL', True), admission.admit('sanitise', content_length=1000):
+        response = client.post(
+            url_for('precompiled_blueprint.sanitise_precompiled_letter'),
+            data=blank_page,
+            headers={
+                'Content-type': 'application/json',
+                **auth_header
+            }
+        )
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    assert response.json == {'result': 'error', 'message': 'Too many requests to sanitise endpoints'}
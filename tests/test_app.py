@@ -1,9 +1,52 @@
 import copy
+import subprocess
+import sys
+
 import pytest
 
+from app import check_preview_rasterisers
+
 
 @pytest.fixture
 def revert_config(app):
     old_config = copy.deepcopy(app.config)
     yield
     app.config = old_config
+
+
+def test_create_app_for_celery_does_not_import_the_previews():
+    # in a fresh interpreter, as the tests have imported everything already
+    subprocess.run(
+        [
+            sys.executable, '-c',
+            'import sys\n'
+            'from app import create_app\n'
+            'assert create_app(register_blueprints=False).blueprints == {}\n'
+            'import app.celery.tasks\n'
+            'assert "app.preview" not in sys.modules\n'
+            'assert "app.rasterisers" not in sys.modules\n'
+            'assert "wand.image" not in sys.modules\n',
+        ],
+        check=True,
+    )
+
+
+@pytest.mark.parametrize('templated_rasteriser, precompiled_rasteriser', [
+    ('wand', 'fitz'),
+    ('pdf2image', 'wand'),
+])
+def test_check_preview_rasterisers_allows_known_rasterisers(templated_rasteriser, precompiled_rasteriser):
+    check_preview_rasterisers({
+        'TEMPLATED_PREVIEW_RASTERISER': templated_rasteriser,
+        'PRECOMPILED_PREVIEW_RASTERISER': precompiled_rasteriser,
+    })
+
+
+def test_check_preview_rasterisers_fails_for_unknown_rasterisers():
+    with pytest.raises(ValueError) as excinfo:
+        check_preview_rasterisers({
+            'TEMPLATED_PREVIEW_RASTERISER': 'wand',
+            'PRECOMPILED_PREVIEW_RASTERISER': 'fitzz',
+        })
+
+    assert str(excinfo.value) == 'PRECOMPILED_PREVIEW_RASTERISER must be wand or one of fitz, pdf2image, not fitzz'
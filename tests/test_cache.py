@@ -0,0 +1,450 @@
+import os
+import threading
+from io import BytesIO
+
+import boto3
+import pytest
+from moto import mock_s3
+from notifications_utils.s3 import S3ObjectNotFound
+
+from app.cache import (
+    DiskCacheTier,
+    MemoryCacheTier,
+    PreviewCache,
+    boto3_session,
+    s3download,
+    s3upload,
+    single_flight_lock,
+)
+from tests.conftest import set_config
+
+
+@pytest.fixture
+def local_cache(app, tmpdir):
+    with set_config(app, 'LOCAL_CACHE_MEMORY_LIMIT_BYTES', 100), \
+            set_config(app, 'LOCAL_CACHE_DISK_PATH', str(tmpdir)), \
+            set_config(app, 'LOCAL_CACHE_DISK_LIMIT_BYTES', 1000):
+        yield PreviewCache(app)
+
+
+def test_memory_tier_evicts_least_recently_used_items():
+    tier = MemoryCacheTier(max_bytes=10)
+    tier.set('a', b'1234')
+    tier.set('b', b'1234')
+    tier.get('a')
+    tier.set('c', b'1234')
+
+    assert tier.get('a') == b'1234'
+    assert tier.get('b') is None
+    assert tier.get('c') == b'1234'
+    assert tier.size == 8
+
+
+def test_memory_tier_replacing_an_item_updates_its_size():
+    tier = MemoryCacheTier(max_bytes=10)
+    tier.set('a', b'1234')
+    tier.set('a', b'12')
+
+    assert tier.get('a') == b'12'
+    assert tier.size == 2
+
+
+def test_memory_tier_ignores_items_bigger_than_the_tier():
+    tier = MemoryCacheTier(max_bytes=3)
+    tier.set('a', b'1234')
+
+    assert tier.get('a') is None
+    assert tier.size == 0
+
+
+def test_memory_tier_clear():
+    tier = MemoryCacheTier(max_bytes=10)
+    tier.set('a', b'1234')
+    tier.clear()
+
+    assert tier.get('a') is None
+    assert tier.size == 0
+
+
+def test_disk_tier_stores_files_under_cache_key(tmpdir):
+    tier = DiskCacheTier(str(tmpdir), max_bytes=10)
+    tier.set('templated/abc.pdf', b'1234')
+
+    assert tmpdir.join('templated', 'abc.pdf').read_binary() == b'1234'
+    assert tier.get('templated/abc.pdf') == b'1234'
+    assert tier.get('templated/def.pdf') is None
+
+
+def test_disk_tier_evicts_least_recently_used_files(tmpdir):
+    tier = DiskCacheTier(str(tmpdir), max_bytes=10)
+    tier.set('templated/a.pdf', b'1234')
+    tier.set('templated/b.pdf', b'1234')
+    os.utime(str(tmpdir.join('templated', 'a.pdf')), (1, 1))
+
+    tier.set('templated/c.pdf', b'1234')
+
+    assert tier.get('templated/a.pdf') is None
+    assert tier.get('templated/b.pdf') == b'1234'
+    assert tier.get('templated/c.pdf') == b'1234'
+
+
+def test_disk_tier_only_looks_for_files_to_evict_once_it_is_full(tmpdir, mocker):
+    tier = DiskCacheTier(str(tmpdir), max_bytes=10)
+    mock_walk = mocker.patch('app.cache.os.walk', wraps=os.walk)
+
+    tier.set('templated/a.pdf', b'1234')
+    tier.set('templated/b.pdf', b'1234')
+    assert mock_walk.called is False
+    assert tier.size == 8
+
+    tier.set('templated/c.pdf', b'1234')
+    assert mock_walk.called is True
+    assert tier.size == 8
+
+
+def test_disk_tier_replacing_a_file_updates_its_size(tmpdir, mocker):
+    tier = DiskCacheTier(str(tmpdir), max_bytes=10)
+    mock_walk = mocker.patch('app.cache.os.walk', wraps=os.walk)
+
+    for _ in range(3):
+        tier.set('templated/a.pdf', b'1234')
+    tier.set('templated/a.pdf', b'12')
+
+    assert tier.get('templated/a.pdf') == b'12'
+    assert tier.size == 2
+    assert mock_walk.called is False
+
+
+def test_disk_tier_counts_files_already_in_the_directory(tmpdir):
+    DiskCacheTier(str(tmpdir), max_bytes=10).set('templated/a.pdf', b'1234')
+
+    assert DiskCacheTier(str(tmpdir), max_bytes=10).size == 4
+
+
+def test_disk_tier_clear(tmpdir):
+    tier = DiskCacheTier(str(tmpdir.join('cache')), max_bytes=10)
+    tier.set('templated/a.pdf', b'1234')
+    tier.clear()
+
+    assert tier.get('templated/a.pdf') is None
+    tier.set('templated/a.pdf', b'1234')
+    assert tier.get('templated/a.pdf') == b'1234'
+
+
+def test_cache_key():
+    assert PreviewCache.key('foo', True, folder='precompiled', extension='page01.png') == (
+        'precompiled/41f94d687c034f70e237794e6fe8d3cc60e62cfe.page01.png'
+    )
+
+
+def test_cache_without_local_tiers_goes_straight_to_s3(app, mocked_cache_get, mocked_cache_set):
+    cache = PreviewCache(app)
+
+    @cache('foo', folder='templated', extension='pdf')
+    def _get():
+        return BytesIO(b'data')
+
+    assert _get().read() == b'data'
+    assert mocked_cache_get.call_count == 1
+    assert mocked_cache_set.call_count == 1
+    assert cache.stats == {('s3', 'templated', 'miss'): 1}
+
+
+def test_cache_miss_fills_every_tier(local_cache, mocked_cache_get, mocked_cache_set, tmpdir):
+    @local_cache('foo', folder='templated', extension='pdf')
+    def _get():
+        return BytesIO(b'data')
+
+    assert _get().read() == b'data'
+    cache_key = mocked_cache_set.call_args[0][3]
+    assert local_cache.local_tiers[0].get(cache_key) == b'data'
+    assert local_cache.local_tiers[1].get(cache_key) == b'data'
+    assert local_cache.stats == {
+        ('memory', 'templated', 'miss'): 1,
+        ('disk', 'templated', 'miss'): 1,
+        ('s3', 'templated', 'miss'): 1,
+    }
+
+
+def test_cache_memory_hit_does_not_go_to_s3(local_cache, mocked_cache_get, mocked_cache_set):
+    local_cache.local_tiers[0].set('templated/abc.pdf', b'data')
+
+    assert local_cache.get('templated/abc.pdf').read() == b'data'
+    assert not mocked_cache_get.called
+    assert local_cache.stats == {('memory', 'templated', 'hit'): 1}
+
+
+def test_cache_disk_hit_is_copied_into_memory(local_cache, mocked_cache_get):
+    local_cache.local_tiers[1].set('precompiled/abc.page01.png', b'data')
+
+    assert local_cache.get('precompiled/abc.page01.png').read() == b'data'
+    assert local_cache.local_tiers[0].get('precompiled/abc.page01.png') == b'data'
+    assert not mocked_cache_get.called
+    assert local_cache.stats == {
+        ('memory', 'precompiled', 'miss'): 1,
+        ('disk', 'precompiled', 'hit'): 1,
+    }
+
+
+def test_cache_s3_hit_is_copied_into_local_tiers(local_cache, mocked_cache_get):
+    mocked_cache_get.side_effect = None
+    mocked_cache_get.return_value = BytesIO(b'data')
+
+    assert local_cache.get('templated/abc.pdf').read() == b'data'
+    assert local_cache.local_tiers[0].get('templated/abc.pdf') == b'data'
+    assert local_cache.local_tiers[1].get('templated/abc.pdf') == b'data'
+    assert local_cache.stats[('s3', 'templated', 'hit')] == 1
+
+
+def test_cache_s3_hit_is_streamed_and_copied_into_local_tiers_once_read(local_cache, mocked_cache_get):
+    mocked_cache_get.side_effect = None
+    mocked_cache_get.return_value = BytesIO(b'data')
+
+    data = local_cache.get('templated/abc.pdf')
+    assert not isinstance(data, BytesIO)
+    assert data.read(3) == b'dat'
+    assert local_cache.local_tiers[1].get('templated/abc.pdf') is None
+
+    assert data.read(3) == b'a'
+    assert data.read(3) == b''
+    assert local_cache.local_tiers[0].get('templated/abc.pdf') == b'data'
+    assert local_cache.local_tiers[1].get('templated/abc.pdf') == b'data'
+
+
+def test_cache_s3_hit_is_not_copied_into_local_tiers_if_not_read_to_the_end(local_cache, mocked_cache_get):
+    mocked_cache_get.side_effect = None
+    mocked_cache_get.return_value = BytesIO(b'data')
+
+    data = local_cache.get('templated/abc.pdf')
+    data.read(3)
+    data.close()
+
+    assert local_cache.local_tiers[1].get('templated/abc.pdf') is None
+
+
+def test_cache_s3_hit_bigger_than_the_local_tiers_is_not_kept(local_cache, mocked_cache_get):
+    mocked_cache_get.side_effect = None
+    mocked_cache_get.return_value = BytesIO(b'x' * 1001)
+
+    data = local_cache.get('templated/abc.pdf')
+
+    assert data.read(600) + data.read(600) + data.read(600) == b'x' * 1001
+    assert local_cache.local_tiers[1].get('templated/abc.pdf') is None
+
+
+def test_cache_s3_miss_returns_none(local_cache, mocked_cache_get):
+    mocked_cache_get.side_effect = S3ObjectNotFound({}, '')
+
+    assert local_cache.get('templated/abc.pdf') is None
+
+
+def test_single_flight_lock_does_not_wait_if_nobody_holds_it(tmpdir):
+    with single_flight_lock(str(tmpdir), 'templated/abc.pdf', timeout=1) as waited:
+        assert waited is False
+
+
+def test_single_flight_lock_gives_up_waiting_after_timeout(tmpdir):
+    results = []
+
+    def wait_for_lock():
+        with single_flight_lock(str(tmpdir), 'templated/abc.pdf', timeout=0.1) as waited:
+            results.append(waited)
+
+    with single_flight_lock(str(tmpdir), 'templated/abc.pdf', timeout=1):
+        waiting_request = threading.Thread(target=wait_for_lock)
+        waiting_request.start()
+        waiting_request.join()
+
+    assert results == [True]
+
+
+def test_single_flight_lock_is_reentrant_within_a_thread(tmpdir):
+    with single_flight_lock(str(tmpdir), 'templated/abc.pdf', timeout=1):
+        with single_flight_lock(str(tmpdir), 'templated/abc.pdf', timeout=1) as waited:
+            assert waited is False
+
+
+@pytest.mark.parametrize('other_cache_key, expected_waited', [
+    ('templated/def.pdf', True),
+    # an image is made while holding the lock for its request-keyed copy, and the pdf while holding the image's, so
+    # they mustn't share lock files
+    ('templated/abc.page01.png', False),
+    ('templated-request/abc.pdf', False),
+])
+def test_single_flight_lock_only_shares_lock_files_between_the_same_kind_of_file(
+    tmpdir,
+    mocker,
+    other_cache_key,
+    expected_waited,
+):
+    mocker.patch('app.cache.LOCK_STRIPES', 1)
+    results = []
+
+    def wait_for_lock():
+        with single_flight_lock(str(tmpdir), other_cache_key, timeout=0.1) as waited:
+            results.append(waited)
+
+    with single_flight_lock(str(tmpdir), 'templated/abc.pdf', timeout=1):
+        waiting_request = threading.Thread(target=wait_for_lock)
+        waiting_request.start()
+        waiting_request.join()
+
+    assert results == [expected_waited]
+
+
+def test_cache_waits_for_render_in_progress_and_reads_its_result(app, mocked_cache_get, tmpdir):
+    # the first lookup misses, then whoever held the lock has cached it by the time we look again
+    mocked_cache_get.side_effect = [S3ObjectNotFound({}, ''), BytesIO(b'rendered elsewhere')]
+    render = []
+
+    with set_config(app, 'CACHE_LOCK_DIRECTORY', str(tmpdir)):
+        cache = PreviewCache(app)
+
+        @cache('foo', folder='templated', extension='pdf')
+        def _get():
+            render.append(True)
+            return BytesIO(b'rendered here')
+
+        results = []
+        with single_flight_lock(str(tmpdir), cache.key('foo', folder='templated', extension='pdf'), timeout=1):
+            waiting_request = threading.Thread(target=lambda: results.append(_get().read()))
+            waiting_request.start()
+            waiting_request.join(0.2)
+            assert waiting_request.is_alive()
+        waiting_request.join()
+
+    assert results == [b'rendered elsewhere']
+    assert not render
+    assert mocked_cache_get.call_count == 2
+
+
+@pytest.fixture
+def write_behind_cache(app):
+    with set_config(app, 'CACHE_WRITE_BEHIND', True), \
+            set_config(app, 'CACHE_WRITE_BEHIND_QUEUE_SIZE', 1), \
+            set_config(app, 'CACHE_WRITE_BEHIND_THREAD_COUNT', 1):
+        yield PreviewCache(app)
+
+
+def test_write_behind_cache_returns_before_uploading(write_behind_cache, mocked_cache_set):
+    uploading = threading.Event()
+    finish_upload = threading.Event()
+    mocked_cache_set.side_effect = lambda *args: uploading.set() or finish_upload.wait()
+
+    @write_behind_cache('foo', folder='templated', extension='pdf')
+    def _get():
+        return BytesIO(b'data')
+
+    assert _get().read() == b'data'
+    assert uploading.wait(1)
+    assert write_behind_cache.flush(timeout=0) is False
+
+    finish_upload.set()
+
+    assert write_behind_cache.flush(timeout=1) is True
+    data, _, _, cache_key = mocked_cache_set.call_args[0]
+    assert data.read() == b'data'
+    assert cache_key == write_behind_cache.key('foo', folder='templated', extension='pdf')
+
+
+def test_cache_writes_behind_when_asked_to_without_write_behind_set(app, mocked_cache_set):
+    cache = PreviewCache(app)
+    uploading = threading.Event()
+    finish_upload = threading.Event()
+    mocked_cache_set.side_effect = lambda *args: uploading.set() or finish_upload.wait()
+
+    @cache('foo', folder='templated-request', extension='pdf', write_behind=True)
+    def _get():
+        return BytesIO(b'data')
+
+    assert _get().read() == b'data'
+    assert uploading.wait(1)
+    assert cache.flush(timeout=0) is False
+
+    finish_upload.set()
+
+    assert cache.flush(timeout=1) is True
+    assert mocked_cache_set.call_args[0][3] == cache.key('foo', folder='templated-request', extension='pdf')
+
+
+def test_write_behind_cache_drops_uploads_when_the_queue_is_full(write_behind_cache, mocked_cache_set, mocker):
+    mock_incr = mocker.patch.object(write_behind_cache.application.statsd_client, 'incr')
+    uploading = threading.Event()
+    finish_upload = threading.Event()
+    mocked_cache_set.side_effect = lambda *args: uploading.set() or finish_upload.wait()
+
+    assert write_behind_cache.uploader.upload('templated/1.pdf', b'1') is True
+    assert uploading.wait(1)
+    assert write_behind_cache.uploader.upload('templated/2.pdf', b'2') is True
+    assert write_behind_cache.uploader.upload('templated/3.pdf', b'3') is False
+
+    finish_upload.set()
+    write_behind_cache.flush(timeout=1)
+
+    assert [call[0][3] for call in mocked_cache_set.call_args_list] == ['templated/1.pdf', 'templated/2.pdf']
+    mock_incr.assert_any_call('cache.write-behind.dropped')
+
+
+def test_write_behind_cache_carries_on_after_a_failed_upload(write_behind_cache, mocked_cache_set):
+    mocked_cache_set.side_effect = [Exception('S3 is down'), None]
+
+    write_behind_cache.uploader.upload('templated/1.pdf', b'1')
+    write_behind_cache.flush(timeout=1)
+    write_behind_cache.uploader.upload('templated/2.pdf', b'2')
+
+    assert write_behind_cache.flush(timeout=1) is True
+    assert mocked_cache_set.call_count == 2
+
+
+@pytest.fixture
+def cache_bucket(app):
+    with mock_s3():
+        s3 = boto3.client('s3', region_name=app.config['AWS_REGION'])
+        s3.create_bucket(
+            Bucket=app.config['LETTER_CACHE_BUCKET_NAME'],
+            CreateBucketConfiguration={'LocationConstraint': app.config['AWS_REGION']},
+        )
+        yield s3
+
+
+def test_presigned_url_for_cached_file(app, cache_bucket):
+    cache_bucket.put_object(Bucket=app.config['LETTER_CACHE_BUCKET_NAME'], Key='templated/abc.pdf', Body=b'data')
+    cache = PreviewCache(app)
+
+    url = cache.presigned_url('templated/abc.pdf')
+
+    assert 'test-template-preview-cache' in url
+    assert '/templated/abc.pdf?' in url
+    assert 'Signature=' in url
+    assert cache.stats == {('s3', 'templated', 'hit'): 1}
+
+
+def test_presigned_url_is_none_if_file_is_not_cached(app, cache_bucket):
+    cache = PreviewCache(app)
+
+    assert cache.presigned_url('templated/abc.pdf') is None
+    assert cache.stats == {('s3', 'templated', 'miss'): 1}
+
+
+def test_boto3_session_is_one_per_thread():
+    sessions = []
+    thread = threading.Thread(target=lambda: sessions.append(boto3_session()))
+    thread.start()
+    thread.join()
+
+    assert boto3_session() is boto3_session()
+    assert sessions[0] is not boto3_session()
+
+
+def test_cache_reads_and_writes_s3_with_its_own_session(app, cache_bucket, mocker):
+    # the autouse fixtures mock these out, so put the real ones back
+    mocker.patch('app.cache.s3download', new=s3download)
+    mocker.patch('app.cache.s3upload', new=s3upload)
+    cache = PreviewCache(app)
+
+    @cache('foo', folder='templated', extension='pdf')
+    def _get():
+        return BytesIO(b'data')
+
+    assert _get().read() == b'data'
+    assert cache.get(cache.key('foo', folder='templated', extension='pdf')).read() == b'data'
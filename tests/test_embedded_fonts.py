@@ -3,6 +3,7 @@ import pytest
 
 from app.embedded_fonts import contains_unembedded_fonts, remove_embedded_fonts
 
+from tests.conftest import set_config
 from tests.pdf_consts import blank_with_address, valid_letter, multi_page_pdf, example_dwp_pdf
 
 
@@ -23,3 +24,10 @@ def test_remove_embedded_fonts():
     new_pdf = remove_embedded_fonts(BytesIO(multi_page_pdf))
 
     assert not contains_unembedded_fonts(new_pdf)
+
+
+def test_remove_embedded_fonts_with_ghostscript_pool(app):
+    with set_config(app, 'GHOSTSCRIPT_POOL', True):
+        new_pdf = remove_embedded_fonts(BytesIO(multi_page_pdf))
+
+    assert not contains_unembedded_fonts(new_pdf)
@@ -0,0 +1,110 @@
+import subprocess
+
+import pytest
+
+from app.ghostscript_pool import GhostscriptPool, ghostscript_version
+from app.transformation import CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT
+from tests.conftest import set_config
+from tests.pdf_consts import multi_page_pdf
+
+
+@pytest.fixture
+def ghostscript_pool(app):
+    with set_config(app, 'GHOSTSCRIPT_POOL_SIZE', 1):
+        pool = GhostscriptPool(app)
+        yield pool
+        pool.stop()
+
+
+def _idle_worker(pool):
+    return pool._workers[CMYK_GHOSTSCRIPT_ARGS].queue[-1]
+
+
+def test_run_reuses_workers(ghostscript_pool):
+    first = ghostscript_pool.run(multi_page_pdf, CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT)
+    worker = _idle_worker(ghostscript_pool)
+    second = ghostscript_pool.run(multi_page_pdf, CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT)
+
+    assert first.startswith(b'%PDF-1.7\n')
+    assert second.startswith(b'%PDF-1.7\n')
+    assert _idle_worker(ghostscript_pool) is worker
+    assert worker.jobs_run == 2
+    assert worker.is_alive()
+
+
+@pytest.mark.parametrize('name, value', [
+    ('GHOSTSCRIPT_WORKER_MAX_JOBS', 1),
+    ('GHOSTSCRIPT_WORKER_MAX_RSS_MB', 0),
+])
+def test_run_recycles_workers(app, ghostscript_pool, name, value):
+    with set_config(app, name, value):
+        ghostscript_pool.run(multi_page_pdf, CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT)
+
+    assert _idle_worker(ghostscript_pool) is None
+
+
+def test_run_retires_worker_if_job_fails(ghostscript_pool):
+    ghostscript_pool.run(multi_page_pdf, CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT)
+    worker = _idle_worker(ghostscript_pool)
+
+    with pytest.raises(Exception) as excinfo:
+        ghostscript_pool.run(b'not a pdf', CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT)
+
+    assert 'ghostscript worker job failed' in str(excinfo.value)
+    assert _idle_worker(ghostscript_pool) is None
+    assert not worker.is_alive()
+    # and the next job gets a new worker
+    assert ghostscript_pool.run(
+        multi_page_pdf, CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT
+    ).startswith(b'%PDF-1.7\n')
+
+
+def test_run_kills_worker_that_times_out(app, ghostscript_pool, mocker):
+    mocker.patch('app.ghostscript_pool.select.select', return_value=([], [], []))
+
+    with pytest.raises(Exception) as excinfo:
+        ghostscript_pool.run(multi_page_pdf, CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT)
+
+    assert 'ghostscript worker timed out' in str(excinfo.value)
+    assert _idle_worker(ghostscript_pool) is None
+
+
+def test_forked_process_starts_its_own_workers(ghostscript_pool, mocker):
+    ghostscript_pool.run(multi_page_pdf, CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT)
+    parent_worker = _idle_worker(ghostscript_pool)
+    mocker.patch('app.ghostscript_pool.os.getpid', return_value=-1)
+
+    ghostscript_pool.run(multi_page_pdf, CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT)
+
+    assert _idle_worker(ghostscript_pool) is not parent_worker
+    parent_worker.stop()
+
+
+@pytest.mark.parametrize('output, expected_version', [
+    (b'9.21\n', (9, 21)),
+    (b'10.02.1\n', (10, 2, 1)),
+])
+def test_ghostscript_version(mocker, output, expected_version):
+    mock_check_output = mocker.patch('app.ghostscript_pool.subprocess.check_output', return_value=output)
+
+    assert ghostscript_version() == expected_version
+    assert mock_check_output.call_args[0][0] == ['gs', '--version']
+
+
+def test_run_checks_ghostscript_version_before_starting_first_worker(ghostscript_pool, mocker):
+    mocker.patch('app.ghostscript_pool.ghostscript_version', return_value=(9, 20))
+    mock_worker = mocker.patch('app.ghostscript_pool.GhostscriptWorker')
+
+    with pytest.raises(Exception) as excinfo:
+        ghostscript_pool.run(multi_page_pdf, CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT)
+
+    assert str(excinfo.value) == 'ghostscript worker needs ghostscript 9.21 or later, not 9.20'
+    assert mock_worker.called is False
+
+
+def test_workers_are_started_without_safer(ghostscript_pool, mocker):
+    mock_popen = mocker.patch('app.ghostscript_pool.subprocess.Popen', wraps=subprocess.Popen)
+
+    ghostscript_pool.run(multi_page_pdf, CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT)
+
+    assert '-dNOSAFER' in mock_popen.call_args[0][0]
@@ -0,0 +1,78 @@
+from unittest.mock import Mock
+
+import pytest
+
+import gunicorn_config
+
+
+@pytest.fixture
+def worker():
+    worker = Mock(alive=True, nr=5, max_requests=1000)
+    gunicorn_config.post_fork(Mock(), worker)
+    return worker
+
+
+def test_post_fork_jitters_memory_limits(worker):
+    assert gunicorn_config.WORKER_MAX_RSS_MB * 0.9 <= worker.max_rss_mb <= gunicorn_config.WORKER_MAX_RSS_MB
+    assert worker.max_rss_growth_mb / gunicorn_config.WORKER_MAX_RSS_GROWTH_MB == pytest.approx(
+        worker.max_rss_mb / gunicorn_config.WORKER_MAX_RSS_MB
+    )
+
+
+def test_post_request_keeps_warm_workers(worker, mocker):
+    mocker.patch('gunicorn_config._rss_mb', side_effect=[200, 220])
+
+    gunicorn_config.post_request(worker, Mock(), {}, Mock())
+    gunicorn_config.post_request(worker, Mock(), {}, Mock())
+
+    assert worker.alive is True
+    assert worker.first_request_rss_mb == 200
+
+
+@pytest.mark.parametrize('rss_mb, reason', [
+    ([200, 400], 'rss'),
+    ([100, 300], 'rss-growth'),
+])
+def test_post_request_recycles_workers_using_too_much_memory(worker, mocker, rss_mb, reason):
+    mocker.patch('gunicorn_config._rss_mb', side_effect=rss_mb)
+
+    gunicorn_config.post_request(worker, Mock(), {}, Mock())
+    gunicorn_config.post_request(worker, Mock(), {}, Mock())
+
+    assert worker.alive is False
+    assert worker.recycle_reason == reason
+
+
+@pytest.mark.parametrize('recycle_reason, nr, expected_reason', [
+    ('rss', 5, 'rss'),
+    (None, 1000, 'max-requests'),
+    (None, 5, 'exit'),
+])
+def test_worker_exit_records_why_the_worker_stopped(worker, mocker, recycle_reason, nr, expected_reason):
+    mocker.patch('gunicorn_config._rss_mb', return_value=300)
+    worker.recycle_reason = recycle_reason
+    worker.nr = nr
+
+    gunicorn_config.worker_exit(Mock(), worker)
+
+    worker.wsgi.statsd_client.incr.assert_called_once_with('gunicorn.worker-exit.{}'.format(expected_reason))
+    worker.wsgi.statsd_client.gauge.assert_called_once_with('gunicorn.worker-exit.rss-mb', 300)
+    worker.wsgi.cache.flush.assert_called_once_with()
+
+
+def test_post_worker_init_warms_up_the_worker(worker, mocker):
+    mocker.patch('gunicorn_config.WARM_UP_WORKERS', True)
+    mock_warm_up_worker = mocker.patch('app.warmup.warm_up_worker')
+
+    gunicorn_config.post_worker_init(worker)
+
+    mock_warm_up_worker.assert_called_once_with(worker.wsgi)
+
+
+def test_post_worker_init_does_nothing_unless_asked_to(worker, mocker):
+    mocker.patch('gunicorn_config.WARM_UP_WORKERS', False)
+    mock_warm_up_worker = mocker.patch('app.warmup.warm_up_worker')
+
+    gunicorn_config.post_worker_init(worker)
+
+    assert mock_warm_up_worker.called is False
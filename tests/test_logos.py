@@ -0,0 +1,122 @@
+import urllib.error
+from http.client import HTTPMessage
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.logos import LogoCache, logo_url_fetcher
+from tests.conftest import set_config
+
+LOGO_URL = 'https://static-logos.notify.tools/letters/hm-government.svg'
+
+
+def _response(data, etag='"abc"', content_type='image/svg+xml'):
+    headers = HTTPMessage()
+    headers['Content-Type'] = content_type
+    if etag:
+        headers['ETag'] = etag
+
+    response = MagicMock()
+    response.__enter__.return_value.headers = headers
+    response.__enter__.return_value.read.return_value = data
+    return response
+
+
+def _not_modified():
+    return urllib.error.HTTPError(LOGO_URL, 304, 'Not Modified', HTTPMessage(), None)
+
+
+@pytest.fixture
+def logo_cache(app, tmpdir):
+    with set_config(app, 'LETTER_LOGO_CACHE_DISK_PATH', str(tmpdir.join('logos'))):
+        yield LogoCache(app)
+
+
+def test_fetch_keeps_logos_in_memory(logo_cache, mocker):
+    mock_urlopen = mocker.patch('app.logos.urllib.request.urlopen', return_value=_response(b'<svg/>'))
+
+    assert logo_cache.fetch(LOGO_URL) == ('image/svg+xml', b'<svg/>')
+    assert logo_cache.fetch(LOGO_URL) == ('image/svg+xml', b'<svg/>')
+
+    assert mock_urlopen.call_count == 1
+
+
+def test_fetch_revalidates_logos_older_than_the_ttl(logo_cache, mocker):
+    logo_cache.ttl_seconds = 0
+    mock_urlopen = mocker.patch(
+        'app.logos.urllib.request.urlopen',
+        side_effect=[_response(b'<svg/>'), _not_modified()],
+    )
+
+    assert logo_cache.fetch(LOGO_URL) == ('image/svg+xml', b'<svg/>')
+    assert logo_cache.fetch(LOGO_URL) == ('image/svg+xml', b'<svg/>')
+
+    assert mock_urlopen.call_count == 2
+    assert mock_urlopen.call_args[0][0].get_header('If-none-match') == '"abc"'
+
+
+def test_fetch_replaces_logos_that_have_changed(logo_cache, mocker):
+    logo_cache.ttl_seconds = 0
+    mocker.patch(
+        'app.logos.urllib.request.urlopen',
+        side_effect=[_response(b'<svg/>'), _response(b'<svg></svg>', etag='"def"')],
+    )
+
+    logo_cache.fetch(LOGO_URL)
+
+    assert logo_cache.fetch(LOGO_URL) == ('image/svg+xml', b'<svg></svg>')
+
+
+def test_fetch_revalidates_logos_from_disk(app, logo_cache, mocker):
+    mocker.patch('app.logos.urllib.request.urlopen', return_value=_response(b'<svg/>'))
+    logo_cache.fetch(LOGO_URL)
+
+    # a new process on the same host
+    with set_config(app, 'LETTER_LOGO_CACHE_DISK_PATH', logo_cache.disk_path):
+        other_logo_cache = LogoCache(app)
+    mock_urlopen = mocker.patch('app.logos.urllib.request.urlopen', side_effect=_not_modified())
+
+    assert other_logo_cache.fetch(LOGO_URL) == ('image/svg+xml', b'<svg/>')
+    assert mock_urlopen.call_args[0][0].get_header('If-none-match') == '"abc"'
+
+
+def test_fetch_raises_if_logo_cant_be_fetched(logo_cache, mocker):
+    mocker.patch(
+        'app.logos.urllib.request.urlopen',
+        side_effect=urllib.error.HTTPError(LOGO_URL, 404, 'Not Found', HTTPMessage(), None),
+    )
+
+    with pytest.raises(urllib.error.HTTPError):
+        logo_cache.fetch(LOGO_URL)
+
+
+def test_fetch_reads_logos_from_local_directory(app, tmpdir, mocker):
+    tmpdir.join('hm-government.svg').write_binary(b'<svg/>')
+    mock_urlopen = mocker.patch('app.logos.urllib.request.urlopen')
+
+    with set_config(app, 'LETTER_LOGO_LOCAL_DIRECTORY', str(tmpdir)):
+        logo_cache = LogoCache(app)
+
+    assert logo_cache.fetch(LOGO_URL) == ('image/svg+xml', b'<svg/>')
+    assert mock_urlopen.called is False
+
+
+def test_logo_url_fetcher_serves_logos_from_the_logo_cache(app, mocker):
+    mock_fetch = mocker.patch.object(app.logo_cache, 'fetch', return_value=('image/svg+xml', b'<svg/>'))
+    mock_default_url_fetcher = mocker.patch('app.logos.default_url_fetcher')
+
+    assert logo_url_fetcher(LOGO_URL) == {
+        'string': b'<svg/>',
+        'mime_type': 'image/svg+xml',
+        'redirected_url': LOGO_URL,
+    }
+    mock_fetch.assert_called_once_with(LOGO_URL)
+    assert mock_default_url_fetcher.called is False
+
+
+def test_logo_url_fetcher_fetches_other_urls_as_normal(app, mocker):
+    mock_fetch = mocker.patch.object(app.logo_cache, 'fetch')
+    mock_default_url_fetcher = mocker.patch('app.logos.default_url_fetcher')
+
+    assert logo_url_fetcher('https://example.com/image.png') == mock_default_url_fetcher.return_value
+    assert mock_fetch.called is False
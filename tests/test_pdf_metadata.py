@@ -0,0 +1,54 @@
+import pytest
+from PyPDF2.generic import ArrayObject, DictionaryObject, NameObject, NumberObject
+
+from app.pdf_metadata import _colourspace_name, get_pdf_metadata, pdf_metadata_as_file, pdf_metadata_from_file
+
+from tests.pdf_consts import cmyk_image_pdf, multi_page_pdf, rgb_image_pdf
+
+
+def test_get_pdf_metadata():
+    metadata = get_pdf_metadata(multi_page_pdf)
+
+    assert metadata['page_count'] == 10
+    assert len(metadata['media_boxes']) == 10
+    left, bottom, right, top = metadata['media_boxes'][0]
+    # A4, in points
+    assert round(right - left) == 595
+    assert round(top - bottom) == 842
+    assert metadata['size_in_bytes'] == len(multi_page_pdf)
+
+
+def test_get_pdf_metadata_lists_image_colourspaces():
+    assert ['RGB' in colourspace for colourspace in get_pdf_metadata(rgb_image_pdf)['image_colourspaces']] == [True]
+    assert ['CMYK' in colourspace for colourspace in get_pdf_metadata(cmyk_image_pdf)['image_colourspaces']] == [True]
+
+
+def test_get_pdf_metadata_does_not_decode_images(mocker):
+    mock_get_data = mocker.patch('PyPDF2.generic.EncodedStreamObject.getData')
+
+    get_pdf_metadata(rgb_image_pdf)
+
+    assert mock_get_data.called is False
+
+
+def _icc_profile(**kwargs):
+    return DictionaryObject({NameObject('/' + key): value for key, value in kwargs.items()})
+
+
+@pytest.mark.parametrize('colourspace, expected_name', [
+    (NameObject('/DeviceRGB'), 'DeviceRGB'),
+    (ArrayObject([NameObject('/ICCBased'), _icc_profile(N=NumberObject(4))]), 'DeviceCMYK'),
+    (
+        ArrayObject([NameObject('/ICCBased'), _icc_profile(N=NumberObject(3), Alternate=NameObject('/DeviceRGB'))]),
+        'DeviceRGB',
+    ),
+    (ArrayObject([NameObject('/Indexed'), NameObject('/DeviceCMYK'), NumberObject(255)]), 'DeviceCMYK'),
+    (ArrayObject([NameObject('/Separation'), NameObject('/Spot'), NameObject('/DeviceCMYK')]), 'DeviceCMYK'),
+    (ArrayObject([NameObject('/Lab'), DictionaryObject()]), 'Lab'),
+])
+def test_colourspace_name(colourspace, expected_name):
+    assert _colourspace_name(colourspace) == expected_name
+
+
+def test_pdf_metadata_round_trips_through_a_file():
+    assert pdf_metadata_from_file(pdf_metadata_as_file(multi_page_pdf)) == get_pdf_metadata(multi_page_pdf)
@@ -2,7 +2,7 @@ import base64
 import io
 import re
 from io import BytesIO
-from unittest.mock import MagicMock, ANY, call
+from unittest.mock import MagicMock, ANY, PropertyMock, call
 
 import PyPDF2
 import pytest
@@ -27,10 +27,12 @@ from app.precompiled import (
     handle_irregular_whitespace_characters,
     is_notify_tag_present,
     redact_precompiled_letter_address_block,
+    register_font,
     replace_first_page_of_pdf_with_new_content,
     rewrite_address_block
 )
 from app.pdf_redactor import RedactionException
+from app.precompiled_document import PrecompiledDocument
 
 from tests.pdf_consts import (
     bad_postcode,
@@ -92,6 +94,15 @@ def test_add_notify_tag_to_letter(mocker):
     assert pdf_new.getPage(3).extractText() == pdf_original.getPage(3).extractText()
 
 
+def test_register_font_only_parses_the_font_once(mocker):
+    register_font()
+    mock_ttfont = mocker.patch('app.precompiled.TTFont')
+
+    register_font()
+
+    assert mock_ttfont.called is False
+
+
 def test_add_notify_tag_to_letter_correct_margins(mocker):
     pdf_original = PyPDF2.PdfFileReader(BytesIO(multi_page_pdf))
 
@@ -331,7 +342,7 @@ def test_overlay_template_png_for_page_not_encoded(client, auth_header):
 ])
 def test_overlay_template_png_for_page_checks_if_first_page(client, auth_header, mocker, params, expected_first_page):
 
-    mock_png_from_pdf = mocker.patch('app.precompiled.png_from_pdf', return_value=BytesIO(b'\x00'))
+    mock_png_from_pdf = mocker.patch('app.preview.png_from_pdf', return_value=BytesIO(b'\x00'))
     mock_colour = mocker.patch('app.precompiled._colour_no_print_areas_of_single_page_pdf_in_red')
 
     response = client.post(
@@ -348,6 +359,18 @@ def test_overlay_template_png_for_page_checks_if_first_page(client, auth_header,
     mock_png_from_pdf.assert_called_once_with(mock_colour.return_value, page_number=1)
 
 
+def test_overlay_template_png_for_page_renders_a_png(client, auth_header):
+    response = client.post(
+        url_for('precompiled_blueprint.overlay_template_png_for_page', page_number='1'),
+        data=blank_page,
+        headers=auth_header
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert response.get_data().startswith(b'\x89PNG')
+
+
 def test_overlay_template_png_for_page_errors_if_not_a_pdf(client, auth_header):
     resp = client.post(
         url_for('precompiled_blueprint.overlay_template_png_for_page', is_first_page='true'),
@@ -463,7 +486,7 @@ def test_precompiled_sanitise_pdf_with_colour_in_address_margin_returns_400(clie
 
 
 def test_precompiled_sanitise_pdf_that_is_too_long_returns_400(client, auth_header, mocker):
-    mocker.patch('app.precompiled.pdf_page_count', return_value=11)
+    mocker.patch.object(PrecompiledDocument, 'page_count', new_callable=PropertyMock, return_value=11)
     mocker.patch('app.precompiled.is_letter_too_long', return_value=True)
     response = client.post(
         url_for('precompiled_blueprint.sanitise_precompiled_letter'),
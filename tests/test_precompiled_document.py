@@ -0,0 +1,83 @@
+from io import BytesIO
+from unittest.mock import MagicMock, PropertyMock
+
+import fitz
+import pytest
+from PyPDF2 import PdfFileReader
+
+from app import InvalidRequest
+from app.precompiled_document import PrecompiledDocument
+from tests.pdf_consts import a3_size, cmyk_image_pdf, example_dwp_pdf, multi_page_pdf, rgb_image_pdf
+
+
+def test_from_file_copies_a_file_and_puts_it_back():
+    pdf = BytesIO(multi_page_pdf)
+    pdf.seek(100)
+
+    document = PrecompiledDocument.from_file(pdf)
+
+    assert document.read() == multi_page_pdf
+    assert pdf.tell() == 0
+
+
+def test_from_file_returns_a_document_as_it_is():
+    document = PrecompiledDocument(multi_page_pdf)
+    document.read()
+
+    assert PrecompiledDocument.from_file(document) is document
+    assert document.tell() == 0
+
+
+def test_page_count_and_sizes():
+    document = PrecompiledDocument(a3_size)
+
+    assert document.page_count == 1
+    height, width, _ = document.page_sizes[0]
+    assert (round(height), round(width)) == (420, 297)
+
+
+def test_pdf_is_parsed_once_by_pypdf2(mocker):
+    mock_reader = mocker.patch('app.precompiled_document.PdfFileReader', wraps=PdfFileReader)
+    document = PrecompiledDocument(multi_page_pdf)
+
+    assert document.page_count == 10
+    assert len(document.page_sizes) == 10
+    assert document.unembedded_fonts
+
+    assert mock_reader.call_count == 1
+
+
+def test_pdf_is_parsed_once_by_fitz(mocker):
+    mock_open = mocker.patch('app.precompiled_document.fitz.open', wraps=fitz.open)
+    document = PrecompiledDocument(multi_page_pdf)
+
+    assert document.words(0) == document.words(0)
+    assert document.words(1)
+    assert document.image_colourspaces is not None
+
+    assert mock_open.call_count == 1
+
+
+@pytest.mark.parametrize('data, colourspace, result', [
+    (cmyk_image_pdf, 'CMYK', True),
+    (cmyk_image_pdf, 'RGB', False),
+    (rgb_image_pdf, 'RGB', True),
+    (rgb_image_pdf, 'CMYK', False),
+])
+def test_contains_colourspace(client, data, colourspace, result):
+    assert PrecompiledDocument(data).contains_colourspace(colourspace) == result
+
+
+def test_image_colourspaces_raises_invalid_request_for_unreadable_pages(client, mocker):
+    fitz_document = MagicMock(__len__=lambda self: 1, getPageImageList=MagicMock(side_effect=RuntimeError))
+    mocker.patch.object(PrecompiledDocument, 'fitz_document', new_callable=PropertyMock, return_value=fitz_document)
+
+    with pytest.raises(InvalidRequest) as excinfo:
+        PrecompiledDocument(rgb_image_pdf).image_colourspaces
+
+    assert excinfo.value.message == 'Invalid PDF on page 1'
+
+
+def test_unembedded_fonts():
+    assert not PrecompiledDocument(example_dwp_pdf).unembedded_fonts
+    assert PrecompiledDocument(multi_page_pdf).unembedded_fonts
@@ -1,5 +1,6 @@
+import json
 from io import BytesIO
-from base64 import b64encode
+from base64 import b64decode, b64encode, encodebytes
 from flask import url_for
 import pytest
 
@@ -45,8 +46,8 @@ def test_precompiled_pdf_defaults_first_page_when_no_request_args(
     mocker,
 ):
     mocked_png_from_pdf = mocker.patch(
-        'app.preview.png_from_pdf',
-        return_value=BytesIO(b'\x00'),
+        'app.preview.pngs_from_pdf_with_and_without_notify_tag',
+        return_value={False: BytesIO(b'\x00'), True: BytesIO(b'\x01')},
     )
 
     response = client.post(
@@ -84,13 +85,18 @@ def test_precompiled_pdf_caches_png_to_s3(
     assert response.get_data().startswith(b'\x89PNG')
     mocked_cache_get.assert_called_once_with(
         'test-template-preview-cache',
-        'precompiled/f9094f49cd156f0a5fb5082820fa4f396e082d88.page01.png'
+        'precompiled/4b5daa8ba150ee3cb2a74721b30b5bf8e3c081d0.page01.png'
+    )
+    assert mocked_cache_set.call_count == 2
+    # the version with the notify tag hidden is made from the same raster, and cached too
+    assert mocked_cache_set.call_args_list[0][0][3] == (
+        'precompiled/4b5daa8ba150ee3cb2a74721b30b5bf8e3c081d0.page01.hide-notify.png'
     )
     mocked_cache_set.call_args[0][0].seek(0)
     assert mocked_cache_set.call_args[0][0].read() == response.get_data()
     assert mocked_cache_set.call_args[0][1] == 'eu-west-1'
     assert mocked_cache_set.call_args[0][2] == 'test-template-preview-cache'
-    assert mocked_cache_set.call_args[0][3] == 'precompiled/f9094f49cd156f0a5fb5082820fa4f396e082d88.page01.png'
+    assert mocked_cache_set.call_args[0][3] == 'precompiled/4b5daa8ba150ee3cb2a74721b30b5bf8e3c081d0.page01.png'
 
 
 def test_precompiled_pdf_returns_png_from_cache(
@@ -115,22 +121,54 @@ def test_precompiled_pdf_returns_png_from_cache(
     assert response.status_code == 200
     assert response.headers['Content-Type'] == 'image/png'
     assert response.get_data() == b'\x00'
+    assert response.headers['ETag'] == '"precompiled/4b5daa8ba150ee3cb2a74721b30b5bf8e3c081d0.page01.png"'
     mocked_cache_get.assert_called_once_with(
         'test-template-preview-cache',
-        'precompiled/f9094f49cd156f0a5fb5082820fa4f396e082d88.page01.png'
+        'precompiled/4b5daa8ba150ee3cb2a74721b30b5bf8e3c081d0.page01.png'
     )
     assert mocked_cache_set.call_args_list == []
 
 
-@pytest.mark.parametrize('hide_notify_arg,called_hide_notify_tag', [
-    ('true', True),
-    ('', False),
+@pytest.mark.parametrize('hide_notify_arg, expected_etag', [
+    ('true', '"precompiled/4b5daa8ba150ee3cb2a74721b30b5bf8e3c081d0.page01.hide-notify.png"'),
+    ('', '"precompiled/4b5daa8ba150ee3cb2a74721b30b5bf8e3c081d0.page01.png"'),
+])
+def test_precompiled_pdf_returns_304_without_rendering_if_etag_matches(
+    client,
+    auth_header,
+    mocked_cache_get,
+    mocker,
+    hide_notify_arg,
+    expected_etag,
+):
+    mock_get_png = mocker.patch('app.preview.get_png_from_precompiled')
+
+    response = client.post(
+        url_for('preview_blueprint.view_precompiled_letter', hide_notify=hide_notify_arg),
+        data=b64encode(valid_letter),
+        headers={
+            'Content-type': 'application/json',
+            'If-None-Match': expected_etag,
+            **auth_header
+        }
+    )
+
+    assert response.status_code == 304
+    assert response.headers['ETag'] == expected_etag
+    assert mock_get_png.called is False
+    assert mocked_cache_get.called is False
+
+
+@pytest.mark.parametrize('hide_notify_arg, expected_extension', [
+    ('true', 'page01.hide-notify.png'),
+    ('', 'page01.png'),
 ])
 def test_precompiled_valid_letter_get_image_by_page_hides_notify_tag(
     client,
     auth_header,
     hide_notify_arg,
-    called_hide_notify_tag,
+    expected_extension,
+    mocked_cache_get,
     mocker,
 ):
     mocked_hide_notify = mocker.patch('app.preview.hide_notify_tag')
@@ -147,7 +185,34 @@ def test_precompiled_valid_letter_get_image_by_page_hides_notify_tag(
         }
     )
 
-    assert mocked_hide_notify.called == called_hide_notify_tag
+    # both versions are made whichever was asked for, so the other one is already cached
+    assert mocked_hide_notify.call_count == 1
+    assert mocked_cache_get.call_args[0][1].split('.', 1)[1] == expected_extension
+
+
+def test_precompiled_cache_key_depends_on_pdf_not_base64_encoding(
+    client,
+    auth_header,
+    mocked_cache_get,
+    mocker,
+):
+    mocker.patch(
+        'app.preview.pngs_from_pdf_with_and_without_notify_tag',
+        return_value={False: BytesIO(b'\x00'), True: BytesIO(b'\x01')},
+    )
+
+    for encoded_string in (b64encode(valid_letter), encodebytes(valid_letter)):
+        client.post(
+            url_for('preview_blueprint.view_precompiled_letter'),
+            data=encoded_string,
+            headers={
+                'Content-type': 'application/json',
+                **auth_header
+            }
+        )
+
+    first_cache_key, second_cache_key = [call[0][1] for call in mocked_cache_get.call_args_list]
+    assert first_cache_key == second_cache_key
 
 
 def test_precompiled_cmyk_colourspace_calls_transform_colorspace(
@@ -243,3 +308,88 @@ def test_precompiled_not_pdf_get_image_by_page_raises_400(
     )
 
     assert response.status_code == 400
+
+
+@pytest.mark.parametrize('pages, expected_pages', [
+    (None, [str(page) for page in range(1, 11)]),
+    ('1-3', ['1', '2', '3']),
+    ('10', ['10']),
+])
+def test_precompiled_pages_returns_requested_pages(
+    client,
+    auth_header,
+    mocked_cache_set,
+    pages,
+    expected_pages,
+):
+    response = client.post(
+        url_for('preview_blueprint.view_precompiled_letter_pages', pages=pages),
+        data=b64encode(multi_page_pdf),
+        headers={
+            'Content-type': 'application/json',
+            **auth_header
+        }
+    )
+
+    assert response.status_code == 200
+    json_response = json.loads(response.get_data(as_text=True))
+    assert json_response['page_count'] == 10
+    assert json_response['mimetype'] == 'image/png'
+    assert list(json_response['pages']) == expected_pages
+    assert all(b64decode(png).startswith(b'\x89PNG') for png in json_response['pages'].values())
+    cached_extensions = [call[0][3].split('.', 1)[1] for call in mocked_cache_set.call_args_list]
+    for page in expected_pages:
+        assert 'page{:02d}.png'.format(int(page)) in cached_extensions
+        assert 'page{:02d}.hide-notify.png'.format(int(page)) in cached_extensions
+
+
+def test_precompiled_pages_in_jpeg_format(
+    client,
+    auth_header,
+    mocked_cache_set,
+):
+    response = client.post(
+        url_for('preview_blueprint.view_precompiled_letter_pages', pages='1', format='jpeg', quality='80'),
+        data=b64encode(multi_page_pdf),
+        headers={
+            'Content-type': 'application/json',
+            **auth_header
+        }
+    )
+
+    assert response.status_code == 200
+    json_response = json.loads(response.get_data(as_text=True))
+    assert json_response['mimetype'] == 'image/jpeg'
+    assert b64decode(json_response['pages']['1']).startswith(b'\xff\xd8\xff')
+
+
+def test_precompiled_pages_400s_for_page_not_in_letter(
+    client,
+    auth_header,
+):
+    response = client.post(
+        url_for('preview_blueprint.view_precompiled_letter_pages', pages='11'),
+        data=b64encode(multi_page_pdf),
+        headers={
+            'Content-type': 'application/json',
+            **auth_header
+        }
+    )
+
+    assert response.status_code == 400
+
+
+def test_precompiled_pages_not_pdf_raises_400(
+    client,
+    auth_header,
+):
+    response = client.post(
+        url_for('preview_blueprint.view_precompiled_letter_pages'),
+        data=b64encode(not_pdf),
+        headers={
+            'Content-type': 'application/json',
+            **auth_header
+        }
+    )
+
+    assert response.status_code == 400
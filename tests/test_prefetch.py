@@ -0,0 +1,65 @@
+import threading
+
+from flask import current_app, has_request_context
+
+from app.prefetch import Prefetcher
+from tests.conftest import set_config
+
+
+def test_prefetcher_runs_function_in_background_with_request_context(app):
+    prefetcher = Prefetcher(app)
+    finished = threading.Event()
+    results = []
+
+    def prefetch(arg):
+        results.append((
+            arg,
+            current_app.name,
+            has_request_context(),
+            threading.current_thread() is not threading.main_thread(),
+        ))
+        finished.set()
+
+    assert prefetcher.submit(prefetch, 'foo') is True
+    assert finished.wait(1)
+    assert results == [('foo', app.name, True, True)]
+
+
+def test_prefetcher_drops_work_when_every_slot_is_busy(app, mocker):
+    mock_incr = mocker.patch.object(app.statsd_client, 'incr')
+    with set_config(app, 'PREVIEW_PREFETCH_CONCURRENCY', 1):
+        prefetcher = Prefetcher(app)
+    started, finish = threading.Event(), threading.Event()
+    slow_prefetch = mocker.Mock(side_effect=lambda: started.set() or finish.wait(), __name__='slow_prefetch')
+    other_prefetch = mocker.Mock(__name__='other_prefetch')
+
+    assert prefetcher.submit(slow_prefetch) is True
+    assert started.wait(1)
+    assert prefetcher.submit(other_prefetch) is False
+
+    finish.set()
+    assert other_prefetch.called is False
+    mock_incr.assert_any_call('prefetch.dropped')
+
+
+def test_prefetcher_frees_its_slot_after_an_error(app, mocker):
+    with set_config(app, 'PREVIEW_PREFETCH_CONCURRENCY', 1):
+        prefetcher = Prefetcher(app)
+    failed, finished = threading.Event(), threading.Event()
+    mock_logger = mocker.patch.object(app.logger, 'exception')
+
+    def broken_prefetch():
+        failed.set()
+        raise ValueError('oh no')
+
+    prefetcher.submit(broken_prefetch)
+    assert failed.wait(1)
+
+    # the slot is released just after the error is logged
+    for _ in range(20):
+        if prefetcher.submit(finished.set):
+            break
+        finished.wait(0.05)
+
+    assert finished.wait(1)
+    mock_logger.assert_called_once_with('Failed to prefetch broken_prefetch')
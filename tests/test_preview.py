@@ -1,15 +1,32 @@
+import base64
 import json
 import uuid
 from io import BytesIO
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, call, patch
 
 from flask import url_for
-from flask_weasyprint import HTML
 from freezegun import freeze_time
 import pytest
+from notifications_utils.pdf import pdf_page_count
 from notifications_utils.s3 import S3ObjectNotFound
-
-from app.preview import get_html
+from weasyprint import HTML
+from werkzeug.exceptions import BadRequest
+
+from app.pdf_metadata import pdf_metadata_as_file
+from app.preview import (
+    DEFAULT_IMAGE_OPTIONS,
+    ImageOptions,
+    _notify_tag_cover_size,
+    _page_image_extension,
+    get_html,
+    get_image_options,
+    get_page_count,
+    get_page_numbers,
+    get_request_cache_key_args,
+    get_single_page_of_pdf,
+    prefetch_pngs,
+    prefetch_pngs_from_precompiled,
+)
 
 from tests.pdf_consts import valid_letter, multi_page_pdf
 from tests.conftest import set_config
@@ -111,6 +128,18 @@ def test_return_headers_match_filetype(view_letter_template, filetype, mimetype)
     assert resp.headers['Content-Type'] == mimetype
 
 
+@pytest.fixture
+def request_cache_key(app, preview_post_body):
+    """
+    The key of a templated preview in the cache, worked out from the request, for the default preview_post_body
+    """
+    return lambda extension, json=preview_post_body: app.cache.key(
+        *get_request_cache_key_args(json),
+        folder='templated-request',
+        extension=extension,
+    )
+
+
 @freeze_time('2012-12-12')
 def test_get_pdf_caches_with_correct_keys(
     app,
@@ -118,23 +147,30 @@ def test_get_pdf_caches_with_correct_keys(
     view_letter_template,
     mocked_cache_get,
     mocked_cache_set,
+    request_cache_key,
 ):
     expected_cache_key = 'templated/13a0bbf4a494b3329e399d8e19682e8f14f1f7e4.pdf'
     resp = view_letter_template(filetype='pdf')
+    # the request-keyed copy is uploaded in the background
+    app.cache.flush()
 
     assert resp.status_code == 200
     assert resp.headers['Content-Type'] == 'application/pdf'
     assert resp.get_data().startswith(b'%PDF-1.5')
-    mocked_cache_get.assert_called_once_with(
-        'test-template-preview-cache',
-        expected_cache_key
-    )
-    assert mocked_cache_set.call_count == 1
-    mocked_cache_set.call_args[0][0].seek(0)
-    assert mocked_cache_set.call_args[0][0].read() == resp.get_data()
-    assert mocked_cache_set.call_args[0][1] == 'eu-west-1'
-    assert mocked_cache_set.call_args[0][2] == 'test-template-preview-cache'
-    assert mocked_cache_set.call_args[0][3] == expected_cache_key
+    assert mocked_cache_get.call_args_list == [
+        call('test-template-preview-cache', request_cache_key('pdf')),
+        call('test-template-preview-cache', expected_cache_key),
+    ]
+    assert [cache_set[0][3] for cache_set in mocked_cache_set.call_args_list] == [
+        expected_cache_key + '.json',
+        expected_cache_key,
+        request_cache_key('pdf'),
+    ]
+    for cache_set in mocked_cache_set.call_args_list[1:]:
+        cache_set[0][0].seek(0)
+        assert cache_set[0][0].read() == resp.get_data()
+        assert cache_set[0][1] == 'eu-west-1'
+        assert cache_set[0][2] == 'test-template-preview-cache'
 
 
 @freeze_time('2012-12-12')
@@ -144,44 +180,53 @@ def test_get_png_caches_with_correct_keys(
     view_letter_template,
     mocked_cache_get,
     mocked_cache_set,
+    request_cache_key,
 ):
     expected_cache_key = 'templated/13a0bbf4a494b3329e399d8e19682e8f14f1f7e4.page01.png'
     resp = view_letter_template(filetype='png')
+    app.cache.flush()
 
     assert resp.status_code == 200
     assert resp.headers['Content-Type'] == 'image/png'
     assert resp.get_data().startswith(b'\x89PNG')
-    assert mocked_cache_get.call_count == 2
-    assert mocked_cache_get.call_args_list[0][0][0] == 'test-template-preview-cache'
-    assert mocked_cache_get.call_args_list[0][0][1] == expected_cache_key
-    assert mocked_cache_set.call_count == 2
-    mocked_cache_set.call_args_list[1][0][0].seek(0)
-    assert mocked_cache_set.call_args_list[1][0][0].read() == resp.get_data()
-    assert mocked_cache_set.call_args_list[1][0][1] == 'eu-west-1'
-    assert mocked_cache_set.call_args_list[1][0][2] == 'test-template-preview-cache'
-    assert mocked_cache_set.call_args_list[1][0][3] == expected_cache_key
+    assert [cache_get[0][1] for cache_get in mocked_cache_get.call_args_list] == [
+        request_cache_key('page01.png'),
+        expected_cache_key,
+        'templated/13a0bbf4a494b3329e399d8e19682e8f14f1f7e4.pdf',
+    ]
+    assert mocked_cache_set.call_count == 4
+    for cache_set, cache_key in zip(mocked_cache_set.call_args_list[2:], (
+        expected_cache_key,
+        request_cache_key('page01.png'),
+    )):
+        cache_set[0][0].seek(0)
+        assert cache_set[0][0].read() == resp.get_data()
+        assert cache_set[0][1] == 'eu-west-1'
+        assert cache_set[0][2] == 'test-template-preview-cache'
+        assert cache_set[0][3] == cache_key
 
 
 @pytest.mark.parametrize('side_effects, number_of_cache_get_calls, number_of_cache_set_calls', [
+    # looked up by request, then html, then the pdf is looked up by html
     (
-        [S3ObjectNotFound({}, ''), S3ObjectNotFound({}, '')],
-        2,
-        2,
+        [S3ObjectNotFound({}, ''), S3ObjectNotFound({}, ''), S3ObjectNotFound({}, '')],
+        3,
+        4,
     ),
     (
-        [NonIterableIO(b'\x00'), S3ObjectNotFound({}, '')],
+        [NonIterableIO(b'\x00')],
         1,
         0,
     ),
     (
-        [S3ObjectNotFound({}, ''), NonIterableIO(valid_letter)],
+        [S3ObjectNotFound({}, ''), NonIterableIO(b'\x00')],
         2,
         1,
     ),
     (
-        [NonIterableIO(b'\x00'), NonIterableIO(b'\x00')],
-        1,
-        0,
+        [S3ObjectNotFound({}, ''), S3ObjectNotFound({}, ''), NonIterableIO(valid_letter)],
+        3,
+        2,
     ),
 ])
 def test_get_png_hits_cache_correct_number_of_times(
@@ -198,6 +243,7 @@ def test_get_png_hits_cache_correct_number_of_times(
     mocked_cache_get.side_effect = side_effects
 
     resp = view_letter_template(filetype='png')
+    app.cache.flush()
 
     assert resp.status_code == 200
     assert resp.headers['Content-Type'] == 'image/png'
@@ -205,6 +251,171 @@ def test_get_png_hits_cache_correct_number_of_times(
     assert mocked_cache_set.call_count == number_of_cache_set_calls
 
 
+@pytest.mark.parametrize('filetype', ['pdf', 'png'])
+def test_view_letter_template_cached_by_request_does_not_make_html(
+    view_letter_template,
+    mocked_cache_get,
+    mocked_cache_set,
+    mocker,
+    filetype,
+):
+    mocked_cache_get.side_effect = None
+    mocked_cache_get.return_value = BytesIO(b'cached')
+    mocker.patch('app.preview.get_html', side_effect=AssertionError('Should not make html'))
+
+    resp = view_letter_template(filetype=filetype)
+
+    assert resp.status_code == 200
+    assert resp.get_data() == b'cached'
+    assert mocked_cache_get.call_args[0][1].startswith('templated-request/')
+    assert mocked_cache_set.called is False
+
+
+def test_get_request_cache_key_args_do_not_depend_on_order_of_json(preview_post_body):
+    reordered_post_body = dict(reversed(list(preview_post_body.items())))
+    reordered_post_body['template'] = dict(reversed(list(preview_post_body['template'].items())))
+
+    assert get_request_cache_key_args(reordered_post_body) == get_request_cache_key_args(preview_post_body)
+
+
+def test_get_request_cache_key_args_depend_on_today_unless_date_is_given(preview_post_body):
+    with freeze_time('2012-12-12'):
+        undated_key_args = get_request_cache_key_args(preview_post_body)
+        dated_key_args = get_request_cache_key_args({**preview_post_body, 'date': '2012-12-12T00:00:00'})
+    with freeze_time('2012-12-13'):
+        assert get_request_cache_key_args(preview_post_body) != undated_key_args
+        assert get_request_cache_key_args({**preview_post_body, 'date': '2012-12-12T00:00:00'}) == dated_key_args
+
+
+def test_get_request_cache_key_args_depend_on_logo_url(app, preview_post_body):
+    key_args = get_request_cache_key_args(preview_post_body)
+
+    with set_config(app, 'LETTER_LOGO_URL', 'https://example.com/logos'):
+        assert get_request_cache_key_args(preview_post_body) != key_args
+
+
+@freeze_time('2012-12-12')
+@pytest.mark.parametrize('filetype, extension', [
+    ('pdf', 'pdf'),
+    ('png', 'page01.png'),
+])
+def test_view_letter_template_sets_etag_from_cache_key(view_letter_template, request_cache_key, filetype, extension):
+    resp = view_letter_template(filetype=filetype)
+
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] == '"{}"'.format(request_cache_key(extension))
+    assert resp.headers['Accept-Ranges'] == 'bytes'
+    assert resp.headers['Content-Length'] == str(len(resp.get_data()))
+
+
+@freeze_time('2012-12-12')
+def test_view_letter_template_returns_304_without_rendering_if_etag_matches(
+    view_letter_template,
+    auth_header,
+    mocked_cache_get,
+    mocker,
+    request_cache_key,
+):
+    mock_get_html = mocker.patch('app.preview.get_html')
+    mock_get_pdf = mocker.patch('app.preview.get_pdf')
+
+    resp = view_letter_template(headers={
+        'If-None-Match': '"{}"'.format(request_cache_key('pdf')),
+        **auth_header,
+    })
+
+    assert resp.status_code == 304
+    assert resp.headers['ETag'] == '"{}"'.format(request_cache_key('pdf'))
+    assert resp.get_data() == b''
+    assert mock_get_html.called is False
+    assert mock_get_pdf.called is False
+    assert mocked_cache_get.called is False
+
+
+def test_view_letter_template_renders_if_etag_does_not_match(view_letter_template, auth_header):
+    resp = view_letter_template(headers={'If-None-Match': '"templated/something-else.pdf"', **auth_header})
+
+    assert resp.status_code == 200
+    assert resp.get_data().startswith(b'%PDF-1.')
+
+
+def test_view_letter_template_returns_range_of_cached_pdf(view_letter_template, auth_header, mocked_cache_get):
+    mocked_cache_get.side_effect = None
+    mocked_cache_get.return_value = BytesIO(b'%PDF-1.5 a cached letter')
+
+    resp = view_letter_template(headers={'Range': 'bytes=0-7', **auth_header})
+
+    assert resp.status_code == 206
+    assert resp.get_data() == b'%PDF-1.5'
+    assert resp.headers['Content-Range'] == 'bytes 0-7/24'
+
+
+def test_view_letter_template_streams_cached_file_of_unknown_length(
+    view_letter_template,
+    auth_header,
+    mocked_cache_get,
+):
+    mocked_cache_get.side_effect = None
+    mocked_cache_get.return_value = NonIterableIO(b'%PDF-1.5 a cached letter')
+
+    resp = view_letter_template(headers={'Range': 'bytes=0-7', **auth_header})
+
+    # without a length ranges can't be worked out, so the whole file is sent
+    assert resp.status_code == 200
+    assert resp.get_data() == b'%PDF-1.5 a cached letter'
+    assert 'ETag' in resp.headers
+
+
+@pytest.mark.parametrize('filetype', ['pdf', 'png'])
+def test_view_letter_template_redirects_to_cached_file_if_asked_to(
+    client,
+    auth_header,
+    preview_post_body,
+    mocker,
+    filetype,
+):
+    mock_presigned_url = mocker.patch.object(
+        client.application.cache, 'presigned_url', return_value='https://s3.example.com/cached-file?signature=abc'
+    )
+    mock_get_pdf = mocker.patch('app.preview.get_pdf')
+
+    resp = client.post(
+        url_for('preview_blueprint.view_letter_template', filetype=filetype, redirect='true'),
+        data=json.dumps(preview_post_body),
+        headers={'Content-type': 'application/json', **auth_header},
+    )
+
+    assert resp.status_code == 303
+    assert resp.headers['Location'] == 'https://s3.example.com/cached-file?signature=abc'
+    assert mock_presigned_url.call_args[0][0].startswith('templated-request/')
+    assert mock_get_pdf.called is False
+
+
+def test_view_letter_template_renders_if_asked_to_redirect_to_file_that_is_not_cached(
+    client,
+    auth_header,
+    preview_post_body,
+    mocker,
+):
+    mocker.patch.object(client.application.cache, 'presigned_url', return_value=None)
+
+    resp = client.post(
+        url_for('preview_blueprint.view_letter_template', filetype='pdf', redirect='true'),
+        data=json.dumps(preview_post_body),
+        headers={'Content-type': 'application/json', **auth_header},
+    )
+
+    assert resp.status_code == 200
+    assert resp.get_data().startswith(b'%PDF-1.')
+
+
+def test_view_letter_template_does_not_redirect_unless_asked_to(view_letter_template, mocker, app):
+    mock_presigned_url = mocker.patch.object(app.cache, 'presigned_url')
+
+    assert view_letter_template().status_code == 200
+    assert mock_presigned_url.called is False
+
+
 @pytest.mark.parametrize('filetype, sentence_count, page_number, expected_response_code', [
     ('png', 10, 1, 200),
     ('pdf', 10, 1, 400),
@@ -247,6 +458,352 @@ def test_get_image_by_page(
     assert not mocked_hide_notify.called
 
 
+@pytest.mark.parametrize('page_number', [1, 5, 10])
+def test_get_single_page_of_pdf_returns_only_the_requested_page(page_number):
+    single_page = get_single_page_of_pdf(multi_page_pdf, page_number)
+
+    assert pdf_page_count(BytesIO(single_page)) == 1
+
+
+@pytest.mark.parametrize('page_number', [0, -1, 11])
+def test_get_single_page_of_pdf_400s_if_page_does_not_exist(page_number):
+    with pytest.raises(BadRequest):
+        get_single_page_of_pdf(multi_page_pdf, page_number)
+
+
+@pytest.mark.parametrize('pages, expected_page_numbers', [
+    (None, [1, 2, 3]),
+    ('', [1, 2, 3]),
+    ('2', [2]),
+    ('1-2', [1, 2]),
+    ('3,1', [1, 3]),
+    ('1,2-3,2', [1, 2, 3]),
+])
+def test_get_page_numbers(pages, expected_page_numbers):
+    assert get_page_numbers(pages, 3) == expected_page_numbers
+
+
+@pytest.mark.parametrize('pages', ['0', '4', '2-4', 'one', '1-', '-1', '3-2', '1-999999999999'])
+def test_get_page_numbers_400s_for_invalid_pages(pages):
+    with pytest.raises(BadRequest):
+        get_page_numbers(pages, 3)
+
+
+@pytest.mark.parametrize('args, expected_image_options', [
+    ({}, DEFAULT_IMAGE_OPTIONS),
+    ({'resolution': '50'}, ImageOptions(resolution=50, image_format='png', quality=None)),
+    ({'format': 'png8'}, ImageOptions(resolution=150, image_format='png8', quality=None)),
+    ({'format': 'jpeg', 'quality': '80'}, ImageOptions(resolution=150, image_format='jpeg', quality=80)),
+    (
+        {'format': 'webp', 'quality': '60', 'resolution': '75'},
+        ImageOptions(resolution=75, image_format='webp', quality=60),
+    ),
+])
+def test_get_image_options(args, expected_image_options):
+    assert get_image_options(args) == expected_image_options
+
+
+@pytest.mark.parametrize('args', [
+    {'resolution': '300'},
+    {'resolution': 'high'},
+    {'format': 'gif'},
+    {'format': 'png', 'quality': '80'},
+    {'format': 'jpeg', 'quality': '0'},
+    {'format': 'jpeg', 'quality': '101'},
+])
+def test_get_image_options_400s_for_invalid_args(args):
+    with pytest.raises(BadRequest):
+        get_image_options(args)
+
+
+@pytest.mark.parametrize('hide_notify, image_options, expected_extension', [
+    (False, DEFAULT_IMAGE_OPTIONS, 'page01.png'),
+    (True, DEFAULT_IMAGE_OPTIONS, 'page01.hide-notify.png'),
+    (False, ImageOptions(resolution=50, image_format='png8', quality=None), 'page01.50dpi.palette.png'),
+    (True, ImageOptions(resolution=75, image_format='webp', quality=80), 'page01.hide-notify.75dpi.q80.webp'),
+    (False, ImageOptions(resolution=150, image_format='jpeg', quality=None), 'page01.jpeg'),
+])
+def test_page_image_extension(hide_notify, image_options, expected_extension):
+    assert _page_image_extension(1, hide_notify, image_options) == expected_extension
+
+
+def test_view_letter_template_png_reports_time_spent_in_each_stage(app, view_letter_template, mocker):
+    mock_timing = mocker.patch.object(app.statsd_client, 'timing')
+    mock_logger = mocker.patch.object(app.logger, 'info')
+
+    resp = view_letter_template(filetype='png')
+
+    assert resp.status_code == 200
+    assert [
+        metric.split(';')[0] for metric in resp.headers['Server-Timing'].split(', ')
+    ] == ['s3-get', 'html', 'weasyprint', 's3-put', 'rasterise']
+    mock_timing.assert_any_call('stages.weasyprint', mocker.ANY)
+    assert any(
+        call[0][0].startswith('POST /preview.png 200 stages: s3-get=') for call in mock_logger.call_args_list
+    )
+
+
+@pytest.mark.parametrize('rasteriser', ['fitz', 'pdf2image'])
+def test_view_letter_template_png_with_other_rasterisers(app, view_letter_template, mocker, rasteriser):
+    mocker.patch('app.preview.Image', side_effect=AssertionError('Should not use ImageMagick'))
+
+    with set_config(app, 'TEMPLATED_PREVIEW_RASTERISER', rasteriser):
+        resp = view_letter_template(filetype='png')
+
+    assert resp.status_code == 200
+    assert resp.get_data().startswith(b'\x89PNG')
+
+
+@pytest.mark.parametrize('prefetch_enabled', [True, False])
+def test_view_letter_template_png_prefetches_other_pages_once_sent_if_enabled(
+    app,
+    view_letter_template,
+    mocker,
+    prefetch_enabled,
+):
+    mock_submit = mocker.patch.object(app.prefetcher, 'submit')
+
+    with set_config(app, 'PREVIEW_PREFETCH', prefetch_enabled):
+        resp = view_letter_template(filetype='png')
+
+    assert resp.status_code == 200
+    assert mock_submit.called is False
+
+    resp.close()
+
+    if prefetch_enabled:
+        mock_submit.assert_called_once_with(prefetch_pngs, mocker.ANY, 1, DEFAULT_IMAGE_OPTIONS)
+    else:
+        assert mock_submit.called is False
+
+
+def test_view_letter_template_png_does_not_prefetch_if_page_was_cached(
+    app,
+    view_letter_template,
+    mocked_cache_get,
+    mocker,
+):
+    mocked_cache_get.side_effect = None
+    mocked_cache_get.return_value = BytesIO(b'\x89PNG')
+    mock_submit = mocker.patch.object(app.prefetcher, 'submit')
+
+    with set_config(app, 'PREVIEW_PREFETCH', True):
+        resp = view_letter_template(filetype='png')
+
+    assert resp.status_code == 200
+    resp.close()
+    assert mock_submit.called is False
+
+
+def test_view_letter_template_pdf_does_not_prefetch(app, view_letter_template, mocker):
+    mock_submit = mocker.patch.object(app.prefetcher, 'submit')
+
+    with set_config(app, 'PREVIEW_PREFETCH', True):
+        view_letter_template(filetype='pdf').close()
+
+    assert mock_submit.called is False
+
+
+def test_prefetch_pngs_renders_every_other_page(mocker, preview_post_body):
+    mocker.patch('app.preview.get_html', return_value='<html></html>')
+    mocker.patch('app.preview.get_pdf_metadata_for_html', return_value={'page_count': 10})
+    mocker.patch('app.preview.get_pdf', return_value=BytesIO(multi_page_pdf))
+    mock_get_png = mocker.patch('app.preview.get_png_for_request')
+
+    prefetch_pngs(preview_post_body, 3, DEFAULT_IMAGE_OPTIONS)
+
+    assert [get_png[0] for get_png in mock_get_png.call_args_list] == [
+        (preview_post_body, page_number, DEFAULT_IMAGE_OPTIONS) for page_number in (1, 2, 4, 5, 6, 7, 8, 9, 10)
+    ]
+    assert {get_png[1]['html'] for get_png in mock_get_png.call_args_list} == {'<html></html>'}
+    assert len({id(get_png[1]['pdf']) for get_png in mock_get_png.call_args_list}) == 1
+
+
+def test_prefetch_pngs_does_nothing_for_one_page_letter(mocker, preview_post_body):
+    mocker.patch('app.preview.get_pdf_metadata_for_html', return_value={'page_count': 1})
+    mock_get_pdf = mocker.patch('app.preview.get_pdf')
+    mock_get_png = mocker.patch('app.preview.get_png_for_request')
+
+    prefetch_pngs(preview_post_body, 1, DEFAULT_IMAGE_OPTIONS)
+
+    assert mock_get_pdf.called is False
+    assert mock_get_png.called is False
+
+
+def test_prefetch_pngs_from_precompiled_renders_every_other_page(mocker):
+    mock_get_png = mocker.patch('app.preview.get_png_from_precompiled')
+
+    prefetch_pngs_from_precompiled(multi_page_pdf, 1, True, DEFAULT_IMAGE_OPTIONS)
+
+    assert [get_png[0] for get_png in mock_get_png.call_args_list] == [
+        (multi_page_pdf, page_number, True) for page_number in range(2, 11)
+    ]
+
+
+@pytest.mark.parametrize('resolution, expected_size', [
+    (150, (130, 50)),
+    (75, (65, 25)),
+    (50, (43, 17)),
+])
+def test_notify_tag_cover_scales_with_resolution(resolution, expected_size):
+    assert _notify_tag_cover_size(resolution) == expected_size
+
+
+@freeze_time('2012-12-12')
+@pytest.mark.parametrize('args, expected_mimetype, expected_start, expected_extension', [
+    ({'format': 'jpeg', 'quality': '50'}, 'image/jpeg', b'\xff\xd8', 'page01.q50.jpeg'),
+    ({'format': 'webp'}, 'image/webp', b'RIFF', 'page01.webp'),
+    ({'format': 'png8', 'resolution': '50'}, 'image/png', b'\x89PNG', 'page01.50dpi.palette.png'),
+])
+def test_view_letter_template_png_in_other_formats(
+    client,
+    auth_header,
+    preview_post_body,
+    mocked_cache_set,
+    request_cache_key,
+    args,
+    expected_mimetype,
+    expected_start,
+    expected_extension,
+):
+    resp = client.post(
+        url_for('preview_blueprint.view_letter_template', filetype='png', **args),
+        data=json.dumps(preview_post_body),
+        headers={'Content-type': 'application/json', **auth_header},
+    )
+    client.application.cache.flush()
+
+    assert resp.status_code == 200
+    assert resp.headers['Content-Type'] == expected_mimetype
+    assert resp.get_data().startswith(expected_start)
+    assert mocked_cache_set.call_args_list[-2][0][3] == (
+        'templated/13a0bbf4a494b3329e399d8e19682e8f14f1f7e4.' + expected_extension
+    )
+    assert mocked_cache_set.call_args_list[-1][0][3] == request_cache_key(expected_extension)
+
+
+def test_view_letter_template_png_at_lower_resolution_is_smaller(
+    view_letter_template,
+    client,
+    auth_header,
+    preview_post_body,
+):
+    def png_width(png):
+        # the width is the first field of the IHDR chunk, straight after the signature and chunk header
+        return int.from_bytes(png[16:20], 'big')
+
+    full_size = view_letter_template(filetype='png')
+    thumbnail = client.post(
+        url_for('preview_blueprint.view_letter_template', filetype='png', resolution=50),
+        data=json.dumps(preview_post_body),
+        headers={'Content-type': 'application/json', **auth_header},
+    )
+
+    assert png_width(thumbnail.get_data()) * 3 == pytest.approx(png_width(full_size.get_data()), abs=3)
+
+
+def test_view_letter_template_png_palette_format_has_a_palette(client, auth_header, preview_post_body):
+    resp = client.post(
+        url_for('preview_blueprint.view_letter_template', filetype='png', format='png8'),
+        data=json.dumps(preview_post_body),
+        headers={'Content-type': 'application/json', **auth_header},
+    )
+
+    # colour type, in the IHDR chunk, is 3 for images with a palette
+    assert resp.get_data()[25] == 3
+
+
+@freeze_time('2012-12-12')
+def test_view_letter_template_pages_returns_and_caches_every_page(
+    client,
+    auth_header,
+    preview_post_body,
+    mocked_cache_get,
+    mocked_cache_set,
+):
+    preview_post_body['template']['content'] = 'All work and no play makes Jack a dull boy. ' * 50
+
+    response = client.post(
+        url_for('preview_blueprint.view_letter_template_pages'),
+        data=json.dumps(preview_post_body),
+        headers={
+            'Content-type': 'application/json',
+            **auth_header
+        }
+    )
+
+    assert response.status_code == 200
+    json_response = json.loads(response.get_data(as_text=True))
+    assert json_response['page_count'] == 2
+    assert json_response['mimetype'] == 'image/png'
+    assert set(json_response['pages']) == {'1', '2'}
+    assert all(base64.b64decode(png).startswith(b'\x89PNG') for png in json_response['pages'].values())
+
+    cache_keys = [call[0][3] for call in mocked_cache_set.call_args_list]
+    assert cache_keys[0].endswith('.pdf.json')
+    assert cache_keys[1].endswith('.pdf')
+    assert cache_keys[2].endswith('.page01.png')
+    assert cache_keys[3].endswith('.page02.png')
+
+
+@pytest.mark.parametrize('image_format, expected_mimetype, expected_start', [
+    ('jpeg', 'image/jpeg', b'\xff\xd8\xff'),
+    ('webp', 'image/webp', b'RIFF'),
+])
+def test_view_letter_template_pages_in_other_formats(
+    client,
+    auth_header,
+    preview_post_body,
+    mocked_cache_set,
+    image_format,
+    expected_mimetype,
+    expected_start,
+):
+    response = client.post(
+        url_for('preview_blueprint.view_letter_template_pages', format=image_format),
+        data=json.dumps(preview_post_body),
+        headers={
+            'Content-type': 'application/json',
+            **auth_header
+        }
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    json_response = json.loads(response.get_data(as_text=True))
+    assert json_response['mimetype'] == expected_mimetype
+    assert base64.b64decode(json_response['pages']['1']).startswith(expected_start)
+    assert mocked_cache_set.call_args_list[-1][0][3].endswith('.page01.{}'.format(image_format))
+
+
+@pytest.mark.parametrize('pages, expected_status_code', [
+    ('2', 200),
+    ('3', 400),
+    ('two', 400),
+])
+def test_view_letter_template_pages_with_pages_arg(
+    client,
+    auth_header,
+    preview_post_body,
+    pages,
+    expected_status_code,
+):
+    preview_post_body['template']['content'] = 'All work and no play makes Jack a dull boy. ' * 50
+
+    response = client.post(
+        url_for('preview_blueprint.view_letter_template_pages', pages=pages),
+        data=json.dumps(preview_post_body),
+        headers={
+            'Content-type': 'application/json',
+            **auth_header
+        }
+    )
+
+    assert response.status_code == expected_status_code
+    if expected_status_code == 200:
+        assert list(json.loads(response.get_data(as_text=True))['pages']) == [pages]
+
+
 def test_letter_template_constructed_properly(preview_post_body, view_letter_template):
     with patch('app.preview.LetterPreviewTemplate', __str__=Mock(return_value='foo')) as mock_template:
         resp = view_letter_template()
@@ -293,7 +850,7 @@ def test_date_can_be_passed(view_letter_template, preview_post_body):
 
     preview_post_body['date'] = '2012-12-12T00:00:00'
 
-    with patch('app.preview.HTML', wraps=HTML) as mock_html:
+    with patch('app.rendering.HTML', wraps=HTML) as mock_html:
         resp = view_letter_template(data=preview_post_body)
 
     assert resp.status_code == 200
@@ -335,18 +892,31 @@ def test_page_count(
     assert json.loads(response.get_data(as_text=True)) == {'count': expected_pages}
 
 
+@pytest.mark.parametrize('pdf, expected_page_count', [
+    (valid_letter, 1),
+    (multi_page_pdf, 10),
+])
+def test_get_page_count_does_not_rasterise_the_letter(mocker, pdf, expected_page_count):
+    mocker.patch('app.preview.Image', side_effect=AssertionError('Should not rasterise to count pages'))
+
+    assert get_page_count(pdf) == expected_page_count
+
+
 @freeze_time('2012-12-12')
-def test_page_count_from_cache(
+def test_page_count_from_cached_pdf(
     client,
     auth_header,
     mocker,
-    mocked_cache_get
+    mocked_cache_get,
+    mocked_cache_set,
 ):
     mocked_cache_get.side_effect = [
+        S3ObjectNotFound({}, ''),
         NonIterableIO(multi_page_pdf),
+        S3ObjectNotFound({}, ''),
     ]
     mocker.patch(
-        'app.preview.HTML',
+        'app.preview.letter_html',
         side_effect=AssertionError('Uncached method shouldn’t be called'),
     )
     response = client.post(
@@ -367,10 +937,85 @@ def test_page_count_from_cache(
             **auth_header
         }
     )
-    assert mocked_cache_get.call_args[0][0] == 'test-template-preview-cache'
-    assert mocked_cache_get.call_args[0][1] == 'templated/a78fc88c557d1294d87fea30f504c5c4202ff780.pdf'
+    assert [cache_get[0] for cache_get in mocked_cache_get.call_args_list] == [
+        ('test-template-preview-cache', 'templated/a78fc88c557d1294d87fea30f504c5c4202ff780.pdf.json'),
+        ('test-template-preview-cache', 'templated/a78fc88c557d1294d87fea30f504c5c4202ff780.pdf'),
+        # in case caching the pdf cached its metadata too
+        ('test-template-preview-cache', 'templated/a78fc88c557d1294d87fea30f504c5c4202ff780.pdf.json'),
+    ]
     assert response.status_code == 200
     assert json.loads(response.get_data(as_text=True)) == {'count': 10}
+    # the metadata is cached so next time we don't need the pdf
+    assert mocked_cache_set.call_args[0][3] == 'templated/a78fc88c557d1294d87fea30f504c5c4202ff780.pdf.json'
+    assert json.loads(mocked_cache_set.call_args[0][0].getvalue())['page_count'] == 10
+
+
+def test_page_count_reads_back_metadata_cached_with_the_pdf(
+    client,
+    auth_header,
+    mocker,
+    mocked_cache_get,
+    mocked_cache_set,
+    preview_post_body,
+):
+    cached = {}
+
+    def cache_get(bucket, key):
+        if key not in cached:
+            raise S3ObjectNotFound({}, '')
+        return NonIterableIO(cached[key])
+
+    mocked_cache_set.side_effect = lambda data, region, bucket, key: cached.update({key: data.getvalue()})
+    mocked_cache_get.side_effect = cache_get
+    mock_pdf_metadata_as_file = mocker.patch('app.preview.pdf_metadata_as_file', wraps=pdf_metadata_as_file)
+
+    response = client.post(
+        url_for('preview_blueprint.page_count'),
+        data=json.dumps(preview_post_body),
+        headers={'Content-type': 'application/json', **auth_header},
+    )
+
+    assert response.status_code == 200
+    assert json.loads(response.get_data(as_text=True)) == {'count': 1}
+    assert mock_pdf_metadata_as_file.call_count == 1
+    assert [cache_set[0][3].rsplit('.', 1)[1] for cache_set in mocked_cache_set.call_args_list] == ['json', 'pdf']
+
+
+@freeze_time('2012-12-12')
+def test_page_count_from_cached_metadata(
+    client,
+    auth_header,
+    mocker,
+    mocked_cache_get,
+):
+    mocked_cache_get.side_effect = [
+        NonIterableIO(json.dumps({'page_count': 3}).encode('utf-8')),
+    ]
+    mocker.patch(
+        'app.preview.letter_html',
+        side_effect=AssertionError('Uncached method shouldn’t be called'),
+    )
+    response = client.post(
+        url_for('preview_blueprint.page_count'),
+        data=json.dumps({
+            'letter_contact_block': '123',
+            'template': {
+                'id': str(uuid.uuid4()),
+                'template_type': 'letter',
+                'subject': 'letter subject',
+                'content': ' letter content',
+            },
+            'values': {},
+            'filename': 'hm-government',
+        }),
+        headers={
+            'Content-type': 'application/json',
+            **auth_header
+        }
+    )
+    assert mocked_cache_get.call_count == 1
+    assert response.status_code == 200
+    assert json.loads(response.get_data(as_text=True)) == {'count': 3}
 
 
 @pytest.mark.parametrize('logo', ['hm-government', None])
@@ -384,6 +1029,42 @@ def test_print_letter_returns_200(logo, print_letter_template, preview_post_body
     assert resp.get_data().startswith(b'%PDF-1.')
 
 
+def test_print_letter_caches_pdf_and_page_count(print_letter_template, mocked_cache_get, mocked_cache_set):
+    resp = print_letter_template()
+
+    assert resp.status_code == 200
+    pdf_cache_key = mocked_cache_get.call_args_list[0][0][1]
+    assert pdf_cache_key.startswith('print/')
+    assert pdf_cache_key.endswith('.pdf')
+    assert [cache_set[0][3] for cache_set in mocked_cache_set.call_args_list] == [
+        pdf_cache_key + '.json',
+        pdf_cache_key,
+    ]
+    mocked_cache_set.call_args_list[1][0][0].seek(0)
+    assert mocked_cache_set.call_args_list[1][0][0].read() == resp.get_data()
+    mocked_cache_set.call_args_list[0][0][0].seek(0)
+    assert json.loads(mocked_cache_set.call_args_list[0][0][0].read())['page_count'] == 1
+
+
+def test_print_letter_from_cache_does_not_render(print_letter_template, mocked_cache_get, mocked_cache_set, mocker):
+    mocked_cache_get.side_effect = [
+        NonIterableIO(b'%PDF-1.7 cached'),
+        NonIterableIO(json.dumps({'page_count': 3}).encode('utf-8')),
+    ]
+    mock_write_pdf = mocker.patch('app.preview.write_pdf')
+    mock_convert_pdf_to_cmyk = mocker.patch('app.preview.convert_pdf_to_cmyk')
+
+    resp = print_letter_template()
+
+    assert resp.status_code == 200
+    assert resp.headers['X-pdf-page-count'] == '3'
+    assert resp.get_data() == b'%PDF-1.7 cached'
+    assert [cache_get[0][1].rsplit('.', 1)[1] for cache_get in mocked_cache_get.call_args_list] == ['pdf', 'json']
+    assert mock_write_pdf.called is False
+    assert mock_convert_pdf_to_cmyk.called is False
+    assert mocked_cache_set.called is False
+
+
 def test_returns_502_if_logo_not_found(app, view_letter_template):
     with set_config(app, 'LETTER_LOGO_URL', 'https://not-a-real-website/'):
         response = view_letter_template()
@@ -0,0 +1,45 @@
+import pytest
+from PIL import Image
+
+from app.preview import DEFAULT_IMAGE_OPTIONS, ImageOptions, get_single_page_of_pdf
+from app.rasterisers import RASTERISERS, encode_page
+from tests.pdf_consts import multi_page_pdf
+
+
+@pytest.mark.parametrize('rasteriser', sorted(RASTERISERS))
+@pytest.mark.parametrize('resolution, expected_size', [
+    # A4 is 8.27 by 11.69 inches
+    (150, (1240, 1754)),
+    (50, (413, 585)),
+])
+def test_rasterisers_render_page_at_resolution(rasteriser, resolution, expected_size):
+    image = RASTERISERS[rasteriser](get_single_page_of_pdf(multi_page_pdf, 1), resolution)
+
+    assert image.mode == 'RGB'
+    assert image.size == pytest.approx(expected_size, abs=1)
+
+
+@pytest.mark.parametrize('image_options, expected_format, expected_mode', [
+    (DEFAULT_IMAGE_OPTIONS, 'PNG', 'RGB'),
+    (ImageOptions(resolution=150, image_format='png8', quality=None), 'PNG', 'P'),
+    (ImageOptions(resolution=150, image_format='jpeg', quality=50), 'JPEG', 'RGB'),
+    (ImageOptions(resolution=150, image_format='webp', quality=None), 'WEBP', 'RGB'),
+])
+def test_encode_page(image_options, expected_format, expected_mode):
+    encoded = Image.open(encode_page(Image.new('RGB', (100, 100), 'black'), image_options))
+
+    assert encoded.format == expected_format
+    assert encoded.mode == expected_mode
+
+
+def test_encode_page_covers_top_left_corner():
+    page = Image.new('RGB', (100, 100), 'black')
+
+    encoded = Image.open(encode_page(page, DEFAULT_IMAGE_OPTIONS, cover_size=(20, 10)))
+
+    assert encoded.getpixel((0, 0)) == (255, 255, 255)
+    assert encoded.getpixel((19, 9)) == (255, 255, 255)
+    assert encoded.getpixel((20, 9)) == (0, 0, 0)
+    assert encoded.getpixel((19, 10)) == (0, 0, 0)
+    # the page it was given is left alone
+    assert page.getpixel((0, 0)) == (0, 0, 0)
@@ -0,0 +1,43 @@
+from weasyprint import HTML
+
+from app import rendering
+from app.preview import get_html
+from app.rendering import get_font_config, letter_html, write_pdf
+
+
+def test_get_font_config_is_shared_within_a_process():
+    assert get_font_config() is get_font_config()
+
+
+def test_get_font_config_is_rebuilt_after_a_fork(mocker):
+    font_config = get_font_config()
+    mocker.patch.object(rendering.os, 'getpid', return_value=rendering._font_config_pid + 1)
+
+    assert get_font_config() is not font_config
+
+
+def test_write_pdf_uses_the_shared_font_config(client, mocker):
+    mock_write_pdf = mocker.patch.object(HTML, 'write_pdf', return_value=b'pdf')
+
+    with client.application.test_request_context():
+        assert write_pdf(HTML(string='<html></html>')) == b'pdf'
+
+    mock_write_pdf.assert_called_once_with(font_config=get_font_config())
+
+
+def test_letter_html_fetches_logos_from_the_logo_cache(client, mocker):
+    with open('tests/test_pdfs/hm-government.svg', 'rb') as logo:
+        mock_fetch = mocker.patch.object(
+            client.application.logo_cache, 'fetch', return_value=('image/svg+xml', logo.read())
+        )
+
+    with client.application.test_request_context():
+        write_pdf(letter_html(get_html({
+            'letter_contact_block': '123',
+            'template': {'subject': 'letter subject', 'content': 'letter content'},
+            'values': {},
+            'filename': 'hm-government',
+        })))
+
+    assert mock_fetch.called
+    assert mock_fetch.call_args[0][0].endswith('hm-government.svg')
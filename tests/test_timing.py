@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+from app.celery.tasks import create_pdf_for_templated_letter
+from app.timing import (
+    format_server_timing,
+    format_stage_timings,
+    get_stage_timings,
+    stage,
+    start_stage_timings,
+)
+
+
+def test_stage_adds_up_time_spent_in_each_stage(app):
+    with app.app_context():
+        start_stage_timings()
+        with stage('html'):
+            pass
+        with stage('weasyprint'):
+            pass
+        first_html_time = get_stage_timings()['html']
+        with stage('html'):
+            pass
+
+        assert list(get_stage_timings()) == ['html', 'weasyprint']
+        assert get_stage_timings()['html'] > first_html_time
+
+
+def test_stage_can_decorate_functions(app):
+    @stage('html')
+    def get_html():
+        return 'html'
+
+    with app.app_context():
+        start_stage_timings()
+
+        assert get_html() == 'html'
+        assert get_html.__name__ == 'get_html'
+        assert list(get_stage_timings()) == ['html']
+
+
+def test_stage_times_functions_that_raise(app):
+    with app.app_context():
+        start_stage_timings()
+        try:
+            with stage('ghostscript-cmyk'):
+                raise ValueError()
+        except ValueError:
+            pass
+
+        assert list(get_stage_timings()) == ['ghostscript-cmyk']
+
+
+def test_format_stage_timings():
+    stage_timings = OrderedDict([('html', 0.0031), ('weasyprint', 0.12045)])
+
+    assert format_server_timing(stage_timings) == 'html;dur=3.1, weasyprint;dur=120.5'
+    assert format_stage_timings(stage_timings) == 'html=3.1ms weasyprint=120.5ms'
+
+
+def test_celery_task_logs_and_records_its_stages_when_it_succeeds(app, mocker):
+    mock_logger = mocker.patch.object(app.logger, 'info')
+    mock_timing = mocker.patch.object(app.statsd_client, 'timing')
+    task = create_pdf_for_templated_letter
+    mocker.patch.object(task, 'start', 0)
+    mocker.patch.object(task, 'stage_timings', OrderedDict([('html', 0.002), ('weasyprint', 0.1)]))
+    mocker.patch('app.celery.celery.time.time', return_value=1.5)
+
+    task.on_success(None, 'task-id', [], {})
+
+    mock_logger.assert_called_once_with(
+        'Celery task create-pdf-for-templated-letter took 1.5000, stages: html=2.0ms weasyprint=100.0ms'
+    )
+    mock_timing.assert_any_call('stages.html', 0.002)
+    mock_timing.assert_any_call('stages.weasyprint', 0.1)
@@ -3,8 +3,15 @@ from io import BytesIO
 import pytest
 from weasyprint import HTML
 
-from app.transformation import convert_pdf_to_cmyk, does_pdf_contain_cmyk, does_pdf_contain_rgb
+from app.transformation import (
+    CMYK_GHOSTSCRIPT_ARGS,
+    CMYK_GHOSTSCRIPT_POSTSCRIPT,
+    convert_pdf_to_cmyk,
+    does_pdf_contain_cmyk,
+    does_pdf_contain_rgb,
+)
 
+from tests.conftest import set_config
 from tests.pdf_consts import rgb_image_pdf, cmyk_image_pdf, cmyk_and_rgb_images_in_one_pdf, multi_page_pdf
 
 
@@ -17,6 +24,18 @@ def test_convert_pdf_to_cmyk_outputs_valid_pdf(pdf):
     assert data.read(9) == b'%PDF-1.7\n'
 
 
+def test_convert_pdf_to_cmyk_uses_ghostscript_pool(app, mocker):
+    mock_run = mocker.patch.object(app.ghostscript_pool, 'run', return_value=b'%PDF-1.7\n')
+    mock_popen = mocker.patch('subprocess.Popen')
+
+    with set_config(app, 'GHOSTSCRIPT_POOL', True):
+        data = convert_pdf_to_cmyk(BytesIO(multi_page_pdf))
+
+    assert data.read() == b'%PDF-1.7\n'
+    mock_run.assert_called_once_with(multi_page_pdf, CMYK_GHOSTSCRIPT_ARGS, CMYK_GHOSTSCRIPT_POSTSCRIPT)
+    assert mock_popen.called is False
+
+
 def test_subprocess_fails(client, mocker):
     mock_popen = mocker.patch('subprocess.Popen')
     mock_popen.return_value.returncode = 1
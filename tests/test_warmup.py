@@ -0,0 +1,31 @@
+from reportlab.pdfbase import pdfmetrics
+
+from app.precompiled import FONT
+from app.warmup import warm_up_process, warm_up_worker
+
+
+def test_warm_up_process_registers_fonts(app):
+    warm_up_process(app)
+
+    assert FONT in pdfmetrics.getRegisteredFontNames()
+
+
+def test_warm_up_worker_renders_a_letter(app, mocker, mocked_cache_get, mocked_cache_set):
+    mock_timing = mocker.patch.object(app.statsd_client, 'timing')
+    mock_png_from_pdf = mocker.patch('app.warmup.png_from_pdf')
+
+    warm_up_worker(app)
+
+    assert mock_png_from_pdf.call_args[0][0].startswith(b'%PDF-1.')
+    assert mock_timing.call_args[0][0] == 'gunicorn.worker-warm-up'
+    assert mocked_cache_get.called is False
+    assert mocked_cache_set.called is False
+
+
+def test_warm_up_worker_carries_on_if_it_fails(app, mocker):
+    mocker.patch('app.warmup.write_pdf', side_effect=ValueError('oh no'))
+    mock_logger = mocker.patch.object(app.logger, 'exception')
+
+    warm_up_worker(app)
+
+    mock_logger.assert_called_once_with('Failed to warm up worker')